@@ -1,15 +1,30 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response
 from flask_cors import CORS
 import firebase_admin
-from firebase_admin import credentials, auth, firestore
-import os, re
+from firebase_admin import auth, firestore
+import os, re, json, base64, math
 from dotenv import load_dotenv
 import google.generativeai as genai
 from werkzeug.utils import secure_filename
-import base64
 from datetime import datetime, timezone, timedelta
-from utils.loan_utils import calculate_total_due, check_and_release_documents
+from utils.loan_utils import check_and_release_documents, validate_loan_days
+from utils.loan_dates import to_day, day_to_str
 from utils.lender_logic import register_lender, post_lender_offer, get_lender_offers, fetch_all_borrowers
+from utils.idempotency import IdempotencyStore
+from utils.rate_limit import AdmissionController, RouteClass, LocalBucketBackend, FirestoreBucketBackend, client_identity
+from utils.face_archive import FaceArchiver
+from utils.http_cache import conditional_json, etag_for, init_compression
+from utils.borrower_feed import BorrowerFeed
+from utils.repayment import loan_schedule, amount_owed, repaid_on_time, bulk_schedules
+from utils.repositories import UserRepo, LoanRepo, OfferRepo, instrumentation
+from utils.doc_pool import DocumentPool
+from utils.readiness import Readiness
+from utils import audit_log as audit
+from utils import prompts
+from utils.financial_scoring import FinancialScorer, store_extractions
+from utils.extraction_store import FirestoreExtractionStore, LocalExtractionStore
+from utils.ttl_cache import TTLCache
+from utils.firebase_client import init_firestore
 
 import cloudinary
 import cloudinary.uploader
@@ -21,34 +36,73 @@ from email.mime.text import MIMEText
 
 load_dotenv()
 
-firebase_config = {
-    "type": os.getenv("FIREBASE_TYPE"),
-    "project_id": os.getenv("FIREBASE_PROJECT_ID"),
-    "private_key_id": os.getenv("FIREBASE_PRIVATE_KEY_ID"),
-    "private_key": os.getenv("FIREBASE_PRIVATE_KEY").replace('\\n', '\n'),
-    "client_email": os.getenv("FIREBASE_CLIENT_EMAIL"),
-    "client_id": os.getenv("FIREBASE_CLIENT_ID"),
-    "auth_uri": os.getenv("FIREBASE_AUTH_URI"),
-    "token_uri": os.getenv("FIREBASE_TOKEN_URI"),
-    "auth_provider_x509_cert_url": os.getenv("FIREBASE_AUTH_PROVIDER_X509_CERT_URL"),
-    "client_x509_cert_url": os.getenv("FIREBASE_CLIENT_X509_CERT_URL")
-}
-
-# Firebase setup
-cred = credentials.Certificate(firebase_config)
-firebase_admin.initialize_app(cred)
-db = firestore.client()
+# Firebase setup (emulator when FIRESTORE_EMULATOR_HOST is set)
+db = init_firestore()
+
+# Data access goes through these repositories, which count Firestore reads/writes per request
+users_repo = UserRepo(db)
+loans_repo = LoanRepo(db)
+offers_repo = OfferRepo(db)
 
 
 # Initialize Flask app
 app = Flask(__name__)
-CORS(app)
+CORS(app, expose_headers=["ETag"])
+init_compression(app, min_size=int(os.getenv("COMPRESSION_MIN_BYTES", 1024)))
+instrumentation.init_app(
+    app,
+    read_budget=int(os.getenv("FIRESTORE_READ_BUDGET", 50)),
+    slow_query_ms=float(os.getenv("FIRESTORE_SLOW_QUERY_MS", 500)),
+    enforce=os.getenv("FIRESTORE_ENFORCE_READ_BUDGET") == "1"
+)
+
+# Replays retried POSTs that carry an Idempotency-Key header
+idempotency = IdempotencyStore(db, ttl_seconds=int(os.getenv("IDEMPOTENCY_TTL_SECONDS", 24 * 3600)))
+
+# Shared listener behind the lender borrower list and its SSE stream
+# Each stream holds one gthread thread (Procfile --threads), so streams per worker are capped
+borrower_feed = BorrowerFeed(
+    db,
+    max_streams=int(os.getenv("SSE_MAX_STREAMS", 8)),
+    max_stream_seconds=float(os.getenv("SSE_MAX_STREAM_SECONDS", 300))
+)
+
+# Admission control for routes that call Gemini or send email
+# RATE_LIMIT_BACKEND=firestore shares the per-client buckets across gunicorn workers;
+# concurrency caps are per worker. Clients are keyed by verified ID token or by address
+limiter = AdmissionController(
+    {
+        "vision": RouteClass(rate=0.1, burst=3, max_concurrent=int(os.getenv("VISION_MAX_CONCURRENT", 4)),
+                             max_queue=8, max_wait=20.0),
+        "face": RouteClass(rate=0.1, burst=3, max_concurrent=int(os.getenv("FACE_MAX_CONCURRENT", 4)),
+                           max_queue=8, max_wait=20.0),
+        "otp": RouteClass(rate=1 / 60, burst=3, max_concurrent=8, max_queue=16, max_wait=5.0),
+    },
+    backend=FirestoreBucketBackend(db) if os.getenv("RATE_LIMIT_BACKEND") == "firestore" else LocalBucketBackend(),
+    identity=client_identity(
+        trusted_proxies=int(os.getenv("TRUSTED_PROXY_COUNT") or 0),
+        verify_token=lambda token: verify_token(token)
+    ),
+)
 
 
 # Gemini API setup
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 genai.configure(api_key=GEMINI_API_KEY)
-model = genai.GenerativeModel('gemini-2.5-flash')
+
+# Financial scores memoized per (prompt version, model, normalized extracted text)
+financial_scorer = FinancialScorer(TTLCache(
+    max_entries=int(os.getenv("FINANCIAL_SCORE_CACHE_SIZE", 4096)),
+    ttl_seconds=float(os.getenv("FINANCIAL_SCORE_CACHE_TTL", 7 * 24 * 3600))
+))
+
+# Extracted document text (PII) kept for prompt replay; audit events only carry its id
+extraction_retention_days = int(os.getenv("EXTRACTION_RETENTION_DAYS", 90))
+extraction_store = (
+    FirestoreExtractionStore(db, retention_days=extraction_retention_days)
+    if os.getenv("EXTRACTION_STORE") == "firestore"
+    else LocalExtractionStore(os.getenv("EXTRACTION_STORE_DIR", "extractions"), retention_days=extraction_retention_days)
+)
 
 # Configure Cloudinary
 cloudinary.config(
@@ -56,6 +110,24 @@ cloudinary.config(
     api_key=os.getenv("CLOUDINARY_API_KEY"),
     api_secret=os.getenv("CLOUDINARY_API_SECRET")
 )
+
+# Process pool for image resizing / base64 encoding of uploaded documents
+doc_pool = DocumentPool(
+    max_workers=int(os.getenv("DOC_POOL_WORKERS") or os.cpu_count() or 1),
+    max_dimension=int(os.getenv("DOC_MAX_IMAGE_DIMENSION", 2048))
+)
+
+# Background archival of face-verification images
+face_archiver = FaceArchiver(db, outbox_dir=os.getenv("FACE_OUTBOX_DIR", "face_outbox"))
+
+# Audit trail of state changes, buffered in memory and flushed in batches
+audit_log = audit.AuditLog(
+    audit.FirestoreSink(db) if os.getenv("AUDIT_SINK") == "firestore"
+    else audit.NDJSONSink(os.getenv("AUDIT_LOG_DIR", "audit_logs")),
+    capacity=int(os.getenv("AUDIT_BUFFER_SIZE", 10000)),
+    flush_interval=float(os.getenv("AUDIT_FLUSH_INTERVAL", 2.0)),
+    overflow=os.getenv("AUDIT_OVERFLOW_POLICY", "drop_oldest")
+)
  
 # Helper to verify Firebase ID token
 def verify_token(token):
@@ -90,6 +162,49 @@ def send_email(to_email, otp):
 
 
 
+# Warm-up: open connections and prime caches before the instance reports ready
+def warm_auth_certs():
+    """
+    Fetch the ID-token signing certificates through firebase_admin's own
+    cached session, so the first real verify_id_token doesn't pay for it.
+    The token is well-formed but unsigned: verification downloads the
+    certificates and then rejects it. Only a fetch failure fails the check.
+    """
+    project_id = firebase_admin.get_app().project_id
+    now = int(datetime.now(timezone.utc).timestamp())
+
+    def segment(data):
+        return base64.urlsafe_b64encode(json.dumps(data).encode()).rstrip(b"=").decode()
+
+    token = ".".join([
+        segment({"alg": "RS256", "kid": "warmup", "typ": "JWT"}),
+        segment({"aud": project_id, "iss": f"https://securetoken.google.com/{project_id}",
+                 "sub": "warmup", "iat": now, "exp": now + 3600}),
+        segment("warmup")
+    ])
+    try:
+        auth.verify_id_token(token)
+    except auth.InvalidIdTokenError:
+        pass
+
+def check_smtp():
+    with smtplib.SMTP("smtp.gmail.com", 587, timeout=10) as server:
+        server.starttls()
+        server.login(os.getenv("SMTP_USER"), os.getenv("SMTP_PASS"))
+
+readiness = Readiness()
+readiness.add_check("firestore", lambda: db.collection("gov_records").limit(1).get())
+readiness.add_check("auth_certs", warm_auth_certs)
+readiness.add_check("gemini", lambda: [genai.get_model(f"models/{name}") for name in prompts.active_models()])
+readiness.add_check("cloudinary", lambda: cloudinary.api.ping(), required=False)
+readiness.add_check("smtp", check_smtp, required=False)
+readiness.add_check("pending_loans_cache", lambda: borrower_feed.borrowers(timeout=10) is not None, required=False)
+if os.getenv("WARMUP_ON_START", "1") == "1":
+    readiness.start()
+
+
+
+
                                             # ---- ROUTES ----
 
 # Health check
@@ -97,6 +212,23 @@ def send_email(to_email, otp):
 def home():
     return jsonify({"message": "TrustBridge Backend Running"}), 200
 
+# Liveness: the process is up and serving requests
+@app.route("/healthz")
+def healthz():
+    return jsonify({"status": "ok"}), 200
+
+# Readiness: dependencies are connected and caches are warm
+@app.route("/readyz")
+def readyz():
+    # Instances started with WARMUP_ON_START=0 warm up on the first probe instead
+    readiness.start()
+    ready, checks = readiness.status()
+    return jsonify({
+        "status": "ready" if ready else "warming_up",
+        "checks": checks,
+        "audit_log": audit_log.stats()
+    }), 200 if ready else 503
+
 
 
 # Auth verification (Frontend sends Firebase ID token)
@@ -117,21 +249,22 @@ def auth_verify():
 @app.route("/user/profile/<uid>", methods=["GET", "POST"])
 def user_profile(uid):
     if request.method == "GET":
-        doc = db.collection("users").document(uid).get()
+        doc = users_repo.get(uid)
         if doc.exists:
-            return jsonify(doc.to_dict()), 200
+            return conditional_json(doc.to_dict, etag=etag_for("profile", uid, doc.update_time))
         else:
             return jsonify({"error": "User not found"}), 404
     
     elif request.method == "POST":
         data = request.get_json()
-        db.collection("users").document(uid).set(data, merge=True)
+        users_repo.update_profile(uid, data)
         return jsonify({"status": "profile updated"}), 200
     
 
 
 # Submit a loan request
 @app.route("/loan/request", methods=["POST"])
+@idempotency.idempotent
 def loan_request():
     data = request.get_json()
     
@@ -147,6 +280,15 @@ def loan_request():
             return jsonify({"error": "Amount must be positive"}), 400
     except (ValueError, TypeError):
         return jsonify({"error": "Invalid amount"}), 400
+
+    # Optional repayment terms (defaults: one installment, no interest)
+    try:
+        installments = int(data.get("installments", 1))
+        interest_rate = float(data.get("interest_rate", 0))
+        if installments <= 0 or interest_rate < 0:
+            raise ValueError
+    except (ValueError, TypeError):
+        return jsonify({"error": "Invalid repayment terms"}), 400
     
     uid = data.get("uid")
     loan_data = {
@@ -155,11 +297,15 @@ def loan_request():
         "timestamp": firestore.SERVER_TIMESTAMP,
         "due_date": datetime.now(timezone.utc) + timedelta(days=30),
         "status": "pending",
-        "wallet": data.get("wallet")
+        "wallet": data.get("wallet"),
+        "installments": installments,
+        "interest_rate": interest_rate
     }
     
     try:
-        db.collection("users").document(uid).collection("loans").add(loan_data)
+        _, loan_ref = loans_repo.add(uid, loan_data)
+        audit_log.record(audit.LOAN_REQUESTED, uid, loan_id=loan_ref.id, amount=amount,
+                         installments=installments, interest_rate=interest_rate)
         return jsonify({"status": "loan request submitted"}), 200
     except Exception as e:
         return jsonify({"error": f"Database error: {str(e)}"}), 500
@@ -170,13 +316,24 @@ def loan_request():
 @app.route("/loan/user/<uid>", methods=["GET"])
 def user_loans(uid):
     try:
-        loans = db.collection("users").document(uid).collection("loans").stream()
-        loan_list = []
-        for loan in loans:
-            loan_entry = loan.to_dict()
-            loan_entry["id"] = loan.id
-            loan_list.append(loan_entry)
-        return jsonify(loan_list), 200
+        loans = loans_repo.list_for_user(uid)
+        # ?schedule=1 attaches each loan's repayment schedule, built in one batch
+        with_schedules = request.args.get("schedule") == "1"
+
+        def build_loan_list():
+            loan_list = []
+            for loan in loans:
+                loan_entry = loan.to_dict()
+                loan_entry["id"] = loan.id
+                loan_list.append(loan_entry)
+            if with_schedules:
+                schedules = bulk_schedules((entry["id"], entry) for entry in loan_list)
+                for entry in loan_list:
+                    entry["schedule"] = schedules.get(entry["id"])
+            return loan_list
+
+        etag = etag_for("loans", uid, with_schedules, [(loan.id, loan.update_time) for loan in loans])
+        return conditional_json(build_loan_list, etag=etag)
     except Exception as e:
         return jsonify({"error": f"Failed to fetch loans: {str(e)}"}), 500
     
@@ -186,23 +343,24 @@ def user_loans(uid):
 @app.route("/user/trust-score/<uid>", methods=["GET"])
 def get_trust_score(uid):
     try:
-        user_ref = db.collection("users").document(uid)
-        user_doc = user_ref.get()
+        user_doc = users_repo.get(uid)
         
         if not user_doc.exists:
             return jsonify({"error": "User not found"}), 404
         
-        user_data = user_doc.to_dict()
-        trust_score = user_data.get("trust_score", {
-            "current": 0,
-            "updated_at": None,
-            "history": []
-        })
-        
-        return jsonify({
-            "status": "success",
-            "trust_score": trust_score
-        }), 200
+        def build_response():
+            user_data = user_doc.to_dict()
+            trust_score = user_data.get("trust_score", {
+                "current": 0,
+                "updated_at": None,
+                "history": []
+            })
+            return {
+                "status": "success",
+                "trust_score": trust_score
+            }
+
+        return conditional_json(build_response, etag=etag_for("trust-score", uid, user_doc.update_time))
         
     except Exception as e:
         print(f"Error fetching trust score: {str(e)}")
@@ -217,8 +375,7 @@ def get_trust_score(uid):
 @app.route("/loan/status/<uid>/<loan_id>", methods=["GET"])
 def loan_status(uid: str, loan_id: str):
     try:
-        loan_ref = db.collection("users").document(uid).collection("loans").document(loan_id)
-        loan = loan_ref.get()
+        loan = loans_repo.get(uid, loan_id)
         
         if not loan.exists:
             return jsonify({"error": "Loan not found"}), 404
@@ -232,34 +389,36 @@ def loan_status(uid: str, loan_id: str):
         
         principal = float(loan_data["amount"])
         
-        # Handle timestamp
-        issue_date_dt = loan_data["timestamp"]
-        if isinstance(issue_date_dt, datetime):
-            issue_date = issue_date_dt.astimezone(timezone.utc).strftime("%Y-%m-%d")
-        else:
-            issue_date = issue_date_dt.strftime("%Y-%m-%d")
-        
-        # Handle due_date
-        due_date = loan_data["due_date"]
-        if isinstance(due_date, datetime):
-            due_date = due_date.astimezone(timezone.utc).strftime("%Y-%m-%d")
-        elif isinstance(due_date, str):
-            # If it's already a string, ensure it's in YYYY-MM-DD format
-            due_date = datetime.strptime(due_date, "%Y-%m-%d").strftime("%Y-%m-%d")
-        
-        # Get current date in UTC
-        current_date = datetime.now(timezone.utc).strftime("%Y-%m-%d")
-        
-        total_due = calculate_total_due(principal, issue_date, due_date, current_date)
-        docs_released = check_and_release_documents(db, uid, loan_id, due_date, current_date)
+        # Normalize Firestore timestamps / strings to UTC day numbers once
+        issue_day = to_day(loan_data["timestamp"])
+        due_day = to_day(loan_data["due_date"])
+        current_day = to_day(datetime.now(timezone.utc))
+        validate_loan_days(issue_day, due_day, current_day)
+
+        # Penalty and document release both follow the outstanding balance and the
+        # first unpaid installment; repaid loans owe nothing and keep their documents
+        owed = amount_owed(loan_data, current_day)
+        total_due = owed["total_due"]
+        months_overdue = owed["months_overdue"]
+        docs_released = check_and_release_documents(loans_repo, uid, loan_id, due_day, current_day, months_overdue)
+        if docs_released and not loan_data.get("documents_released"):
+            audit_log.record(audit.DOCUMENTS_RELEASED, uid, loan_id=loan_id, months_overdue=months_overdue)
+
+        # Count an overdue approved loan against the repayment component once
+        if (months_overdue > 0 and loan_data.get("status") == "approved"
+                and not loan_data.get("overdue_recorded")):
+            loans_repo.update(uid, loan_id, {"overdue_recorded": True})
+            users_repo.apply_trust_event_async(uid, "loan_overdue", loan_id=loan_id)
         
         return jsonify({
             "loan_id": loan_id,
             "principal": principal,
             "total_due": total_due,
-            "issue_date": issue_date,
-            "due_date": due_date,
-            "current_date": current_date,
+            "outstanding": owed["outstanding"],
+            "next_due_date": day_to_str(owed["next_due_day"]) if owed["next_due_day"] else None,
+            "issue_date": day_to_str(issue_day),
+            "due_date": day_to_str(due_day),
+            "current_date": day_to_str(current_day),
             "documents_released": docs_released,
             "status": loan_data.get("status", "unknown")
         }), 200
@@ -273,6 +432,67 @@ def loan_status(uid: str, loan_id: str):
 
 
 
+# Repayment schedule and running balance of a loan
+@app.route("/loan/schedule/<loan_id>", methods=["GET"])
+def loan_repayment_schedule(loan_id):
+    uid = request.args.get("uid")
+    if not uid:
+        return jsonify({"error": "uid query parameter is required"}), 400
+    try:
+        loan = loans_repo.get(uid, loan_id)
+        if not loan.exists:
+            return jsonify({"error": "Loan not found"}), 404
+
+        schedule = loan_schedule(loan.to_dict(), datetime.now(timezone.utc))
+        return jsonify({"loan_id": loan_id, **schedule}), 200
+
+    except (ValueError, KeyError) as ve:
+        return jsonify({"error": "Invalid loan data", "details": str(ve)}), 400
+    except Exception as e:
+        print(f"Loan schedule error: {str(e)}")
+        return jsonify({"error": "Failed to build repayment schedule", "details": str(e)}), 500
+
+
+
+# Record a (partial) repayment in the loan's ledger
+@app.route("/loan/repay/<uid>/<loan_id>", methods=["POST"])
+@idempotency.idempotent
+def loan_repay(uid, loan_id):
+    data = request.get_json()
+    try:
+        amount = float(data.get("amount"))
+    except (ValueError, TypeError):
+        return jsonify({"error": "Invalid amount"}), 400
+    if not math.isfinite(amount) or amount <= 0:
+        return jsonify({"error": "Invalid amount"}), 400
+
+    try:
+        loan_data, repayment = loans_repo.record_payment(uid, loan_id, amount, data.get("tx_hash"))
+    except LookupError:
+        return jsonify({"error": "Loan not found"}), 404
+    except ValueError as ve:
+        return jsonify({"error": str(ve)}), 400
+    except Exception as e:
+        print(f"Loan repayment error: {str(e)}")
+        return jsonify({"error": "Failed to record repayment", "details": str(e)}), 500
+
+    audit_log.record(audit.LOAN_REPAYMENT, uid, loan_id=loan_id, amount=amount,
+                     tx_hash=data.get("tx_hash"), outstanding=repayment["outstanding"])
+    if repayment["outstanding"] == 0:
+        # On time means by the last installment's due date, not the first
+        on_time = repaid_on_time(loan_data, datetime.now(timezone.utc))
+        users_repo.apply_trust_event_async(uid, "loan_repaid", loan_id=loan_id, on_time=on_time)
+
+    return jsonify({
+        "loan_id": loan_id,
+        "paid": repayment["paid"],
+        "outstanding": repayment["outstanding"],
+        "installments_paid": repayment["installments_paid"],
+        "status": "repaid" if repayment["outstanding"] == 0 else loan_data.get("status")
+    }), 200
+
+
+
 # Loan approved or rejected
 @app.route("/loan/decision/<uid>/<loan_id>", methods=["POST"])
 def loan_decision(uid, loan_id):
@@ -283,14 +503,15 @@ def loan_decision(uid, loan_id):
         if decision not in ["approved", "rejected"]:
             return jsonify({"error": "Decision must be either 'approved' or 'rejected'"}), 400
         
-        loan_ref = db.collection("users").document(uid).collection("loans").document(loan_id)
-        loan = loan_ref.get()
+        loan = loans_repo.get(uid, loan_id)
         
         if not loan.exists:
             return jsonify({"error": "Loan not found"}), 404
         
         # Update status
-        loan_ref.update({"status": decision})
+        loans_repo.update(uid, loan_id, {"status": decision})
+        audit_log.record(audit.LOAN_DECISION, uid, loan_id=loan_id, decision=decision,
+                         previous_status=loan.to_dict().get("status"))
         
         return jsonify({
             "message": f"Loan {loan_id} has been {decision}"
@@ -319,6 +540,7 @@ def lender_register():
 
 # Post a lender offer
 @app.route("/lender/offer", methods=["POST"])
+@idempotency.idempotent
 def lender_offer():
     data = request.get_json()
     uid = data.get("uid")
@@ -332,6 +554,9 @@ def lender_offer():
     
     result = post_lender_offer(db, uid, offer_data)
     status = 200 if result["status"] == "success" else 500
+    if status == 200:
+        audit_log.record(audit.OFFER_POSTED, uid, amount=offer_data["amount"],
+                         interest_rate=offer_data["interest_rate"])
     return jsonify(result), status
 
 # Get all offers from a lender
@@ -342,21 +567,56 @@ def lender_offers(uid):
         return jsonify(result), 500
     return jsonify(result), 200
 
+# Market-wide view of available capital and interest rates across all lenders
+@app.route("/market/stats", methods=["GET"])
+def market_stats():
+    try:
+        return jsonify(offers_repo.market_stats()), 200
+    except Exception as e:
+        print(f"Error fetching market stats: {str(e)}")
+        return jsonify({"error": "Failed to fetch market stats", "details": str(e)}), 500
+
 @app.route("/lender/borrowers", methods=["GET"])
 def get_borrowers_for_lender():
     try:
-        borrowers = fetch_all_borrowers(db)
-        return jsonify(borrowers), 200
+        # Served from the shared listener; fall back to a full scan if it hasn't synced
+        borrowers = borrower_feed.borrowers(timeout=2.0)
+        if borrowers is None:
+            borrowers = fetch_all_borrowers(db)
+        return conditional_json(borrowers)
     except Exception as e:
         print(f"Error fetching borrowers: {str(e)}")
         return jsonify({"error": "Failed to fetch borrowers", "details": str(e)}), 500
 
+# Live add/update/remove deltas of pending borrowers (server-sent events)
+@app.route("/lender/borrowers/stream", methods=["GET"])
+def stream_borrowers_for_lender():
+    last_event_id = request.headers.get("Last-Event-ID") or request.args.get("last_event_id")
+    if not borrower_feed.ready():
+        stream = None
+        message = "Live borrower feed is unavailable, poll /lender/borrowers instead"
+    else:
+        stream = borrower_feed.open_stream(last_event_id)
+        message = "Too many live streams, poll /lender/borrowers instead"
+    if stream is None:
+        response = jsonify({"error": message})
+        response.status_code = 503
+        response.headers["Retry-After"] = "30"
+        return response
+    return Response(
+        stream,
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 
 
 
 
 
 @app.route("/vision/first-trustscore", methods=["POST"])
+@idempotency.idempotent(share_body=False)
+@limiter.limit("vision")
 def verify_identity_documents():
     try:
         uid = request.form.get("uid")
@@ -375,36 +635,14 @@ def verify_identity_documents():
         allowed_types = {'image/jpeg', 'image/png', 'application/pdf'}
         extracted_results = []
 
-        for file in files:
-            if file.mimetype not in allowed_types:
-                continue
+        # Resize/encode all uploads in parallel in the document pool
+        valid_files = [file for file in files if file.mimetype in allowed_types]
+        prepared = doc_pool.prepare([(file.read(), file.mimetype) for file in valid_files])
+
+        for file, inline_data in zip(valid_files, prepared):
             filename = secure_filename(file.filename)
-            file_bytes = file.read()
-            image_parts = [{
-                "mime_type": file.mimetype,
-                "data": base64.b64encode(file_bytes).decode("utf-8")
-            }]
-            vision_prompt = """
-                You are extracting user identity details from official Indian documents (PAN card, Aadhaar card).
-                Strictly extract:
-                - Full Name
-                - PAN Number (if available)
-                - Aadhaar Number (if available)
-                - Phone Number (if available)
-
-                Output format (plain text):
-                Name: [full name]
-                PAN: [PAN number]
-                Aadhaar: [12-digit number]
-                Phone: [10-digit number]
-
-                If irrelevant or no values found, return only: "Invalid document"
-                """
-            vision_response = model.generate_content(
-                contents=[{"parts": [{"text": vision_prompt}, {"inline_data": image_parts[0]}]}],
-                generation_config={"temperature": 0.0}
-            )
-            extracted_text = vision_response.text.strip() if vision_response.text else "No text extracted"
+            extracted = prompts.generate(prompts.get("identity_extraction"), inline_data=[inline_data])
+            extracted_text = extracted.strip() if extracted else "No text extracted"
             extracted_results.append({
                 "filename": filename,
                 "extracted_text": extracted_text
@@ -439,7 +677,7 @@ def verify_identity_documents():
             pan_verified = True
             pan_verification_message = "PAN bypass code detected."
         else:
-            gov_doc = db.collection("gov_records").document(pan_number).get()
+            gov_doc = users_repo.gov_record(pan_number)
             if not gov_doc.exists:
                 return jsonify({"error": "PAN not found in government records", "pan": pan_number}), 403
 
@@ -490,20 +728,18 @@ def verify_identity_documents():
         identity_trust_score = min(identity_trust_score, 15)
         identity_explanation = " | ".join(explanation_parts)
 
-        # Save to Firestore
-        user_ref = db.collection("users").document(uid)
+        # Save to Firestore (recomputes trust_score.current from all components)
         history_entry = {
             "score": identity_trust_score,
             "reason": f"Identity verification completed. PAN Verified: {pan_verified}, Aadhaar Present: {aadhaar_verified}",
             "date": datetime.now(timezone.utc).isoformat()
         }
-        user_ref.set({
-            'trust_score': {
-                'identity_score': identity_trust_score,
-                'identity_verified_at': firestore.SERVER_TIMESTAMP,
-                'identity_history': [history_entry]
-            }
-        }, merge=True)
+        users_repo.apply_trust_event(uid, "identity_verified", score=identity_trust_score, extra={
+            'identity_verified_at': firestore.SERVER_TIMESTAMP,
+            'identity_history': [history_entry]
+        })
+        audit_log.record(audit.IDENTITY_SCORED, uid, score=identity_trust_score,
+                         pan_verified=pan_verified, aadhaar_verified=aadhaar_verified)
 
         return jsonify({
             "trust_score": identity_trust_score,
@@ -526,6 +762,8 @@ def verify_identity_documents():
 
 
 @app.route("/vision/financial-trustscore", methods=["POST"])
+@idempotency.idempotent(share_body=False)
+@limiter.limit("vision")
 def verify_financial_documents():
     try:
         uid = request.form.get("uid")
@@ -542,51 +780,14 @@ def verify_financial_documents():
         allowed_types = {'image/jpeg', 'image/png', 'application/pdf'}
         extracted_results = []
 
-        for file in files:
-            if file.mimetype not in allowed_types:
-                continue
+        # Resize/encode all uploads in parallel in the document pool
+        valid_files = [file for file in files if file.mimetype in allowed_types]
+        prepared = doc_pool.prepare([(file.read(), file.mimetype) for file in valid_files])
+
+        for file, inline_data in zip(valid_files, prepared):
             filename = secure_filename(file.filename)
-            file_bytes = file.read()
-            image_parts = [{
-                "mime_type": file.mimetype,
-                "data": base64.b64encode(file_bytes).decode("utf-8")
-            }]
-            vision_prompt = """
-                You are analyzing financial documents to evaluate a user's financial reliability.
-                Documents may include:
-                - Income Tax Returns (ITR)
-                - Electricity bills
-                - Gas bills
-                - Rent receipts
-                - Water bills
-                - Phone/Internet bills
-                - Bank statements
-                - Property tax receipts
-                - Insurance premium receipts
-
-                Extract:
-                - Document Type
-                - Amount
-                - Date
-                - Account Holder
-                - Outstanding Due
-                - Payment Consistency (if visible)
-
-                If invalid or irrelevant, respond with: "Invalid financial document"
-
-                Output:
-                Document Type: [type]
-                Amount: [amount]
-                Date: [date]
-                Account Holder: [name]
-                Outstanding Due: [yes/no]
-                Notes: [summary]
-                """
-            vision_response = model.generate_content(
-                contents=[{"parts": [{"text": vision_prompt}, {"inline_data": image_parts[0]}]}],
-                generation_config={"temperature": 0.0}
-            )
-            extracted_text = vision_response.text.strip() if vision_response.text else "No text extracted"
+            extracted = prompts.generate(prompts.get("financial_extraction"), inline_data=[inline_data])
+            extracted_text = extracted.strip() if extracted else "No text extracted"
             extracted_results.append({
                 "filename": filename,
                 "extracted_text": extracted_text
@@ -595,81 +796,29 @@ def verify_financial_documents():
         if not extracted_results:
             return jsonify({"error": "No valid documents processed"}), 400
 
-        combined_data = "\n\n".join([res["extracted_text"] for res in extracted_results])
-
-        # Prepare AI prompt for financial scoring
-        trust_prompt = f"""
-                You are evaluating a user's financial reliability based on their submitted financial documents.
-
-                The documents may include:
-                - Income Tax Returns (ITR)
-                - Electricity bills
-                - Gas bills
-                - Rent receipts
-                - Water bills
-                - Phone/Internet bills
-                - Bank statements
-                - Property tax receipts
-                - Insurance premium receipts
-
-                Scoring Guidelines (0–60):
+        # Memoized: identical extractions under the same prompt version are scored once
+        scoring = financial_scorer.score([res["extracted_text"] for res in extracted_results])
+        financial_score = scoring["score"]
+        financial_explanation = scoring["explanation"]
 
-                - 50–60: User has submitted 3 or more valid and recent documents. Payments are consistent and on time. Documents are clearly legible and contain complete financial and personal information.
-
-                - 30–49: User has submitted 1–2 valid documents. There may be inconsistencies (e.g., partial data, outdated documents, or occasional late payments). Overall moderately reliable.
-
-                - 10–29: Documents are low-quality, outdated, or show irregular payments. Some documents may be hard to read, missing key details, or only partially relevant.
-
-                - 0–9: No valid documents submitted, or all are invalid, irrelevant, or unreadable.
-
-                Instructions:
-                Analyze the user's extracted document data below and assign a trust score between 0 and 60.
-
-                User's document data:
-                {combined_data}
-
-                Respond in the following format (plain text):
-                Score: [number 0–60]  
-                Explanation: [brief explanation of reasoning]
-
-                """
-        trust_response = model.generate_content(trust_prompt, generation_config={"temperature": 0.0})
-        text_response = trust_response.text if trust_response and trust_response.text else ""
-
-        score_match = re.search(r"Score:\s*(\d{1,3})", text_response, re.IGNORECASE)
-        explanation_match = re.search(r"Explanation:\s*(.*)", text_response, re.IGNORECASE | re.DOTALL)
-
-        financial_score = 5
-        financial_explanation = "Score could not be determined from documents."
-
-        if score_match:
-            financial_score = min(60, max(0, int(score_match.group(1))))
-            if explanation_match:
-                financial_explanation = explanation_match.group(1).strip()
-
-        # Fetch identity trust score from Firestore
-        user_ref = db.collection("users").document(uid)
-        identity_data = user_ref.get().to_dict().get("trust_score", {})
-        identity_score = identity_data.get("identity_score", 0)
-
-        # Final trust score = identity + financial
-        total_trust_score = min(100, identity_score + financial_score)
-
-        # Save to Firestore
+        # Save to Firestore; the final trust score combines identity, financial, face and repayment components
         history_entry = {
             "score": financial_score,
             "reason": financial_explanation,
+            "prompt": scoring["prompt"],
             "date": datetime.now(timezone.utc).isoformat()
         }
-        user_ref.set({
-            'trust_score': {
-                'financial_score': financial_score,
-                'financial_verified_at': firestore.SERVER_TIMESTAMP,
-                'financial_history': firestore.ArrayUnion([history_entry]),
-                'current': total_trust_score,
-                'updated_at': firestore.SERVER_TIMESTAMP
-            }
-        }, merge=True)
+        updated_score = users_repo.apply_trust_event(uid, "financial_verified", score=financial_score, extra={
+            'financial_verified_at': firestore.SERVER_TIMESTAMP,
+            'financial_history': firestore.ArrayUnion([history_entry])
+        })
+        identity_score = updated_score.get("identity_score", 0)
+        total_trust_score = updated_score["current"]
+        extraction_id = store_extractions(extraction_store, uid, [res["extracted_text"] for res in extracted_results])
+        audit_log.record(audit.FINANCIAL_SCORED, uid, score=financial_score,
+                         trust_score=total_trust_score, documents=len(extracted_results),
+                         prompt=scoring["prompt"], model=scoring["model"], cached=scoring["cached"],
+                         latency_ms=scoring["latency_ms"], extraction_id=extraction_id)
 
         return jsonify({
             "trust_score": total_trust_score,
@@ -696,6 +845,8 @@ import google.generativeai as genai
 from PIL import Image
 
 @app.route("/face/verify", methods=["POST"])
+@idempotency.idempotent(share_body=False)
+@limiter.limit("face")
 def verify_face_route():
     try:
         if 'live_image' not in request.files or 'doc_image' not in request.files or 'uid' not in request.form:
@@ -709,65 +860,26 @@ def verify_face_route():
         live_bytes = live_file.read()
         doc_bytes = doc_file.read()
 
-        # 2. Upload to Cloudinary (Keep this for your records/database)
-        # Reset file pointers to 0 before uploading because .read() moved them to the end
-        live_file.seek(0)
-        doc_file.seek(0)
-        
-        # Note: We upload the file objects, not the bytes, to Cloudinary
-        live_result = cloudinary.uploader.upload(live_file, folder=f"trustbridge/{uid}/", public_id="live")
-        doc_result = cloudinary.uploader.upload(doc_file, folder=f"trustbridge/{uid}/", public_id="doc")
-        
-        live_url = live_result["secure_url"]
-        doc_url = doc_result["secure_url"]
-        
-        # 3. Store URLs in Firestore
-        db.collection("users").document(uid).set({
-            "face_images": {
-                "live": live_url,
-                "doc": doc_url
-            }
-        }, merge=True)
-        
-        # 4. Prepared inputs for Gemini
-        # We pass the raw bytes we read in Step 1
-        image_parts = [
-            {"mime_type": live_file.mimetype, "data": base64.b64encode(live_bytes).decode("utf-8")},
-            {"mime_type": doc_file.mimetype, "data": base64.b64encode(doc_bytes).decode("utf-8")}
-        ]
-
-        # 5. Construct the Prompt
-        # We ask for a strict JSON response to parse it easily
-        verification_prompt = """
-        You are a strict identity verification AI. 
-        I have provided two images:
-        1. A live selfie of a person.
-        2. An ID document (Passport, Aadhaar, PAN, etc.) containing a photo.
-
-        Task: Compare the face in the live selfie with the face in the ID document.
-        Ignore differences in age, lighting, or hair style, but focus on facial structure (eyes, nose, jawline).
-        
-        Output strictly in this JSON format (no markdown, no extra text):
-        {
-            "match": boolean, 
-            "confidence": number_between_0_and_100,
-            "reason": "short explanation of why they match or do not match"
-        }
-        """
+        # 2. Queue archival to Cloudinary + Firestore in the background
+        # Unchanged images are skipped and failed uploads are retried from the outbox
+        image_urls = face_archiver.submit(uid, {
+            "live": (live_bytes, live_file.mimetype),
+            "doc": (doc_bytes, doc_file.mimetype)
+        })
+        live_url = image_urls["live"]
+        doc_url = image_urls["doc"]
 
-        # 6. Call Gemini
-        # We use Flash because it's faster for vision tasks
-        model = genai.GenerativeModel('gemini-2.5-flash')
-        
-        response = model.generate_content(
-            contents=[{"parts": [{"text": verification_prompt}, {"inline_data": image_parts[0]}, {"inline_data": image_parts[1]}]}],
-            generation_config={"temperature": 0.0, "response_mime_type": "application/json"}
-        )
+        # 3. Prepared inputs for Gemini
+        # The raw bytes from Step 1 are resized/encoded in the document pool
+        image_parts = doc_pool.prepare([(live_bytes, live_file.mimetype), (doc_bytes, doc_file.mimetype)])
+
+        # 4. Call Gemini with the registered face-matching prompt (strict JSON response)
+        response_text = prompts.generate(prompts.get("face_match"), inline_data=image_parts)
 
-        # 7. Parse Response
+        # 5. Parse Response
         try:
             import json
-            result = json.loads(response.text)
+            result = json.loads(response_text)
             
             # Add logic: If confidence is high but match is false (rare), or vice versa
             is_match = result.get("match", False)
@@ -780,7 +892,10 @@ def verify_face_route():
 
         except json.JSONDecodeError:
             # Fallback if Gemini messes up JSON
-            return jsonify({"error": "AI response parsing failed", "raw": response.text}), 500
+            return jsonify({"error": "AI response parsing failed", "raw": response_text}), 500
+
+        users_repo.apply_trust_event_async(uid, "face_verified", match=is_match)
+        audit_log.record(audit.FACE_VERIFIED, uid, match=is_match, confidence=confidence)
 
         return jsonify({
             "match": is_match,
@@ -798,6 +913,7 @@ def verify_face_route():
 
 
 @app.route("/send-otp", methods=["POST"])
+@limiter.limit("otp")
 def send_otp():
     data = request.get_json()
     email = data.get("email")
@@ -809,6 +925,7 @@ def send_otp():
 
     try:
         send_email(email, otp)
+        audit_log.record(audit.OTP_SENT, email=email)
         return jsonify({"success": True, "message": "OTP sent"})
     except Exception as e:
         print("Email send error:", e)
@@ -824,8 +941,10 @@ def verify_otp():
 
     if otp_store.get(email) == otp:
         del otp_store[email]
+        audit_log.record(audit.OTP_VERIFIED, email=email, success=True)
         return jsonify({"success": True, "message": "OTP verified"})
     else:
+        audit_log.record(audit.OTP_VERIFIED, email=email, success=False)
         return jsonify({"success": False, "message": "Invalid OTP"}), 400
 
 
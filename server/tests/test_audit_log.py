@@ -0,0 +1,30 @@
+import json
+
+from utils.audit_log import query
+
+
+def write_events(directory, timestamps):
+    with open(directory / "audit-host-1.ndjson", "w", encoding="utf-8") as f:
+        for i, ts in enumerate(timestamps):
+            f.write(json.dumps({"id": str(i), "type": "loan.requested", "uid": "u1", "ts": ts}) + "\n")
+
+
+def test_date_only_bounds_cover_the_whole_day(tmp_path):
+    write_events(tmp_path, [
+        "2025-01-30T23:59:59.999999+00:00",
+        "2025-01-31T00:00:00+00:00",
+        "2025-01-31T23:59:59.999999+00:00",
+        "2025-02-01T00:00:00+00:00",
+    ])
+    events = query(str(tmp_path), since="2025-01-31", until="2025-01-31")
+    assert [event["id"] for event in events] == ["1", "2"]
+
+
+def test_timestamp_until_is_inclusive_at_its_precision(tmp_path):
+    write_events(tmp_path, [
+        "2025-01-31T12:00:00.5+00:00",
+        "2025-01-31T12:00:59+00:00",
+        "2025-01-31T12:01:00+00:00",
+    ])
+    assert [event["id"] for event in query(str(tmp_path), until="2025-01-31T12:00")] == ["0", "1"]
+    assert [event["id"] for event in query(str(tmp_path), until="2025-01-31T12:00:00")] == ["0"]
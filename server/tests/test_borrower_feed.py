@@ -0,0 +1,147 @@
+import time
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+from utils.borrower_feed import BorrowerFeed
+
+T0 = datetime(2025, 3, 1, 12, 0, tzinfo=timezone.utc)
+
+
+def change(kind, uid, loan_id, amount=100):
+    reference = SimpleNamespace(parent=SimpleNamespace(parent=SimpleNamespace(id=uid)))
+    document = SimpleNamespace(id=loan_id, reference=reference,
+                               to_dict=lambda: {"amount": amount, "status": "pending"})
+    return SimpleNamespace(type=SimpleNamespace(name=kind), document=document)
+
+
+class FakeWatch:
+    def __init__(self):
+        self.is_active = True
+
+
+class FakeDb:
+    """Firestore stand-in whose collection-group query records the listeners attached to it."""
+
+    def __init__(self):
+        self.watches = []
+
+    def collection_group(self, name):
+        return self
+
+    def where(self, *args):
+        return self
+
+    def on_snapshot(self, callback):
+        self.watches.append(FakeWatch())
+        return self.watches[-1]
+
+
+def worker(**kwargs):
+    # A feed whose listener is attached but has not delivered a snapshot yet
+    feed = BorrowerFeed(db=FakeDb(), heartbeat_interval=0.01, max_stream_seconds=0.05, **kwargs)
+    feed.start()
+    return feed
+
+
+def frames(feed, last_event_id=None):
+    stream = feed.open_stream(last_event_id)
+    try:
+        return [frame for frame in stream if frame.startswith("id:")]
+    finally:
+        stream.close()
+
+
+def ids_and_types(frames_):
+    return [(f.split("\n")[0][4:], f.split("\n")[1][7:]) for f in frames_]
+
+
+def test_ids_come_from_read_time_and_agree_across_workers():
+    a, b = worker(), worker()
+    for feed in (a, b):
+        feed._on_snapshot([], [change("ADDED", "u1", "l1")], T0)
+        feed._on_snapshot([], [change("MODIFIED", "u1", "l1", 200), change("ADDED", "u2", "l2")],
+                          T0 + timedelta(seconds=1))
+    expected = [(f"{int((T0 + timedelta(seconds=1)).timestamp() * 1_000_000)}-{i}", kind)
+                for i, kind in enumerate(["update", "add"])]
+    assert [event[1:3] for event in a._events][1:] == expected
+    assert [event[1:3] for event in a._events] == [event[1:3] for event in b._events]
+
+
+def test_resume_on_another_worker_replays_from_the_read_time():
+    a = worker()
+    b = worker()
+    first = [change("ADDED", "u1", "l1")]
+    second = [change("ADDED", "u2", "l2")]
+    third = [change("REMOVED", "u1", "l1")]
+    a._on_snapshot([], first, T0)
+    a._on_snapshot([], second, T0 + timedelta(seconds=1))
+    last_seen = ids_and_types(frames(a, f"{int(T0.timestamp() * 1_000_000)}-0"))[-1][0]
+
+    # Worker b synced earlier and has seen one more change since
+    b._on_snapshot([], first, T0)
+    b._on_snapshot([], second, T0 + timedelta(seconds=1))
+    b._on_snapshot([], third, T0 + timedelta(seconds=2))
+    replayed = ids_and_types(frames(b, last_seen))
+    assert [kind for _, kind in replayed] == ["add", "remove"]
+
+
+def test_resume_before_the_horizon_gets_a_snapshot():
+    feed = worker(history_size=2)
+    for i in range(4):
+        feed._on_snapshot([], [change("ADDED", f"u{i}", "l")], T0 + timedelta(seconds=i))
+    stale = f"{int(T0.timestamp() * 1_000_000)}-0"
+    assert [kind for _, kind in ids_and_types(frames(feed, stale))] == ["snapshot"]
+    assert [kind for _, kind in ids_and_types(frames(feed, "not-an-id"))] == ["snapshot"]
+
+
+def test_streams_per_worker_are_capped_and_released_on_close():
+    feed = worker(max_streams=2)
+    feed._on_snapshot([], [], T0)
+    first, second = feed.open_stream(), feed.open_stream()
+    assert feed.open_stream() is None
+    # A stream closed before it was ever iterated still gives its slot back
+    first.close()
+    first.close()
+    third = feed.open_stream()
+    assert third is not None
+    second.close()
+    third.close()
+    assert feed._streams == 0
+
+
+def test_unsynced_feed_falls_back_without_waiting_and_never_streams_an_empty_snapshot():
+    feed = worker(sync_timeout=0.0)
+    started = time.monotonic()
+    assert feed.borrowers(timeout=2.0) is None
+    assert not feed.ready(timeout=2.0)
+    assert time.monotonic() - started < 0.5
+    assert frames(feed) == []
+
+
+def test_closed_listener_is_reattached_and_reconciled():
+    feed = worker(restart_interval=0.0)
+    feed._on_snapshot([], [change("ADDED", "u1", "l1"), change("ADDED", "u2", "l2")], T0)
+    assert feed.ready(timeout=0)
+
+    # The RPC fails; until the new listener syncs, callers get the fallback
+    feed.db.watches[0].is_active = False
+    assert not feed.ready(timeout=0)
+    assert len(feed.db.watches) == 2
+
+    # u2's loan stopped being pending while the listener was down
+    survivor = change("ADDED", "u1", "l1").document
+    feed._on_snapshot([survivor], [change("ADDED", "u1", "l1")], T0 + timedelta(seconds=5))
+    assert feed.ready(timeout=0)
+    assert [event[2] for event in feed._events][-2:] == ["remove", "update"]
+    assert [entry["uid"] for entry in feed.borrowers(timeout=0)] == ["u1"]
+
+
+def test_streams_end_when_the_listener_is_lost():
+    feed = worker()
+    feed._on_snapshot([], [], T0)
+    stream = feed.open_stream()
+    assert next(stream).startswith("retry:")
+    assert next(stream).startswith("id:")
+    feed.db.watches[0].is_active = False
+    assert list(stream) == []
+    stream.close()
@@ -0,0 +1,31 @@
+import base64
+import io
+import os
+
+from PIL import Image
+
+from utils.doc_pool import DocumentPool
+
+
+def jpeg(width, height):
+    out = io.BytesIO()
+    Image.new("RGB", (width, height), (200, 120, 40)).save(out, format="JPEG")
+    return out.getvalue()
+
+
+def test_pool_returns_the_same_parts_as_inline_and_leaks_no_shared_memory():
+    documents = [(jpeg(3000, 1000), "image/jpeg"), (jpeg(200, 100), "image/jpeg"),
+                 (b"%PDF-1.4\n%%EOF", "application/pdf"), (b"", "image/png"), (b"not an image", "image/png")]
+    before = set(os.listdir("/dev/shm")) if os.path.isdir("/dev/shm") else set()
+    pool = DocumentPool(max_workers=2, max_dimension=1024)
+    try:
+        pooled = pool.prepare(documents)
+    finally:
+        pool.shutdown()
+
+    assert pooled == DocumentPool(max_workers=0, max_dimension=1024).prepare(documents)
+    with Image.open(io.BytesIO(base64.b64decode(pooled[0]["data"]))) as resized:
+        assert max(resized.size) == 1024
+    assert pooled[2]["data"] == base64.b64encode(documents[2][0]).decode("ascii")
+    if os.path.isdir("/dev/shm"):
+        assert set(os.listdir("/dev/shm")) - before == set()
@@ -0,0 +1,58 @@
+import hashlib
+import os
+import time
+
+import cloudinary
+import cloudinary.uploader
+import pytest
+
+from utils.face_archive import FaceArchiver, outbox_entry_id
+
+
+class MissingUserDb:
+    """Firestore stand-in where no user has archived images yet."""
+
+    def collection(self, name):
+        return self
+
+    def document(self, doc_id):
+        return self
+
+    def get(self):
+        return type("Snapshot", (), {"exists": False})()
+
+
+def failing_upload(*args, **kwargs):
+    raise OSError("Cloudinary unreachable")
+
+
+@pytest.fixture
+def offline_cloudinary(monkeypatch):
+    cloudinary.config(cloud_name="test")
+    monkeypatch.setattr(cloudinary.uploader, "upload", failing_upload)
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_outbox_names_do_not_come_from_the_uid(tmp_path, offline_cloudinary):
+    outbox = tmp_path / "outbox"
+    archiver = FaceArchiver(MissingUserDb(), str(outbox), max_attempts=8, retry_interval=3600)
+    archiver.submit("../escaped", {"live": (b"attacker bytes", "image/png")})
+    assert wait_for(lambda: not archiver._pending)
+
+    entry_id = outbox_entry_id("../escaped", "live", hashlib.sha256(b"attacker bytes").hexdigest())
+    assert sorted(os.listdir(outbox)) == [f"{entry_id}.bin", f"{entry_id}.json"]
+    assert not list(tmp_path.glob("escaped*"))
+
+
+def test_entries_are_deleted_after_max_attempts(tmp_path, offline_cloudinary):
+    outbox = tmp_path / "outbox"
+    archiver = FaceArchiver(MissingUserDb(), str(outbox), max_attempts=1, retry_interval=3600)
+    archiver.submit("u1", {"live": (b"face", "image/png")})
+
+    assert wait_for(lambda: not archiver._pending and not os.listdir(outbox))
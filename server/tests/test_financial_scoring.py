@@ -0,0 +1,74 @@
+import os
+import stat
+import time
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+from utils import audit_log as audit
+from utils import prompts
+from utils.extraction_store import FirestoreExtractionStore, LocalExtractionStore
+from utils.financial_scoring import evaluate, load_extractions, store_extractions
+
+TEXTS = ["Document Type: Bank statement\nAccount Holder: Asha Rao", "Electricity  bill"]
+
+
+def test_audit_events_reference_extractions_without_the_text(tmp_path):
+    store = LocalExtractionStore(str(tmp_path / "extractions"))
+    log = audit.AuditLog(audit.NDJSONSink(str(tmp_path / "audit")), flush_interval=0.05)
+    record_id = store_extractions(store, "u1", TEXTS)
+    log.record(audit.FINANCIAL_SCORED, "u1", score=40, prompt="financial_score@v1", extraction_id=record_id)
+    expired_id = store_extractions(LocalExtractionStore(str(tmp_path / "extractions"), retention_days=0), "u2", ["old"])
+    log.record(audit.FINANCIAL_SCORED, "u2", score=10, prompt="financial_score@v1", extraction_id=expired_id)
+    log.record(audit.FINANCIAL_SCORED, "u3", score=10, prompt="financial_score@v1", extraction_id="missing")
+    log.close()
+
+    with open(log.sink.path, encoding="utf-8") as f:
+        assert "Asha Rao" not in f.read()
+    assert stat.S_IMODE(os.stat(tmp_path / "extractions").st_mode) == 0o700
+    assert stat.S_IMODE(os.stat(tmp_path / "extractions" / f"{record_id}.json").st_mode) == 0o600
+
+    records = load_extractions(store, str(tmp_path / "audit"))
+    assert [(record["uid"], record["extractions"]) for record in records] == [("u1", TEXTS)]
+    # Reading an expired record also deletes it
+    assert not (tmp_path / "extractions" / f"{expired_id}.json").exists()
+    report = evaluate(records, prompts.get("financial_score"),
+                      generate=lambda prompt, **fields: "Score: 42\nExplanation: ok")
+    assert report["drift"]["mean"] == 2.0
+
+
+def test_failed_store_write_returns_no_reference():
+    class Broken:
+        def put(self, *args):
+            raise OSError("disk full")
+
+    assert store_extractions(Broken(), "u1", TEXTS) is None
+
+
+def test_local_store_purges_records_past_retention(tmp_path):
+    store = LocalExtractionStore(str(tmp_path), retention_days=30)
+    store.put("old", "u1", TEXTS)
+    store.put("new", "u1", TEXTS)
+    month_ago = time.time() - 31 * 86400
+    os.utime(tmp_path / "old.json", (month_ago, month_ago))
+
+    assert store.purge() == 1
+    assert sorted(os.listdir(tmp_path)) == ["new.json"]
+
+
+def test_firestore_store_ignores_records_that_ttl_has_not_deleted_yet():
+    now = datetime.now(timezone.utc)
+    documents = {"stale": {"uid": "u1", "extractions": TEXTS, "expires_at": now - timedelta(days=1)},
+                 "fresh": {"uid": "u1", "extractions": TEXTS, "expires_at": now + timedelta(days=1)}}
+
+    class Db:
+        def collection(self, name):
+            return self
+
+        def document(self, record_id):
+            data = documents.get(record_id)
+            return SimpleNamespace(get=lambda: SimpleNamespace(exists=data is not None, to_dict=lambda: data))
+
+    store = FirestoreExtractionStore(Db())
+    assert store.get("stale") is None
+    assert store.get("fresh")["extractions"] == TEXTS
+    assert store.get("missing") is None
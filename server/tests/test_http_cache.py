@@ -0,0 +1,104 @@
+import gzip
+import json
+from types import SimpleNamespace
+
+import pytest
+from flask import Flask, jsonify
+
+from utils import http_cache
+from utils.http_cache import conditional_json, etag_for, init_compression
+
+ETAG = etag_for("loans", "u1", [("l1", 1)])
+LARGE = {"loans": [{"id": f"l{i}", "purpose": "inventory"} for i in range(100)]}
+
+
+@pytest.fixture
+def client():
+    app = Flask(__name__)
+    init_compression(app, min_size=512)
+    builds = []
+
+    def build():
+        builds.append(1)
+        return LARGE
+
+    @app.route("/loans")
+    def loans():
+        return conditional_json(build, etag=ETAG)
+
+    @app.route("/derived")
+    def derived():
+        return conditional_json({"ok": True})
+
+    @app.route("/small")
+    def small():
+        return conditional_json({"ok": True}, etag=ETAG)
+
+    @app.route("/missing")
+    def missing():
+        return jsonify({"error": "x" * 2048}), 404
+
+    @app.route("/text")
+    def text():
+        return "x" * 2048, 200, {"Content-Type": "image/svg+xml"}
+
+    app.builds = builds
+    return app.test_client()
+
+
+def test_matching_if_none_match_is_304_without_building_the_body(client):
+    first = client.get("/loans")
+    assert first.status_code == 200 and first.get_json() == LARGE
+    assert first.headers["ETag"] == f'"{ETAG}"'
+    assert first.headers["Cache-Control"] == "no-cache"
+
+    again = client.get("/loans", headers={"If-None-Match": first.headers["ETag"]})
+    assert again.status_code == 304
+    assert again.data == b""
+    assert again.headers["ETag"] == f'"{ETAG}"'
+    assert len(client.application.builds) == 1
+
+    stale = client.get("/loans", headers={"If-None-Match": '"something-else"'})
+    assert stale.status_code == 200
+    assert client.get("/loans", headers={"If-None-Match": "*"}).status_code == 304
+
+
+def test_etag_derived_from_the_body_is_honoured(client):
+    etag = client.get("/derived").headers["ETag"]
+    assert client.get("/derived", headers={"If-None-Match": etag}).status_code == 304
+
+
+@pytest.mark.parametrize("encoding", ["gzip", "br"])
+def test_encoded_etags_revalidate(client, monkeypatch, encoding):
+    monkeypatch.setattr(http_cache, "brotli", SimpleNamespace(compress=lambda body, quality: b"br:" + body))
+    first = client.get("/loans", headers={"Accept-Encoding": encoding})
+    assert first.headers["Content-Encoding"] == encoding
+    assert first.headers["ETag"] == f'"{ETAG}-{encoding}"'
+
+    again = client.get("/loans", headers={"Accept-Encoding": encoding, "If-None-Match": first.headers["ETag"]})
+    assert again.status_code == 304
+    assert again.headers["ETag"] == first.headers["ETag"]
+    # The same tag is still fresh when the client stops asking for compression
+    assert client.get("/loans", headers={"If-None-Match": first.headers["ETag"]}).status_code == 304
+
+
+def test_gzip_is_used_when_brotli_is_not_installed(client, monkeypatch):
+    monkeypatch.setattr(http_cache, "brotli", None)
+    response = client.get("/loans", headers={"Accept-Encoding": "br, gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert "Accept-Encoding" in response.headers["Vary"]
+    assert json.loads(gzip.decompress(response.data)) == LARGE
+
+
+def test_only_large_successful_compressible_responses_are_compressed(client, monkeypatch):
+    monkeypatch.setattr(http_cache, "brotli", None)
+    gzip_only = {"Accept-Encoding": "gzip"}
+    # Below min_size
+    small = client.get("/small", headers=gzip_only)
+    assert "Content-Encoding" not in small.headers
+    assert small.headers["ETag"] == f'"{ETAG}"'
+    # Errors, other content types and clients that do not accept an encoding
+    assert "Content-Encoding" not in client.get("/missing", headers=gzip_only).headers
+    assert "Content-Encoding" not in client.get("/text", headers=gzip_only).headers
+    assert "Content-Encoding" not in client.get("/loans", headers={"Accept-Encoding": "identity"}).headers
+    assert client.get("/loans", headers=gzip_only).headers["Content-Encoding"] == "gzip"
@@ -0,0 +1,198 @@
+import io
+import threading
+import time
+
+import pytest
+from flask import Flask, jsonify, request
+
+from utils.idempotency import IdempotencyStore
+
+KEY = {"Idempotency-Key": "key-1"}
+
+
+@pytest.fixture
+def client():
+    store = IdempotencyStore(None)
+    app = Flask(__name__)
+    calls = []
+
+    @app.route("/json", methods=["POST"])
+    @store.idempotent
+    def json_route():
+        calls.append(request.get_json())
+        return jsonify({"call": len(calls), "uid": request.get_json()["uid"]})
+
+    @app.route("/form", methods=["POST"])
+    @store.idempotent
+    def form_route():
+        calls.append(request.files["document"].read())
+        return jsonify({"call": len(calls), "uid": request.form["uid"]})
+
+    @app.route("/limited", methods=["POST"])
+    @store.idempotent
+    def limited_route():
+        calls.append(None)
+        return jsonify({"error": "Rate limit exceeded"}), 429
+
+    app.calls = calls
+    return app.test_client()
+
+
+def upload(uid, data):
+    return {"uid": uid, "document": (io.BytesIO(data), "doc.png", "image/png")}
+
+
+def test_retry_with_same_body_is_replayed(client):
+    first = client.post("/json", json={"uid": "a", "amount": 1}, headers=KEY)
+    retry = client.post("/json", json={"amount": 1, "uid": "a"}, headers=KEY)
+    assert retry.get_json() == first.get_json()
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert len(client.application.calls) == 1
+
+
+def test_key_is_scoped_to_the_caller(client):
+    client.post("/json", json={"uid": "a", "amount": 1}, headers=KEY)
+    other = client.post("/json", json={"uid": "b", "amount": 1}, headers=KEY)
+    assert other.get_json() == {"call": 2, "uid": "b"}
+    assert "Idempotent-Replayed" not in other.headers
+
+
+def test_reused_key_with_different_body_is_rejected(client):
+    client.post("/json", json={"uid": "a", "amount": 1}, headers=KEY)
+    assert client.post("/json", json={"uid": "a", "amount": 2}, headers=KEY).status_code == 422
+
+
+def test_multipart_uploads_are_fingerprinted_by_content(client):
+    first = client.post("/form", data=upload("a", b"image"), headers=KEY)
+    retry = client.post("/form", data=upload("a", b"image"), headers=KEY)
+    assert retry.get_json() == first.get_json()
+    assert client.application.calls == [b"image"]
+    assert client.post("/form", data=upload("a", b"other"), headers=KEY).status_code == 422
+
+
+def test_rate_limited_response_is_not_replayed(client):
+    assert client.post("/limited", json={"uid": "a"}, headers=KEY).status_code == 429
+    retry = client.post("/limited", json={"uid": "a"}, headers=KEY)
+    assert "Idempotent-Replayed" not in retry.headers
+    assert len(client.application.calls) == 2
+
+
+def concurrent_app(store, outcomes):
+    """A route that blocks until released and answers with the next queued outcome."""
+    app = Flask(__name__)
+    app.started = threading.Event()
+    app.release = threading.Event()
+    app.calls = []
+
+    @app.route("/slow", methods=["POST"])
+    @store.idempotent
+    def slow_route():
+        app.calls.append(None)
+        app.started.set()
+        app.release.wait(5)
+        body, status = outcomes[len(app.calls) - 1]
+        return jsonify(body), status
+
+    return app
+
+
+def post_in_thread(app, results):
+    def run():
+        with app.test_client() as client:
+            results.append(client.post("/slow", json={"uid": "a"}, headers=KEY))
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread
+
+
+def test_concurrent_duplicate_waits_for_the_original():
+    app = concurrent_app(IdempotencyStore(None), [({"loan": "l1"}, 201)])
+    results = []
+    first = post_in_thread(app, results)
+    assert app.started.wait(5)
+    second = post_in_thread(app, results)
+    time.sleep(0.1)
+    app.release.set()
+    first.join(5)
+    second.join(5)
+
+    assert len(app.calls) == 1
+    assert sorted(r.status_code for r in results) == [201, 201]
+    assert [r.get_json() for r in results] == [{"loan": "l1"}, {"loan": "l1"}]
+    assert sum(r.headers.get("Idempotent-Replayed") == "true" for r in results) == 1
+
+
+def test_waiter_runs_the_request_when_the_original_failed():
+    app = concurrent_app(IdempotencyStore(None), [({"error": "boom"}, 500), ({"loan": "l1"}, 201)])
+    results = []
+    first = post_in_thread(app, results)
+    assert app.started.wait(5)
+    second = post_in_thread(app, results)
+    time.sleep(0.1)
+    app.release.set()
+    first.join(5)
+    second.join(5)
+
+    assert len(app.calls) == 2
+    assert sorted(r.status_code for r in results) == [201, 500]
+
+
+def test_waiter_gives_up_with_409_while_the_original_is_still_running():
+    app = concurrent_app(IdempotencyStore(None, wait_timeout=0.05), [({"loan": "l1"}, 201)])
+    results = []
+    first = post_in_thread(app, results)
+    assert app.started.wait(5)
+    with app.test_client() as client:
+        assert client.post("/slow", json={"uid": "a"}, headers=KEY).status_code == 409
+    app.release.set()
+    first.join(5)
+
+
+class KeyCollection:
+    """In-memory stand-in for the idempotency_keys collection."""
+
+    def __init__(self):
+        self.docs = {}
+
+    def collection(self, name):
+        return self
+
+    def document(self, doc_id):
+        docs = self.docs
+
+        class Ref:
+            def create(self, data):
+                docs[doc_id] = dict(data)
+
+            def set(self, data, merge=False):
+                docs[doc_id] = {**docs.get(doc_id, {}), **data} if merge else dict(data)
+
+            def delete(self):
+                docs.pop(doc_id, None)
+
+        return Ref()
+
+
+def test_private_routes_keep_no_body_in_the_shared_tier():
+    db = KeyCollection()
+    store = IdempotencyStore(db)
+    app = Flask(__name__)
+
+    @app.route("/identity", methods=["POST"])
+    @store.idempotent(share_body=False)
+    def identity_route():
+        return jsonify({"aadhaar_number": "123412341234"})
+
+    @app.route("/offer", methods=["POST"])
+    @store.idempotent
+    def offer_route():
+        return jsonify({"offer": "o1"})
+
+    client = app.test_client()
+    assert client.post("/identity", json={"uid": "a"}, headers=KEY).status_code == 200
+    assert db.docs == {}
+    replay = client.post("/identity", json={"uid": "a"}, headers=KEY)
+    assert replay.headers["Idempotent-Replayed"] == "true"
+
+    client.post("/offer", json={"uid": "a"}, headers=KEY)
+    assert [doc["state"] for doc in db.docs.values()] == ["completed"]
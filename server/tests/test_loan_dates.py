@@ -0,0 +1,110 @@
+from datetime import date, datetime, timedelta, timezone
+
+import pytest
+from dateutil.relativedelta import relativedelta
+from google.api_core.datetime_helpers import DatetimeWithNanoseconds
+
+from utils.loan_dates import add_months, day_to_str, overdue_months, to_day
+from utils.loan_utils import calculate_total_due
+
+IST = timezone(timedelta(hours=5, minutes=30))
+PST = timezone(timedelta(hours=-8))
+
+
+def day(text):
+    return date.fromisoformat(text).toordinal()
+
+
+def reference_overdue_months(due, current):
+    """The original relativedelta rule."""
+    if current <= due:
+        return 0
+    delta = relativedelta(current, due)
+    return delta.years * 12 + delta.months + (1 if delta.days > 0 else 0)
+
+
+@pytest.mark.parametrize("value, expected", [
+    # Just after midnight in India is still the previous day in UTC
+    (datetime(2025, 3, 1, 0, 30, tzinfo=IST), "2025-02-28"),
+    (datetime(2025, 3, 1, 5, 30, tzinfo=IST), "2025-03-01"),
+    # Late evening on the US west coast is already the next day in UTC
+    (datetime(2025, 3, 1, 23, 30, tzinfo=PST), "2025-03-02"),
+    (datetime(2024, 12, 31, 16, 0, tzinfo=PST), "2025-01-01"),
+    # Naive datetimes and strings are taken as UTC
+    (datetime(2025, 3, 1, 23, 59, 59), "2025-03-01"),
+    (datetime(2025, 3, 1, 0, 0), "2025-03-01"),
+    ("2024-02-29", "2024-02-29"),
+    (date(2025, 3, 1), "2025-03-01"),
+])
+def test_to_day_normalizes_to_utc_calendar_day(value, expected):
+    assert day_to_str(to_day(value)) == expected
+
+
+def test_to_day_accepts_firestore_timestamps():
+    stamp = DatetimeWithNanoseconds(2025, 1, 31, 23, 59, 59, nanosecond=999999999, tzinfo=timezone.utc)
+    assert day_to_str(to_day(stamp)) == "2025-01-31"
+    shifted = DatetimeWithNanoseconds(2025, 2, 1, 1, 0, tzinfo=IST)
+    assert day_to_str(to_day(shifted)) == "2025-01-31"
+
+
+def test_to_day_passes_day_numbers_through():
+    assert to_day(day("2025-03-01")) == day("2025-03-01")
+
+
+@pytest.mark.parametrize("value", [
+    "2025-02-30", "2023-02-29", "2025-13-01", "2025/01/01", "25-01-01", "2025-1-1",
+    " 2025-01-01", "2025-01-01T00:00:00", "", "not a date", None, 3.5, True,
+])
+def test_malformed_dates_raise_value_error(value):
+    with pytest.raises(ValueError):
+        to_day(value)
+
+
+def test_calculate_total_due_rejects_malformed_strings():
+    with pytest.raises(ValueError):
+        calculate_total_due(1000, "2025-01-01", "2025-02-30", "2025-03-01")
+
+
+@pytest.mark.parametrize("start, months, expected", [
+    ("2024-01-31", 1, "2024-02-29"),
+    ("2025-01-31", 1, "2025-02-28"),
+    ("2024-02-29", 12, "2025-02-28"),
+    ("2024-02-29", 48, "2028-02-29"),
+    ("2025-08-31", 1, "2025-09-30"),
+    ("2025-12-15", 1, "2026-01-15"),
+    ("2025-03-31", -1, "2025-02-28"),
+])
+def test_add_months_clamps_to_month_end(start, months, expected):
+    assert day_to_str(add_months(day(start), months)) == expected
+    reference = date.fromisoformat(start) + relativedelta(months=months)
+    assert day_to_str(add_months(day(start), months)) == reference.isoformat()
+
+
+@pytest.mark.parametrize("due", [
+    "2024-01-29", "2024-01-30", "2024-01-31", "2024-02-28", "2024-02-29",
+    "2023-01-31", "2023-02-28", "2025-04-30", "2025-05-31", "2025-12-31",
+])
+def test_overdue_months_matches_relativedelta_around_month_ends(due):
+    due_date = date.fromisoformat(due)
+    for offset in range(0, 400):
+        current = due_date + timedelta(days=offset)
+        assert overdue_months(due_date.toordinal(), current.toordinal()) == \
+            reference_overdue_months(due_date, current), current
+
+
+def test_penalty_boundary_uses_utc_day_of_aware_current_time():
+    # 01:00 IST on Feb 1 is still Jan 31 in UTC: due today, not overdue
+    assert calculate_total_due(1000, "2025-01-01", "2025-01-31",
+                               datetime(2025, 2, 1, 1, 0, tzinfo=IST)) == 1000
+    # 17:00 PST on Jan 31 is Feb 1 in UTC: one started month overdue
+    assert calculate_total_due(1000, "2025-01-01", "2025-01-31",
+                               datetime(2025, 1, 31, 17, 0, tzinfo=PST)) == 1050
+
+
+def test_date_order_is_checked_on_utc_days():
+    issued = datetime(2025, 2, 1, 1, 0, tzinfo=timezone.utc)
+    # 15:00 PST on Jan 31 is 23:00 UTC the same day, before the issue day
+    with pytest.raises(ValueError):
+        calculate_total_due(1000, issued, datetime(2025, 1, 31, 15, 0, tzinfo=PST), "2025-03-01")
+    # 23:00 PST on Jan 31 is already Feb 1 in UTC, the issue day itself
+    assert calculate_total_due(1000, issued, datetime(2025, 1, 31, 23, 0, tzinfo=PST), "2025-02-01") == 1000
@@ -0,0 +1,51 @@
+import pytest
+
+from utils.market_stats import OfferBookSketch, offer_increments, parse_offer
+from utils.repositories import OfferRepo
+
+
+@pytest.mark.parametrize("field,value", [("amount", "nan"), ("amount", "inf"), ("interest_rate", "nan"),
+                                         ("interest_rate", "-inf"), ("amount", 0), ("interest_rate", -1)])
+def test_invalid_offers_are_not_parsed(field, value):
+    offer = {"amount": 5000, "interest_rate": 12.5, field: value}
+    assert parse_offer(offer) is None
+    assert offer_increments(offer) is None
+
+
+def test_sketch_summary_of_valid_offers():
+    sketch = OfferBookSketch()
+    for amount, rate in [(500, 10.0), (2000, 12.0), (20000, 14.0)]:
+        sketch.add(*parse_offer({"amount": str(amount), "interest_rate": str(rate)}))
+    summary = sketch.summary()
+    assert summary["offer_count"] == 3
+    assert summary["interest_rate_percentiles"]["p50"] == 12.12
+    assert summary["offers_by_amount"]["<1k"] == 1
+
+
+class RecordingDb:
+    """Firestore stand-in that records batched writes."""
+
+    def __init__(self):
+        self.written = []
+
+    def collection(self, name):
+        return self
+
+    def document(self, doc_id=None):
+        return self
+
+    def batch(self):
+        return self
+
+    def set(self, ref, data, merge=False):
+        self.written.append(data)
+
+    def commit(self):
+        pass
+
+
+def test_offer_is_written_when_folding_into_stats_fails(monkeypatch):
+    db = RecordingDb()
+    monkeypatch.setattr("utils.repositories.offer_increments", lambda offer: 1 / 0)
+    OfferRepo(db).add_offer("lender-1", {"amount": 5000, "interest_rate": 12})
+    assert db.written == [{"amount": 5000, "interest_rate": 12}]
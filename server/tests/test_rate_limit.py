@@ -0,0 +1,226 @@
+import threading
+import time
+
+import pytest
+from flask import Flask, jsonify
+
+from utils.rate_limit import (AdmissionController, ConcurrencyGate, LocalBucketBackend, RouteClass, TokenBucket,
+                              client_identity)
+
+
+class FakeClock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+def wait_until(predicate, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "condition not reached"
+        time.sleep(0.001)
+
+
+def test_token_bucket_allows_burst_then_reports_wait():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=0.5, capacity=2, clock=clock)
+
+    assert bucket.take() == 0
+    assert bucket.take() == 0
+    assert bucket.take() == pytest.approx(2.0)
+
+    clock.advance(1.0)
+    assert bucket.take() == pytest.approx(1.0)
+
+
+def test_token_bucket_refills_up_to_capacity():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=1.0, capacity=3, clock=clock)
+    for _ in range(3):
+        bucket.take()
+
+    clock.advance(2.0)
+    assert bucket.take() == 0
+    assert bucket.take() == 0
+    assert bucket.take() > 0
+
+    # Idle time never accumulates more than `capacity` tokens
+    clock.advance(3600)
+    assert [bucket.take() for _ in range(3)] == [0, 0, 0]
+    assert bucket.take() == pytest.approx(1.0)
+
+
+def test_local_backend_keeps_buckets_per_client():
+    clock = FakeClock()
+    backend = LocalBucketBackend(clock=clock)
+    policy = RouteClass(rate=1.0, burst=1, max_concurrent=1, max_queue=0, max_wait=1.0)
+
+    assert backend.take("a", policy) == 0
+    assert backend.take("a", policy) == pytest.approx(1.0)
+    assert backend.take("b", policy) == 0
+
+
+def test_gate_sheds_when_queue_is_full():
+    gate = ConcurrencyGate(RouteClass(rate=1, burst=1, max_concurrent=1, max_queue=0, max_wait=5.0),
+                           clock=FakeClock())
+    assert gate.acquire() is None
+    assert gate.acquire() == "shed"
+    gate.release()
+    assert gate.acquire() is None
+
+
+def test_gate_times_out_on_injected_clock():
+    clock = FakeClock()
+    gate = ConcurrencyGate(RouteClass(rate=1, burst=1, max_concurrent=1, max_queue=1, max_wait=5.0),
+                           clock=clock, poll_interval=0.01)
+    assert gate.acquire() is None
+
+    outcome = []
+    waiter = threading.Thread(target=lambda: outcome.append(gate.acquire()))
+    waiter.start()
+    wait_until(lambda: gate.waiting == 1)
+
+    clock.advance(4.9)
+    time.sleep(0.05)
+    assert outcome == []
+
+    clock.advance(0.2)
+    waiter.join(2.0)
+    assert outcome == ["timeout"]
+    assert gate.waiting == 0 and gate.active == 1
+
+
+def test_gate_hands_slot_to_waiter_on_release():
+    gate = ConcurrencyGate(RouteClass(rate=1, burst=1, max_concurrent=1, max_queue=1, max_wait=5.0),
+                           clock=FakeClock(), poll_interval=0.01)
+    assert gate.acquire() is None
+
+    outcome = []
+    waiter = threading.Thread(target=lambda: outcome.append(gate.acquire()))
+    waiter.start()
+    wait_until(lambda: gate.waiting == 1)
+    gate.release()
+    waiter.join(2.0)
+    assert outcome == [None]
+    assert gate.active == 1
+
+
+@pytest.fixture
+def limited_app():
+    clock = FakeClock()
+    release = threading.Event()
+    entered = threading.Event()
+    limiter = AdmissionController(
+        {
+            "rated": RouteClass(rate=0.25, burst=2, max_concurrent=4, max_queue=4, max_wait=1.0),
+            "busy": RouteClass(rate=100, burst=100, max_concurrent=1, max_queue=1, max_wait=3.0),
+        },
+        identity=lambda: "client",
+        clock=clock,
+    )
+    limiter._gates["busy"]._poll_interval = 0.01
+
+    app = Flask(__name__)
+
+    @app.route("/rated", methods=["POST"])
+    @limiter.limit("rated")
+    def rated():
+        return jsonify({"ok": True})
+
+    @app.route("/busy", methods=["POST"])
+    @limiter.limit("busy")
+    def busy():
+        entered.set()
+        release.wait(5.0)
+        return jsonify({"ok": True})
+
+    yield app, clock, limiter, entered, release
+    release.set()
+
+
+def test_rate_limited_client_gets_429_with_retry_after(limited_app):
+    app, clock, _, _, _ = limited_app
+    client = app.test_client()
+
+    assert client.post("/rated").status_code == 200
+    assert client.post("/rated").status_code == 200
+    response = client.post("/rated")
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "4"
+    assert response.get_json()["retry_after"] == 4
+
+    clock.advance(2.5)
+    response = client.post("/rated")
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "2"
+
+    clock.advance(1.5)
+    assert client.post("/rated").status_code == 200
+
+
+def test_full_queue_is_shed_with_503_and_expired_wait_is_429(limited_app):
+    app, clock, limiter, entered, release = limited_app
+    gate = limiter._gates["busy"]
+    results = {}
+
+    def call(name):
+        results[name] = app.test_client().post("/busy")
+
+    holder = threading.Thread(target=call, args=("holder",))
+    holder.start()
+    assert entered.wait(2.0)
+
+    queued = threading.Thread(target=call, args=("queued",))
+    queued.start()
+    wait_until(lambda: gate.waiting == 1)
+
+    shed = app.test_client().post("/busy")
+    assert shed.status_code == 503
+    assert shed.headers["Retry-After"] == "3"
+
+    clock.advance(3.5)
+    queued.join(2.0)
+    assert results["queued"].status_code == 429
+    assert results["queued"].headers["Retry-After"] == "3"
+
+    release.set()
+    holder.join(2.0)
+    assert results["holder"].status_code == 200
+
+
+def identity_app(identity):
+    app = Flask(__name__)
+
+    @app.route("/whoami", methods=["POST"])
+    def whoami():
+        return identity()
+
+    return app.test_client()
+
+
+def test_identity_ignores_body_uid_and_untrusted_forwarded_for():
+    client = identity_app(client_identity())
+    response = client.post("/whoami", json={"uid": "rotating-1"}, headers={"X-Forwarded-For": "6.6.6.6"},
+                           environ_base={"REMOTE_ADDR": "10.0.0.9"})
+    assert response.get_data(as_text=True) == "ip:10.0.0.9"
+
+
+def test_identity_takes_the_address_appended_by_the_trusted_proxy():
+    client = identity_app(client_identity(trusted_proxies=1))
+    # The client forged the first entry; the load balancer appended the real address
+    response = client.post("/whoami", headers={"X-Forwarded-For": "6.6.6.6, 203.0.113.7"},
+                           environ_base={"REMOTE_ADDR": "10.0.0.1"})
+    assert response.get_data(as_text=True) == "ip:203.0.113.7"
+
+
+def test_identity_uses_the_verified_token_uid():
+    tokens = {"good-token": "user-1"}
+    client = identity_app(client_identity(verify_token=tokens.get))
+    assert client.post("/whoami", headers={"Authorization": "Bearer good-token"}).get_data(as_text=True) == "uid:user-1"
+    forged = client.post("/whoami", headers={"Authorization": "Bearer forged"}, environ_base={"REMOTE_ADDR": "10.0.0.9"})
+    assert forged.get_data(as_text=True) == "ip:10.0.0.9"
@@ -0,0 +1,175 @@
+import random
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from utils.loan_dates import to_day
+from utils.loan_utils import calculate_total_due
+from utils import repayment
+from utils.repayment import (amortization_schedule, amount_owed, apply_payment, bulk_schedules, initial_snapshot,
+                             loan_schedule)
+
+SEEDS = range(200)
+BASE = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def random_loan(rng, **overrides):
+    issued = BASE + timedelta(days=rng.randint(0, 800), hours=rng.randint(0, 23))
+    loan = {
+        "amount": round(rng.uniform(1, 200000), rng.choice([0, 2])) or 1.0,
+        "interest_rate": rng.choice([0, 0, rng.randint(1, 30), round(rng.uniform(0, 25), 2)]),
+        "installments": rng.choice([1, 1, rng.randint(2, 24)]),
+        "timestamp": issued,
+        "due_date": issued + timedelta(days=30),
+        "status": "approved",
+    }
+    loan.update(overrides)
+    return loan
+
+
+def random_payments(rng, snapshot):
+    """Payments that never exceed the balance, sometimes paying the loan off."""
+    payments = []
+    outstanding = snapshot["outstanding"]
+    for _ in range(rng.randint(0, 8)):
+        if outstanding <= 0:
+            break
+        amount = outstanding if rng.random() < 0.2 else round(rng.uniform(0.01, outstanding), 2)
+        payments.append(amount)
+        outstanding = round(outstanding - amount, 2)
+    return payments
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_schedule_rows_sum_to_total(seed):
+    rng = random.Random(seed)
+    loan = random_loan(rng)
+    schedule = amortization_schedule(loan["amount"], loan["interest_rate"], loan["installments"], loan["due_date"])
+    total = round(loan["amount"] * (1 + loan["interest_rate"] / 100), 2)
+
+    assert len(schedule) == loan["installments"]
+    assert round(sum(row["amount"] for row in schedule), 2) == total
+    assert round(sum(row["principal"] for row in schedule), 2) == round(loan["amount"], 2)
+    assert schedule[-1]["balance"] == 0
+    for row in schedule:
+        assert round(row["principal"] + row["interest"], 2) == row["amount"]
+    dues = [row["due_date"] for row in schedule]
+    assert dues == sorted(dues) and len(set(dues)) == len(dues)
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_bulk_schedules_match_the_scalar_schedule(seed):
+    rng = random.Random(seed)
+    loans = {f"l{i}": random_loan(rng) for i in range(50)}
+    # Loans sharing terms and due dates reuse the same computed rows
+    loans["copy"] = dict(loans["l0"])
+    loans["same-terms"] = {**loans["l1"], "due_date": loans["l1"]["due_date"] + timedelta(days=3)}
+
+    schedules = bulk_schedules(loans.items())
+    assert schedules.keys() == loans.keys()
+    for loan_id, loan in loans.items():
+        assert schedules[loan_id] == amortization_schedule(loan["amount"], loan["interest_rate"],
+                                                           loan["installments"], loan["due_date"])
+
+
+def test_bulk_schedules_compute_shared_terms_once(monkeypatch):
+    calls = []
+    rows = repayment._installment_rows
+    monkeypatch.setattr(repayment, "_installment_rows", lambda *args: calls.append(args) or rows(*args))
+    due = datetime(2025, 1, 31, tzinfo=timezone.utc)
+    loans = [(f"l{i}", {"amount": 1000, "interest_rate": 10, "installments": 3, "due_date": due + timedelta(days=i)})
+             for i in range(100)]
+    loans.append(("other", {"amount": 500, "interest_rate": 10, "installments": 3, "due_date": due}))
+
+    schedules = bulk_schedules(loans)
+    assert len(calls) == 2
+    assert [row["due_date"] for row in schedules["l0"]] == ["2025-01-31", "2025-02-28", "2025-03-31"]
+    # Each loan gets its own rows, not a shared list
+    schedules["l0"][0]["amount"] = 0
+    assert schedules["l1"][0]["amount"] == 366.67
+
+
+def test_bulk_schedules_skip_loans_with_invalid_terms():
+    due = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    loans = [("ok", {"amount": 100, "due_date": due}), ("nan", {"amount": float("nan"), "due_date": due}),
+             ("no-due", {"amount": 100}), ("bad-date", {"amount": 100, "due_date": "01/01/2025"})]
+    assert list(bulk_schedules(loans)) == ["ok"]
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_snapshot_matches_ledger_replay(seed):
+    rng = random.Random(seed)
+    loan = random_loan(rng)
+    snapshot = initial_snapshot(loan)
+    payments = random_payments(rng, snapshot)
+
+    for n, amount in enumerate(payments):
+        snapshot = apply_payment(snapshot, amount, BASE + timedelta(days=n))
+
+    # Replaying the whole ledger gives the same balance as the incremental snapshot
+    paid = round(sum(payments), 2)
+    assert snapshot["entries"] == len(payments)
+    assert snapshot["paid"] == pytest.approx(paid, abs=0.01)
+    assert snapshot["outstanding"] == pytest.approx(max(0.0, snapshot["total"] - paid), abs=0.01)
+
+    # Installments counted as paid are exactly those the schedule says are covered
+    schedule = amortization_schedule(loan["amount"], loan["interest_rate"], loan["installments"], loan["due_date"])
+    covered = sum(1 for row in schedule if snapshot["total"] - row["balance"] <= snapshot["paid"] + 0.005)
+    assert snapshot["installments_paid"] == (loan["installments"] if snapshot["outstanding"] == 0 else covered)
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_amount_owed_matches_scalar_rule_when_nothing_paid(seed):
+    rng = random.Random(seed)
+    loan = random_loan(rng)
+    now = loan["timestamp"] + timedelta(days=rng.randint(0, 400), hours=rng.randint(0, 23))
+    total = initial_snapshot(loan)["total"]
+
+    owed = amount_owed(loan, now)
+    assert owed["total_due"] == calculate_total_due(total, loan["timestamp"], loan["due_date"], now)
+    assert loan_schedule(loan, now)["total_due_now"] == owed["total_due"]
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_paid_installments_move_the_penalty_to_the_next_one(seed):
+    rng = random.Random(seed)
+    loan = random_loan(rng, installments=rng.randint(2, 12))
+    snapshot = initial_snapshot(loan)
+    paid_count = rng.randint(1, loan["installments"] - 1)
+    snapshot = apply_payment(snapshot, round(snapshot["installment_amount"] * paid_count, 2), BASE)
+    loan["repayment"] = snapshot
+    now = loan["timestamp"] + timedelta(days=rng.randint(0, 600))
+
+    schedule = amortization_schedule(loan["amount"], loan["interest_rate"], loan["installments"], loan["due_date"])
+    next_due = schedule[snapshot["installments_paid"]]["due_date"]
+    owed = amount_owed(loan, now)
+    assert owed["next_due_day"] == to_day(next_due)
+    assert owed["total_due"] == calculate_total_due(snapshot["outstanding"], min(next_due, now.strftime("%Y-%m-%d")),
+                                                    next_due, now)
+
+
+@pytest.mark.parametrize("seed", range(50))
+def test_repaid_loans_owe_nothing(seed):
+    rng = random.Random(seed)
+    loan = random_loan(rng)
+    snapshot = initial_snapshot(loan)
+    loan["repayment"] = apply_payment(snapshot, snapshot["outstanding"], BASE)
+    years_later = loan["due_date"] + timedelta(days=rng.randint(0, 2000))
+
+    owed = amount_owed(loan, years_later)
+    assert owed == {"outstanding": 0.0, "next_due_day": None, "months_overdue": 0, "total_due": 0.0}
+    assert amount_owed({**loan, "repayment": None, "status": "repaid"}, years_later)["total_due"] == 0
+
+
+@pytest.mark.parametrize("amount", [float("nan"), float("inf"), float("-inf"), 0.0, -5.0])
+def test_non_finite_or_non_positive_payments_are_rejected(amount):
+    snapshot = initial_snapshot({"amount": 1000, "installments": 3})
+    with pytest.raises(ValueError):
+        apply_payment(snapshot, amount, datetime(2025, 1, 1, tzinfo=timezone.utc))
+
+
+@pytest.mark.parametrize("field", ["amount", "interest_rate"])
+def test_non_finite_terms_are_rejected(field):
+    loan = {"amount": 1000, "interest_rate": 5, "installments": 3, field: float("nan")}
+    with pytest.raises(ValueError):
+        initial_snapshot(loan)
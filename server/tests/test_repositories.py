@@ -0,0 +1,164 @@
+import os
+import uuid
+from types import SimpleNamespace
+
+import pytest
+from flask import Flask, jsonify
+
+from utils.idempotency import IdempotencyStore
+from utils.repositories import LoanRepo, UserRepo, instrumentation
+
+
+@pytest.fixture(autouse=True)
+def restore_instrumentation():
+    # The instrumentation is a module-level singleton configured by init_app
+    saved = (instrumentation.read_budget, instrumentation.slow_query_ms, instrumentation.enforce)
+    yield
+    instrumentation.read_budget, instrumentation.slow_query_ms, instrumentation.enforce = saved
+
+
+def loan_doc(uid, loan_id, status):
+    reference = SimpleNamespace(parent=SimpleNamespace(parent=SimpleNamespace(id=uid)))
+    return SimpleNamespace(id=loan_id, reference=reference, to_dict=lambda: {"status": status})
+
+
+class FakeDb:
+    """Firestore stand-in: every document exists and every query returns `docs`."""
+
+    def __init__(self, docs=()):
+        self.docs = list(docs)
+        self.queries = []
+
+    def collection(self, name):
+        return self
+
+    def collection_group(self, name):
+        self.queries.append(("collection_group", name))
+        return self
+
+    def where(self, *args):
+        self.queries.append(("where",) + args)
+        return self
+
+    def document(self, doc_id=None):
+        return self
+
+    def get(self):
+        return SimpleNamespace(exists=True, to_dict=lambda: {})
+
+    def stream(self):
+        return iter(self.docs)
+
+
+def make_app(db, read_budget=50, slow_query_ms=500.0, enforce=False):
+    app = Flask(__name__)
+    instrumentation.init_app(app, read_budget=read_budget, slow_query_ms=slow_query_ms, enforce=enforce)
+    users, loans = UserRepo(db), LoanRepo(db)
+
+    @app.route("/profile/<uid>")
+    def profile(uid):
+        # Routes catch everything and echo the details, as the app's routes do
+        try:
+            users.get(uid)
+            loans.list_for_user(uid)
+            return jsonify({"ok": True})
+        except Exception as e:
+            return jsonify({"error": "Failed", "details": str(e)}), 500
+
+    return app.test_client()
+
+
+def test_reads_writes_and_round_trips_are_reported_per_request():
+    client = make_app(FakeDb(docs=[loan_doc("u1", f"l{i}", "approved") for i in range(3)]))
+    response = client.get("/profile/u1")
+    assert response.status_code == 200
+    assert response.headers["X-Firestore-Reads"] == "4"
+    assert response.headers["X-Firestore-Writes"] == "0"
+    assert response.headers["X-Firestore-Round-Trips"] == "2"
+
+    # An empty query is still billed one read
+    assert make_app(FakeDb()).get("/profile/u1").headers["X-Firestore-Reads"] == "2"
+
+
+def test_over_budget_requests_are_logged_once_when_not_enforced(capsys):
+    client = make_app(FakeDb(docs=[loan_doc("u1", f"l{i}", "approved") for i in range(10)]), read_budget=5)
+    response = client.get("/profile/u1")
+    assert response.status_code == 200
+    assert capsys.readouterr().out.count("Firestore read budget exceeded (11 > 5) at loans.list") == 1
+
+
+def test_enforced_budget_answers_503_even_when_the_route_catches_it():
+    client = make_app(FakeDb(docs=[loan_doc("u1", f"l{i}", "approved") for i in range(10)]),
+                      read_budget=5, enforce=True)
+    response = client.get("/profile/u1")
+    assert response.status_code == 503
+    assert response.get_json() == {"error": "Request exceeded Firestore read budget of 5"}
+
+
+def test_direct_store_calls_are_counted_but_only_repositories_enforce():
+    db = FakeDb()
+    app = Flask(__name__)
+    instrumentation.init_app(app, read_budget=1, enforce=True)
+
+    @app.route("/mixed")
+    def mixed():
+        instrumentation.call("idempotency.get", db.get, reads=1, enforce=False)
+        instrumentation.call("idempotency.get", db.get, reads=1, enforce=False)
+        UserRepo(db).get("u1")
+        return jsonify({"ok": True})
+
+    response = app.test_client().get("/mixed")
+    assert response.status_code == 503
+    assert response.headers["X-Firestore-Reads"] == "3"
+
+
+def test_idempotency_store_calls_count_towards_the_request():
+    class KeyDb(FakeDb):
+        def create(self, data):
+            pass
+
+        def set(self, data, merge=False):
+            pass
+
+    app = Flask(__name__)
+    instrumentation.init_app(app)
+    store = IdempotencyStore(KeyDb())
+
+    @app.route("/pay", methods=["POST"])
+    @store.idempotent
+    def pay():
+        return jsonify({"ok": True})
+
+    response = app.test_client().post("/pay", json={"uid": "u1"}, headers={"Idempotency-Key": "k1"})
+    # Claim the key, then store the completed response
+    assert response.headers["X-Firestore-Writes"] == "2"
+
+
+def test_slow_calls_are_logged(capsys):
+    make_app(FakeDb(), slow_query_ms=0.0).get("/profile/u1")
+    out = capsys.readouterr().out
+    assert "Slow Firestore call users.get" in out
+    assert "Slow Firestore call loans.list" in out
+
+
+def test_pending_loans_is_one_collection_group_query():
+    db = FakeDb(docs=[loan_doc("u1", "l1", "pending"), loan_doc("u2", "l2", "pending")])
+    assert [(uid, loan.id) for uid, loan in LoanRepo(db).pending_loans()] == [("u1", "l1"), ("u2", "l2")]
+    assert db.queries == [("collection_group", "loans"), ("where", "status", "==", "pending")]
+
+
+@pytest.mark.skipif(not os.getenv("FIRESTORE_EMULATOR_HOST"), reason="needs the Firestore emulator")
+def test_counts_against_the_emulator():
+    from utils.firebase_client import init_firestore
+
+    db = init_firestore()
+    uid = f"test-{uuid.uuid4().hex}"
+    loans = LoanRepo(db)
+    for status in ("pending", "approved", "pending"):
+        loans.add(uid, {"status": status, "amount": 100})
+
+    client = make_app(db)
+    response = client.get(f"/profile/{uid}")
+    assert response.headers["X-Firestore-Reads"] == "4"
+    assert response.headers["X-Firestore-Round-Trips"] == "2"
+    assert sum(1 for owner, _ in loans.pending_loans() if owner == uid) == 2
@@ -0,0 +1,108 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from utils.trust_score import (FACE_BONUS, FINANCIAL_MAX, IDENTITY_MAX, LATE_POINTS, ON_TIME_POINTS, OVERDUE_PENALTY,
+                               REPAYMENT_MAX, _apply, compute_current, loan_outcome, repayment_score)
+
+NOW = datetime(2025, 6, 10, tzinfo=timezone.utc)
+
+
+def installment_loan(**fields):
+    return {"amount": 600, "installments": 6, "due_date": datetime(2025, 1, 15, tzinfo=timezone.utc), **fields}
+
+
+def test_loan_repaid_on_its_schedule_is_on_time():
+    # Sixth installment falls due on Jun 15; repaying on that day is on schedule
+    loan = installment_loan(status="repaid", repaid_at=datetime(2025, 6, 15, 18, tzinfo=timezone.utc))
+    assert loan_outcome(loan, NOW) == "on_time"
+    assert loan_outcome({**loan, "repaid_at": datetime(2025, 6, 16, tzinfo=timezone.utc)}, NOW) == "late"
+
+
+def test_approved_loan_with_current_installments_is_not_overdue():
+    paid_up = {"total": 600.0, "paid": 500.0, "outstanding": 100.0, "installments": 6,
+               "installment_amount": 100.0, "installments_paid": 5, "entries": 5, "last_payment_at": None}
+    assert loan_outcome(installment_loan(status="approved", repayment=paid_up), NOW) is None
+    # Nothing paid: the first installment (Jan 15) is months overdue
+    assert loan_outcome(installment_loan(status="approved"), NOW) == "overdue"
+
+
+def test_loan_outcome_for_loans_that_do_not_count_or_have_no_schedule():
+    assert loan_outcome(installment_loan(status="pending"), NOW) is None
+    assert loan_outcome(installment_loan(status="rejected"), NOW) is None
+    # Loans from before due dates were stored count as on time once repaid
+    assert loan_outcome({"amount": 100, "status": "repaid"}, NOW) == "on_time"
+    assert loan_outcome({"amount": 100, "status": "approved"}, NOW) is None
+    assert loan_outcome(installment_loan(status="repaid"), NOW) == "on_time"
+
+
+def test_loan_outcome_skips_invalid_terms(capsys):
+    assert loan_outcome(installment_loan(status="approved", amount="lots"), NOW) is None
+    assert loan_outcome(installment_loan(status="approved", amount=float("nan")), NOW) is None
+    assert loan_outcome(installment_loan(status="repaid", due_date="15/01/2025",
+                                         repaid_at=datetime(2025, 2, 1, tzinfo=timezone.utc)), NOW) is None
+    assert capsys.readouterr().out.count("Skipping loan with invalid terms") == 3
+
+
+def test_components_are_capped():
+    assert compute_current({}) == 0
+    assert compute_current({"identity_score": 40}) == IDENTITY_MAX
+    assert compute_current({"financial_score": 95}) == FINANCIAL_MAX
+    outcomes = {f"l{i}": "on_time" for i in range(20)}
+    assert repayment_score(outcomes) == REPAYMENT_MAX
+    assert compute_current({"repayment_outcomes": outcomes}) == REPAYMENT_MAX
+    assert compute_current({"face_verified": True}) == FACE_BONUS
+
+
+def test_total_is_capped_at_100_with_the_face_bonus():
+    full = {"identity_score": IDENTITY_MAX, "financial_score": FINANCIAL_MAX,
+            "repayment_outcomes": {f"l{i}": "on_time" for i in range(5)}}
+    assert compute_current(full) == 100
+    assert compute_current({**full, "face_verified": True}) == 100
+    assert compute_current({**full, "identity_score": 10, "face_verified": True}) == 100
+    assert compute_current({**full, "identity_score": 10}) == 95
+
+
+def test_repayment_score_weighs_outcomes_and_never_goes_negative():
+    assert repayment_score({"a": "on_time", "b": "late"}) == ON_TIME_POINTS + LATE_POINTS
+    paid_twice = {"a": "on_time", "b": "on_time", "c": "overdue"}
+    assert repayment_score(paid_twice) == max(0, 2 * ON_TIME_POINTS - OVERDUE_PENALTY)
+    assert repayment_score({"a": "overdue", "b": "overdue"}) == 0
+    # The penalty comes off the capped score, so a long history still feels an overdue loan
+    history = {f"l{i}": "on_time" for i in range(10)}
+    assert repayment_score({**history, "x": "overdue"}) == REPAYMENT_MAX - OVERDUE_PENALTY
+
+
+@pytest.mark.parametrize("event, payload, expected", [
+    ("identity_verified", {"score": 15}, {"identity_score": 15}),
+    ("financial_verified", {"score": 42}, {"financial_score": 42}),
+    ("face_verified", {"match": 1}, {"face_verified": True}),
+    ("face_verified", {"match": None}, {"face_verified": False}),
+])
+def test_apply_sets_the_component_of_the_event(event, payload, expected):
+    assert _apply({"identity_score": 5, "financial_score": 10}, event, payload) == expected
+
+
+def test_repaid_after_overdue_replaces_the_penalty():
+    trust_score = {"repayment_outcomes": {"old": "on_time"}}
+    overdue = _apply(trust_score, "loan_overdue", {"loan_id": "l1"})
+    assert overdue == {"repayment_outcomes": {"old": "on_time", "l1": "overdue"},
+                       "repayment_score": max(0, ON_TIME_POINTS - OVERDUE_PENALTY)}
+    # _apply returns new maps and leaves the stored ones alone
+    assert trust_score == {"repayment_outcomes": {"old": "on_time"}}
+
+    repaid = _apply(overdue, "loan_repaid", {"loan_id": "l1", "on_time": False})
+    assert repaid["repayment_outcomes"] == {"old": "on_time", "l1": "late"}
+    assert repaid["repayment_score"] == ON_TIME_POINTS + LATE_POINTS
+    assert compute_current({**overdue, **repaid}) == ON_TIME_POINTS + LATE_POINTS
+
+    # A late overdue event for a loan that is already settled does not undo the repayment
+    again = _apply(repaid, "loan_overdue", {"loan_id": "l1"})
+    assert again["repayment_outcomes"]["l1"] == "late"
+
+
+def test_repeated_overdue_events_are_counted_once():
+    once = _apply({}, "loan_overdue", {"loan_id": "l1"})
+    twice = _apply(once, "loan_overdue", {"loan_id": "l1"})
+    assert twice["repayment_outcomes"] == {"l1": "overdue"}
+    assert _apply(twice, "loan_repaid", {"loan_id": "l1", "on_time": True})["repayment_outcomes"] == {"l1": "on_time"}
@@ -0,0 +1,234 @@
+import argparse
+import atexit
+import glob
+import json
+import os
+import socket
+import threading
+import uuid
+from collections import deque
+from datetime import datetime, timezone
+from typing import List, Optional
+
+# Typed audit events recorded by the routes
+IDENTITY_SCORED = "trust_score.identity"
+FINANCIAL_SCORED = "trust_score.financial"
+FACE_VERIFIED = "face.verified"
+LOAN_REQUESTED = "loan.requested"
+LOAN_DECISION = "loan.decision"
+LOAN_REPAYMENT = "loan.repayment"
+DOCUMENTS_RELEASED = "documents.released"
+OFFER_POSTED = "offer.posted"
+OTP_SENT = "otp.sent"
+OTP_VERIFIED = "otp.verified"
+EVENT_TYPES = {
+    IDENTITY_SCORED, FINANCIAL_SCORED, FACE_VERIFIED, LOAN_REQUESTED, LOAN_DECISION,
+    LOAN_REPAYMENT, DOCUMENTS_RELEASED, OFFER_POSTED, OTP_SENT, OTP_VERIFIED
+}
+
+OVERFLOW_POLICIES = ("drop_oldest", "drop_newest")
+
+
+class NDJSONSink:
+    """
+    Appends events to rotating newline-delimited JSON files. Each process
+    writes its own file so gunicorn workers never interleave or race on
+    rotation; `query` merges them back by timestamp.
+    """
+
+    def __init__(self, directory: str, max_bytes: int = 10 * 1024 * 1024, backup_count: int = 10):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, f"audit-{socket.gethostname()}-{os.getpid()}.ndjson")
+
+    def write(self, events: List[dict]) -> None:
+        if os.path.exists(self.path) and os.path.getsize(self.path) >= self.max_bytes:
+            self._rotate()
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write("".join(json.dumps(event, default=str) + "\n" for event in events))
+
+    def _rotate(self):
+        for i in range(self.backup_count - 1, 0, -1):
+            source = f"{self.path}.{i}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.path}.{i + 1}")
+        os.replace(self.path, f"{self.path}.1")
+
+
+class FirestoreSink:
+    """Writes events to an `audit_events` collection in batched writes."""
+
+    BATCH_LIMIT = 500
+
+    def __init__(self, db, collection: str = "audit_events"):
+        self.db = db
+        self.collection = collection
+
+    def write(self, events: List[dict]) -> None:
+        for start in range(0, len(events), self.BATCH_LIMIT):
+            batch = self.db.batch()
+            for event in events[start:start + self.BATCH_LIMIT]:
+                batch.set(self.db.collection(self.collection).document(event["id"]), event)
+            batch.commit()
+
+
+class AuditLog:
+    """
+    Asynchronous audit trail. `record` only appends to a bounded in-memory
+    ring buffer; a background thread flushes batches to the sink whenever
+    `batch_size` events are buffered or `flush_interval` seconds have passed,
+    and once more on shutdown.
+
+    When the buffer is full, `drop_oldest` evicts the oldest buffered event
+    and `drop_newest` discards the incoming one; either way the drop is
+    counted. Batches the sink rejects are put back if there is room.
+
+    Args:
+        sink: NDJSONSink, FirestoreSink or anything with write(list_of_events)
+        capacity: Maximum buffered events
+        batch_size: Events per sink write
+        flush_interval: Maximum seconds an event waits in the buffer
+        overflow: "drop_oldest" or "drop_newest"
+    """
+
+    def __init__(self, sink, capacity: int = 10000, batch_size: int = 200,
+                 flush_interval: float = 2.0, overflow: str = "drop_oldest"):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"overflow must be one of {OVERFLOW_POLICIES}")
+        self.sink = sink
+        self.capacity = capacity
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow = overflow
+        self.dropped = 0
+        self.written = 0
+        self._buffer = deque()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="audit-log", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def record(self, event_type: str, uid: Optional[str] = None, **data) -> None:
+        """Buffer one event; never blocks on I/O."""
+        if event_type not in EVENT_TYPES:
+            raise ValueError(f"Unknown audit event type: {event_type}")
+        event = {
+            "id": uuid.uuid4().hex,
+            "type": event_type,
+            "uid": uid,
+            "ts": datetime.now(timezone.utc).isoformat(),
+            "data": data
+        }
+        with self._cond:
+            if self._closed:
+                self.dropped += 1
+                return
+            if len(self._buffer) >= self.capacity:
+                self.dropped += 1
+                if self.overflow == "drop_newest":
+                    return
+                self._buffer.popleft()
+            self._buffer.append(event)
+            if len(self._buffer) >= self.batch_size:
+                self._cond.notify()
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {"buffered": len(self._buffer), "dropped": self.dropped, "written": self.written}
+
+    def _take_batch(self):
+        # Caller holds self._cond
+        count = min(self.batch_size, len(self._buffer))
+        return [self._buffer.popleft() for _ in range(count)]
+
+    def _flush(self, batch):
+        try:
+            self.sink.write(batch)
+        except Exception as e:
+            print(f"Audit log flush failed ({len(batch)} events): {str(e)}")
+            return False
+        with self._cond:
+            self.written += len(batch)
+        return True
+
+    def _requeue(self, events):
+        # Unwritten events go back in front of anything recorded since; what no longer fits is dropped
+        with self._cond:
+            room = max(0, self.capacity - len(self._buffer))
+            self._buffer.extendleft(reversed(events[:room]))
+            self.dropped += len(events) - min(room, len(events))
+
+    def _run(self):
+        failed = False
+        while True:
+            with self._cond:
+                # After a failed write, wait a full interval before retrying the sink
+                if not self._closed and (failed or len(self._buffer) < self.batch_size):
+                    self._cond.wait(self.flush_interval)
+                closing = self._closed
+                batches = []
+                while self._buffer:
+                    batches.append(self._take_batch())
+            failed = False
+            for i, batch in enumerate(batches):
+                if not self._flush(batch):
+                    failed = True
+                    self._requeue([event for unwritten in batches[i:] for event in unwritten])
+                    break
+            if closing:
+                return
+
+    def close(self, timeout: float = 10.0) -> None:
+        """Stop accepting events and flush what is buffered."""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify()
+        self._thread.join(timeout)
+
+
+def query(directory: str, event_type: Optional[str] = None, uid: Optional[str] = None,
+          since: Optional[str] = None, until: Optional[str] = None, limit: Optional[int] = None) -> List[dict]:
+    """
+    Filter events from the local NDJSON files, oldest first. since/until are
+    UTC ISO timestamps or dates and both are inclusive at their own
+    precision: `until="2025-01-31"` keeps every event on Jan 31.
+    """
+    matches = []
+    for path in glob.glob(os.path.join(directory, "audit-*.ndjson*")):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    continue
+                if event_type and event.get("type") != event_type:
+                    continue
+                if uid and event.get("uid") != uid:
+                    continue
+                if since and event.get("ts", "") < since:
+                    continue
+                # Truncate to the bound's precision so a date or minute covers its whole span
+                if until and event.get("ts", "")[:len(until)] > until:
+                    continue
+                matches.append(event)
+    matches.sort(key=lambda event: event.get("ts", ""))
+    return matches[-limit:] if limit else matches
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query the local audit log files")
+    parser.add_argument("--dir", default=os.getenv("AUDIT_LOG_DIR", "audit_logs"))
+    parser.add_argument("--type", choices=sorted(EVENT_TYPES))
+    parser.add_argument("--uid")
+    parser.add_argument("--since", help="ISO timestamp or date, e.g. 2025-01-31")
+    parser.add_argument("--until", help="ISO timestamp or date, inclusive (a date covers the whole day)")
+    parser.add_argument("--limit", type=int, help="Only the most recent N events")
+    args = parser.parse_args()
+
+    for event in query(args.dir, args.type, args.uid, args.since, args.until, args.limit):
+        print(json.dumps(event, default=str))
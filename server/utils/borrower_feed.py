@@ -0,0 +1,257 @@
+import json
+import queue
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from typing import Iterator, Optional
+
+from firebase_admin import firestore
+
+from utils.lender_logic import borrower_entry
+
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def _read_time_us(read_time) -> int:
+    """Microseconds since the epoch of a listener read_time; Firestore's clock, the same in every worker."""
+    if isinstance(read_time, datetime):
+        return (read_time - EPOCH) // timedelta(microseconds=1)
+    return time.time_ns() // 1000
+
+
+def _parse_event_id(event_id: Optional[str]) -> Optional[int]:
+    """Read time of a `<read_time_us>-<seq>` event id, or None if it is not one."""
+    try:
+        return int(event_id.split("-", 1)[0]) if event_id else None
+    except ValueError:
+        return None
+
+
+class _Subscriber:
+    def __init__(self, max_queue: int):
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.overflowed = False
+
+
+class BorrowerFeed:
+    """
+    Server-sent-events feed of pending loan requests for lender dashboards.
+
+    A single Firestore listener on the `loans` collection group (status ==
+    "pending") keeps an in-memory view of the borrower list and fans out
+    add/update/remove deltas to every connected dashboard. Each subscriber has
+    a bounded queue; a subscriber that falls behind is disconnected and
+    resumes from its Last-Event-ID, or from a fresh snapshot if that event has
+    already left the replay buffer.
+
+    Event ids are `<read_time_us>-<seq>`, taken from the listener's read time,
+    so an id issued by one gunicorn worker is meaningful to every other one. A
+    resume replays every retained event at or after that read time. Deltas
+    carry full entries, so an event seen twice is harmless and none is skipped.
+
+    Each open stream holds a worker thread, so streams per worker are capped
+    (`open_stream` returns None beyond the cap) and closed after
+    `max_stream_seconds`; EventSource then reconnects and resumes, possibly on
+    another worker.
+
+    If the listener closes (an RPC error, e.g. the missing index exemption
+    below), the feed stops reporting ready so callers fall back to a scan,
+    open streams end, and the listener is re-attached after
+    `restart_interval`. The first snapshot of a re-attached listener is
+    reconciled against the held view, emitting removes for what went away.
+    Waits for readiness are bounded by `sync_timeout` after attaching, so a
+    feed that never syncs costs requests nothing.
+
+    Note: the collection-group query needs a single-field index exemption on
+    `loans.status` with collection-group scope.
+
+    Args:
+        db: Firestore client
+        history_size: Events kept for Last-Event-ID resume
+        subscriber_queue_size: Events buffered per slow subscriber before it is dropped
+        heartbeat_interval: Seconds between keep-alive comments
+        max_streams: Concurrent streams per worker
+        max_stream_seconds: Lifetime of one stream before the client is made to reconnect
+        sync_timeout: Seconds after attaching the listener during which callers wait for its first sync
+        restart_interval: Minimum seconds between listener attach attempts
+    """
+
+    def __init__(self, db: firestore.Client, history_size: int = 1000,
+                 subscriber_queue_size: int = 256, heartbeat_interval: float = 15.0,
+                 max_streams: int = 8, max_stream_seconds: float = 300.0,
+                 sync_timeout: float = 10.0, restart_interval: float = 30.0):
+        self.db = db
+        self.subscriber_queue_size = subscriber_queue_size
+        self.heartbeat_interval = heartbeat_interval
+        self.max_streams = max_streams
+        self.max_stream_seconds = max_stream_seconds
+        self.sync_timeout = sync_timeout
+        self.restart_interval = restart_interval
+        self._state = {}
+        self._events = deque(maxlen=history_size)
+        # Oldest read time a resume can be served from: the first sync, then the last evicted event
+        self._horizon_us = None
+        self._last_read_us = 0
+        self._streams = 0
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._watch = None
+        self._attached_at = 0.0
+        self._resync = False
+
+    def start(self) -> None:
+        """Attach the shared listener on first use, and re-attach it once it has closed."""
+        with self._lock:
+            if self._watch is not None:
+                if self._watch.is_active:
+                    return
+                self._ready.clear()
+                if time.monotonic() - self._attached_at < self.restart_interval:
+                    return
+                print("Borrower feed listener closed, re-attaching")
+                self._watch = None
+            self._attached_at = time.monotonic()
+            self._resync = True
+            query = self.db.collection_group("loans").where("status", "==", "pending")
+            self._watch = query.on_snapshot(self._on_snapshot)
+
+    def ready(self, timeout: float = 10.0) -> bool:
+        """Whether the listener is synced, waiting at most until sync_timeout after it was attached."""
+        self.start()
+        remaining = self._attached_at + self.sync_timeout - time.monotonic()
+        return self._ready.wait(max(0.0, min(timeout, remaining)))
+
+    def borrowers(self, timeout: float = 10.0) -> Optional[list]:
+        """Current pending-borrower list, or None if the listener is not synced."""
+        if not self.ready(timeout):
+            return None
+        with self._lock:
+            return list(self._state.values())
+
+    def _listening(self) -> bool:
+        watch = self._watch
+        return watch is not None and watch.is_active
+
+    def _on_snapshot(self, docs, changes, read_time):
+        with self._lock:
+            read_us = max(_read_time_us(read_time), self._last_read_us)
+            self._last_read_us = read_us
+            if self._horizon_us is None:
+                self._horizon_us = read_us
+            seq = 0
+            if self._resync:
+                # First snapshot of a (re)attached listener holds every pending loan
+                self._resync = False
+                present = {f"{doc.reference.parent.parent.id}/{doc.id}" for doc in docs}
+                for key in [key for key in self._state if key not in present]:
+                    entry = self._state.pop(key)
+                    self._emit(read_us, seq, "remove", {"uid": entry["uid"], "loan_id": entry["loan_id"]})
+                    seq += 1
+            for change in changes:
+                doc = change.document
+                uid = doc.reference.parent.parent.id
+                key = f"{uid}/{doc.id}"
+                if change.type.name == "REMOVED":
+                    if self._state.pop(key, None) is not None:
+                        self._emit(read_us, seq, "remove", {"uid": uid, "loan_id": doc.id})
+                        seq += 1
+                    continue
+                entry = borrower_entry(uid, doc.id, doc.to_dict())
+                event_type = "update" if key in self._state else "add"
+                self._state[key] = entry
+                self._emit(read_us, seq, event_type, entry)
+                seq += 1
+        self._ready.set()
+
+    def _emit(self, read_us, seq, event_type, data):
+        # Caller holds self._lock
+        if len(self._events) == self._events.maxlen:
+            self._horizon_us = max(self._horizon_us, self._events[0][0] + 1)
+        event = (read_us, f"{read_us}-{seq}", event_type, data)
+        self._events.append(event)
+        for subscriber in list(self._subscribers):
+            try:
+                subscriber.queue.put_nowait(event)
+            except queue.Full:
+                subscriber.overflowed = True
+                self._subscribers.discard(subscriber)
+
+    def open_stream(self, last_event_id: Optional[str] = None) -> Optional["_Stream"]:
+        """
+        SSE frames for one dashboard, or None when this worker already serves
+        max_streams. Check `ready()` first; the stream ends if the listener is lost.
+        """
+        with self._lock:
+            if self._streams >= self.max_streams:
+                return None
+            self._streams += 1
+        return _Stream(self, self._frames(last_event_id))
+
+    def _release_stream(self):
+        with self._lock:
+            self._streams -= 1
+
+    def _frames(self, last_event_id: Optional[str]) -> Iterator[str]:
+        if not self.ready(self.sync_timeout):
+            # Never present an unsynced (empty) view as the borrower list
+            return
+        resume_us = _parse_event_id(last_event_id)
+
+        subscriber = _Subscriber(self.subscriber_queue_size)
+        with self._lock:
+            if resume_us is not None and self._horizon_us is not None and resume_us >= self._horizon_us:
+                backlog = [event[1:] for event in self._events if event[0] >= resume_us]
+            else:
+                backlog = [(f"{self._last_read_us}-0", "snapshot", list(self._state.values()))]
+            self._subscribers.add(subscriber)
+
+        deadline = time.monotonic() + self.max_stream_seconds
+        try:
+            yield "retry: 3000\n\n"
+            for event in backlog:
+                yield _format(*event)
+            while not subscriber.overflowed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return
+                try:
+                    event = subscriber.queue.get(timeout=min(self.heartbeat_interval, remaining))
+                except queue.Empty:
+                    if not self._listening():
+                        # Reconnect once the listener is back instead of streaming a stale view
+                        return
+                    yield ": heartbeat\n\n"
+                    continue
+                yield _format(*event[1:])
+        finally:
+            with self._lock:
+                self._subscribers.discard(subscriber)
+
+
+class _Stream:
+    """Response iterable that gives its stream slot back when the server closes it, even if never started."""
+
+    def __init__(self, feed: BorrowerFeed, frames: Iterator[str]):
+        self._feed = feed
+        self._frames = frames
+        self._closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> str:
+        return next(self._frames)
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        self._frames.close()
+        self._feed._release_stream()
+
+
+def _format(event_id, event_type, data):
+    return f"id: {event_id}\nevent: {event_type}\ndata: {json.dumps(data, default=str)}\n\n"
@@ -0,0 +1,198 @@
+import argparse
+import base64
+import io
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import List, Optional, Tuple
+
+from PIL import Image
+
+RESIZABLE_TYPES = {"image/jpeg": "JPEG", "image/png": "PNG"}
+
+
+def _prepare_in_worker(shm_name: str, size: int, mimetype: str, max_dimension: int) -> Tuple[str, int]:
+    """
+    Runs in a pool process: read the upload from shared memory, resize it if
+    needed and base64-encode it. Returns the name and size of a new
+    shared-memory block holding the ASCII base64 text; the parent unlinks it.
+    """
+    shm = shared_memory.SharedMemory(name=shm_name)
+    view = shm.buf[:size]
+    try:
+        resized = resize_document(view, mimetype, max_dimension)
+        encoded = base64.b64encode(view if resized is None else resized)
+    finally:
+        view.release()
+        shm.close()
+
+    out = shared_memory.SharedMemory(create=True, size=max(1, len(encoded)))
+    out.buf[:len(encoded)] = encoded
+    out.close()
+    return out.name, len(encoded)
+
+
+def _take_shared_text(shm_name: str, size: int) -> str:
+    """Decode an ASCII block returned by a pool worker straight into a str, then unlink it."""
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        with shm.buf[:size] as view:
+            return str(view, "ascii")
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+def resize_document(data, mimetype: str, max_dimension: int) -> Optional[bytes]:
+    """
+    Downscale an oversized JPEG/PNG. Returns None when the upload should be sent
+    unchanged: PDFs (Gemini reads them natively), small images and anything
+    Pillow cannot decode.
+    """
+    image_format = RESIZABLE_TYPES.get(mimetype)
+    if not image_format or not max_dimension:
+        return None
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            if max(image.size) <= max_dimension:
+                return None
+            image.thumbnail((max_dimension, max_dimension))
+            if image_format == "JPEG" and image.mode not in ("RGB", "L"):
+                image = image.convert("RGB")
+            out = io.BytesIO()
+            image.save(out, format=image_format, quality=85, optimize=True)
+            return out.getvalue()
+    except (OSError, Image.DecompressionBombError):
+        # Not decodable here; let Gemini decide what to do with the original bytes
+        return None
+
+
+def encode_document(data: bytes, mimetype: str) -> dict:
+    """Gemini inline_data part for the (prepared) upload."""
+    return {"mime_type": mimetype, "data": base64.b64encode(data).decode("utf-8")}
+
+
+def prepare_document(data: bytes, mimetype: str, max_dimension: int) -> dict:
+    """Resize if needed and base64-encode the upload for Gemini's inline_data."""
+    return encode_document(resize_document(data, mimetype, max_dimension) or data, mimetype)
+
+
+class DocumentPool:
+    """
+    Process pool for the CPU-bound part of document verification (image
+    decoding/resizing and base64 encoding), keeping it off the web worker's
+    GIL. Upload bytes reach the pool, and the base64 text comes back, through
+    `multiprocessing.shared_memory` rather than being pickled through the task
+    and result queues. The request thread only copies the ASCII text into
+    the str Gemini's inline_data takes.
+
+    The pool is created lazily so each gunicorn worker gets its own after
+    forking, and uses the forkserver start method because web workers are
+    multi-threaded.
+
+    Args:
+        max_workers: Pool size; 0 runs everything inline in the calling thread
+        max_dimension: Longest image side sent to Gemini; 0 disables resizing
+    """
+
+    def __init__(self, max_workers: Optional[int] = None, max_dimension: int = 2048):
+        self.max_workers = (os.cpu_count() or 1) if max_workers is None else max_workers
+        self.max_dimension = max_dimension
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers,
+                                                     mp_context=multiprocessing.get_context(method))
+            return self._executor
+
+    def prepare(self, documents: List[Tuple[bytes, str]]) -> List[dict]:
+        """
+        Turn (bytes, mimetype) uploads into Gemini inline_data parts, processing
+        all documents of a request in parallel. Order is preserved.
+        """
+        if not documents:
+            return []
+        if self.max_workers == 0:
+            return [prepare_document(data, mimetype, self.max_dimension) for data, mimetype in documents]
+
+        executor = self._get_executor()
+        blocks, futures = [], []
+        try:
+            for data, mimetype in documents:
+                shm = shared_memory.SharedMemory(create=True, size=max(1, len(data)))
+                blocks.append(shm)
+                shm.buf[:len(data)] = data
+                futures.append(executor.submit(_prepare_in_worker, shm.name, len(data), mimetype, self.max_dimension))
+
+            # Collect every result before raising so no returned block is leaked
+            results, error = [], None
+            for future in futures:
+                try:
+                    results.append(future.result())
+                except Exception as e:
+                    results.append(None)
+                    error = error or e
+            encoded = [_take_shared_text(*result) if result else None for result in results]
+            if error:
+                raise error
+        finally:
+            for shm in blocks:
+                shm.close()
+                shm.unlink()
+
+        return [{"mime_type": mimetype, "data": data} for (_, mimetype), data in zip(documents, encoded)]
+
+    def shutdown(self, wait: bool = True) -> None:
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=wait, cancel_futures=True)
+                self._executor = None
+
+
+def _synthetic_batch(count: int) -> List[Tuple[bytes, str]]:
+    """Mixed JPEG/PNG/PDF uploads resembling phone photos and scanned statements."""
+    documents = []
+    for i in range(count):
+        kind = i % 3
+        if kind == 2:
+            documents.append((b"%PDF-1.4\n" + os.urandom(512 * 1024) + b"\n%%EOF", "application/pdf"))
+            continue
+        image = Image.effect_noise((3000, 2000), 64).convert("RGB")
+        out = io.BytesIO()
+        if kind == 0:
+            image.save(out, format="JPEG", quality=90)
+            documents.append((out.getvalue(), "image/jpeg"))
+        else:
+            image.resize((1600, 1200)).save(out, format="PNG")
+            documents.append((out.getvalue(), "image/png"))
+    return documents
+
+
+def _benchmark(count: int, max_workers: int) -> None:
+    documents = _synthetic_batch(count)
+    print(f"{count} documents, {sum(len(d) for d, _ in documents) / 1e6:.1f} MB")
+    sizes = [0] + [2 ** i for i in range(max_workers.bit_length()) if 2 ** i <= max_workers]
+    for workers in sizes:
+        pool = DocumentPool(max_workers=workers)
+        pool.prepare(documents[:max(1, workers)])  # start the workers outside the timed region
+        started = time.perf_counter()
+        pool.prepare(documents)
+        elapsed = time.perf_counter() - started
+        pool.shutdown()
+        label = "inline" if workers == 0 else f"{workers} workers"
+        print(f"{label:>11}: {count / elapsed:7.2f} docs/s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Document preparation throughput across pool sizes")
+    parser.add_argument("--documents", type=int, default=48)
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+    _benchmark(args.documents, args.max_workers)
@@ -0,0 +1,114 @@
+import hashlib
+import json
+import os
+import time
+from datetime import datetime, timezone, timedelta
+from typing import Optional, Sequence
+
+from utils.repositories import instrumentation
+
+
+def _expired(record: dict) -> bool:
+    expires_at = record.get("expires_at")
+    if isinstance(expires_at, str):
+        expires_at = datetime.fromisoformat(expires_at)
+    return expires_at is not None and expires_at <= datetime.now(timezone.utc)
+
+
+def extraction_id(uid: str, documents: str) -> str:
+    """sha256 of the uid and the normalized extracted text; the reference audit events carry."""
+    return hashlib.sha256("\0".join((uid or "", documents)).encode("utf-8")).hexdigest()
+
+
+class LocalExtractionStore:
+    """
+    One JSON file per record in a directory readable only by the server's
+    user (0700 directory, 0600 files). For local development, next to the
+    NDJSON audit log. Records expire after `retention_days`: reads ignore
+    and delete them, and writes sweep the directory at most once per
+    `purge_interval` seconds.
+    """
+
+    def __init__(self, directory: str, retention_days: float = 90, purge_interval: float = 3600.0):
+        self.directory = directory
+        self.retention_days = retention_days
+        self.purge_interval = purge_interval
+        self._purged_at = 0.0
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        os.chmod(directory, 0o700)
+
+    def _path(self, record_id):
+        return os.path.join(self.directory, f"{record_id}.json")
+
+    def put(self, record_id: str, uid: str, extractions: Sequence[str]) -> None:
+        now = datetime.now(timezone.utc)
+        fd = os.open(self._path(record_id), os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump({"uid": uid, "extractions": list(extractions), "created_at": now.isoformat(),
+                       "expires_at": (now + timedelta(days=self.retention_days)).isoformat()}, f)
+        if time.monotonic() - self._purged_at >= self.purge_interval:
+            self._purged_at = time.monotonic()
+            self.purge()
+
+    def get(self, record_id: str) -> Optional[dict]:
+        try:
+            with open(self._path(record_id), encoding="utf-8") as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if _expired(record):
+            self._remove(record_id)
+            return None
+        return record
+
+    def purge(self) -> int:
+        """Delete records older than the retention period; returns how many were removed."""
+        cutoff = time.time() - self.retention_days * 86400
+        removed = 0
+        for filename in os.listdir(self.directory):
+            path = os.path.join(self.directory, filename)
+            try:
+                if filename.endswith(".json") and os.path.getmtime(path) <= cutoff:
+                    os.remove(path)
+                    removed += 1
+            except OSError:
+                continue
+        return removed
+
+    def _remove(self, record_id):
+        try:
+            os.remove(self._path(record_id))
+        except OSError:
+            pass
+
+
+class FirestoreExtractionStore:
+    """
+    Records in an `llm_extractions` collection that only the Admin SDK
+    reaches: security rules must deny all client access to it. `expires_at`
+    is meant for a Firestore TTL policy so the text is purged after
+    `retention_days`; since TTL deletion can lag by a day or more, reads
+    treat a record past `expires_at` as gone.
+    """
+
+    def __init__(self, db, collection: str = "llm_extractions", retention_days: int = 90):
+        self.db = db
+        self.collection = collection
+        self.retention_days = retention_days
+
+    def put(self, record_id: str, uid: str, extractions: Sequence[str]) -> None:
+        now = datetime.now(timezone.utc)
+        record = {
+            "uid": uid,
+            "extractions": list(extractions),
+            "created_at": now,
+            "expires_at": now + timedelta(days=self.retention_days)
+        }
+        ref = self.db.collection(self.collection).document(record_id)
+        instrumentation.call("extractions.put", lambda: ref.set(record), writes=1, enforce=False)
+
+    def get(self, record_id: str) -> Optional[dict]:
+        ref = self.db.collection(self.collection).document(record_id)
+        snapshot = instrumentation.call("extractions.get", ref.get, reads=1, enforce=False)
+        record = snapshot.to_dict() if snapshot.exists else None
+        return None if record is None or _expired(record) else record
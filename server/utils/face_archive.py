@@ -0,0 +1,184 @@
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Tuple
+
+import cloudinary.uploader
+import cloudinary.utils
+from firebase_admin import firestore
+
+from utils.ttl_cache import TTLCache
+
+
+def face_public_id(uid: str, name: str) -> str:
+    return f"trustbridge/{uid}/{name}"
+
+
+def outbox_entry_id(uid: str, name: str, digest: str) -> str:
+    """File-name-safe outbox id; never derived from the raw uid, which comes from the request."""
+    return hashlib.sha256("\0".join((uid, name, digest)).encode("utf-8")).hexdigest()
+
+
+class FaceArchiver:
+    """
+    Archives face-verification images to Cloudinary off the request path.
+
+    Each image is first written to a local outbox directory, then uploaded by a
+    background thread pool. Uploads are skipped when the image's SHA-256 matches
+    the hash already stored under `users/{uid}.face_images`. Failed uploads stay
+    in the outbox and are retried with exponential backoff, including after a
+    restart. An entry that still fails after `max_attempts` is deleted rather
+    than keeping the biometric image on disk.
+
+    Outbox file names are a hash of the uid, image name and content; the uid
+    (untrusted form input) is only stored inside the entry's metadata.
+
+    Args:
+        db: Firestore client
+        outbox_dir: Directory holding pending uploads
+        max_workers: Concurrent uploads
+        max_attempts: Attempts before an entry is dropped from the outbox
+        retry_interval: Seconds between outbox scans (also the base backoff)
+    """
+
+    def __init__(self, db: firestore.Client, outbox_dir: str, max_workers: int = 2,
+                 max_attempts: int = 8, retry_interval: float = 30.0):
+        self.db = db
+        self.outbox_dir = outbox_dir
+        self.max_attempts = max_attempts
+        self.retry_interval = retry_interval
+        os.makedirs(outbox_dir, mode=0o700, exist_ok=True)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="face-archive")
+        self._uploaded = TTLCache(max_entries=4096, ttl_seconds=3600)
+        self._pending = set()
+        self._lock = threading.Lock()
+        threading.Thread(target=self._retry_loop, name="face-archive-retry", daemon=True).start()
+
+    def submit(self, uid: str, images: Dict[str, Tuple[bytes, str]]) -> Dict[str, str]:
+        """
+        Queue images (name -> (bytes, mimetype)) for archival and return the
+        Cloudinary URL each one will be served from.
+        """
+        urls = {}
+        for name, (data, mimetype) in images.items():
+            public_id = face_public_id(uid, name)
+            urls[name] = cloudinary.utils.cloudinary_url(public_id, secure=True)[0]
+            digest = hashlib.sha256(data).hexdigest()
+            if self._uploaded.get((uid, name)) == digest:
+                continue
+            entry_id = outbox_entry_id(uid, name, digest)
+            meta = {"uid": uid, "name": name, "sha256": digest, "mimetype": mimetype,
+                    "attempts": 0, "next_attempt": 0}
+            try:
+                with open(self._path(entry_id, ".bin"), "wb") as f:
+                    f.write(data)
+                self._write_meta(entry_id, meta)
+            except OSError as e:
+                print(f"Face archive outbox write failed: {str(e)}")
+                continue
+            self._schedule(entry_id)
+        return urls
+
+    # ---- Outbox ----
+
+    def _path(self, entry_id, suffix):
+        return os.path.join(self.outbox_dir, entry_id + suffix)
+
+    def _write_meta(self, entry_id, meta):
+        tmp = self._path(entry_id, ".json.tmp")
+        with open(tmp, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp, self._path(entry_id, ".json"))
+
+    def _remove(self, entry_id):
+        for suffix in (".bin", ".json"):
+            try:
+                os.remove(self._path(entry_id, suffix))
+            except FileNotFoundError:
+                pass
+
+    def _schedule(self, entry_id):
+        with self._lock:
+            if entry_id in self._pending:
+                return
+            self._pending.add(entry_id)
+        self._executor.submit(self._process, entry_id)
+
+    def _retry_loop(self):
+        while True:
+            now = time.time()
+            try:
+                names = os.listdir(self.outbox_dir)
+            except OSError:
+                names = []
+            for filename in names:
+                if not filename.endswith(".json"):
+                    continue
+                entry_id = filename[:-len(".json")]
+                try:
+                    with open(self._path(entry_id, ".json")) as f:
+                        meta = json.load(f)
+                except (OSError, ValueError):
+                    continue
+                if meta["attempts"] >= self.max_attempts:
+                    self._remove(entry_id)
+                elif meta["next_attempt"] <= now:
+                    self._schedule(entry_id)
+            time.sleep(self.retry_interval)
+
+    # ---- Upload ----
+
+    def _process(self, entry_id):
+        try:
+            try:
+                with open(self._path(entry_id, ".json")) as f:
+                    meta = json.load(f)
+                with open(self._path(entry_id, ".bin"), "rb") as f:
+                    data = f.read()
+            except (OSError, ValueError):
+                # Already handled by another worker process
+                return
+
+            uid, name, digest = meta["uid"], meta["name"], meta["sha256"]
+            try:
+                user_doc = self.db.collection("users").document(uid).get()
+                stored = (user_doc.to_dict() or {}).get("face_images", {}) if user_doc.exists else {}
+                if stored.get(f"{name}_sha256") == digest:
+                    self._uploaded.set((uid, name), digest)
+                    self._remove(entry_id)
+                    return
+
+                result = cloudinary.uploader.upload(
+                    io.BytesIO(data),
+                    public_id=face_public_id(uid, name),
+                    overwrite=True,
+                    invalidate=True,
+                    resource_type="image",
+                )
+                self.db.collection("users").document(uid).set({
+                    "face_images": {
+                        name: result["secure_url"],
+                        f"{name}_sha256": digest
+                    }
+                }, merge=True)
+                self._uploaded.set((uid, name), digest)
+                self._remove(entry_id)
+            except Exception as e:
+                meta["attempts"] += 1
+                meta["next_attempt"] = time.time() + self.retry_interval * (2 ** (meta["attempts"] - 1))
+                print(f"Face archive upload failed for {entry_id} (attempt {meta['attempts']}): {str(e)}")
+                if meta["attempts"] >= self.max_attempts:
+                    print(f"Face archive giving up on {entry_id}, removing it from the outbox")
+                    self._remove(entry_id)
+                    return
+                try:
+                    self._write_meta(entry_id, meta)
+                except OSError:
+                    pass
+        finally:
+            with self._lock:
+                self._pending.discard(entry_id)
@@ -0,0 +1,227 @@
+import argparse
+import dataclasses
+import hashlib
+import json
+import os
+import re
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional, Sequence
+
+from utils import prompts
+from utils.audit_log import FINANCIAL_SCORED, query
+from utils.extraction_store import FirestoreExtractionStore, LocalExtractionStore, extraction_id
+from utils.trust_score import FINANCIAL_MAX
+from utils.ttl_cache import TTLCache
+
+DEFAULT_SCORE = 5
+DEFAULT_EXPLANATION = "Score could not be determined from documents."
+
+
+def normalize_extractions(extracted_texts: Sequence[str]) -> str:
+    """
+    Canonical form of the extracted document text: whitespace collapsed,
+    blank lines dropped and documents sorted, so re-uploading the same
+    documents in another order or with different spacing scores the same.
+    """
+    documents = []
+    for text in extracted_texts:
+        lines = (" ".join(line.split()) for line in (text or "").splitlines())
+        documents.append("\n".join(line for line in lines if line))
+    return "\n\n".join(sorted(documents))
+
+
+def cache_key(prompt: prompts.Prompt, documents: str) -> str:
+    return hashlib.sha256("\0".join((prompt.tag, prompt.model, documents)).encode("utf-8")).hexdigest()
+
+
+def parse_score(text: str):
+    """Return (score, explanation) from a `Score: / Explanation:` response, or None."""
+    score_match = re.search(r"Score:\s*(\d{1,3})", text, re.IGNORECASE)
+    if not score_match:
+        return None
+    explanation_match = re.search(r"Explanation:\s*(.*)", text, re.IGNORECASE | re.DOTALL)
+    score = min(FINANCIAL_MAX, max(0, int(score_match.group(1))))
+    return score, explanation_match.group(1).strip() if explanation_match else DEFAULT_EXPLANATION
+
+
+class FinancialScorer:
+    """
+    Financial score from extracted document text, memoized on
+    sha256(prompt version, model, normalized text). Only parsed responses are
+    cached, so a malformed answer is retried on the next request.
+
+    Args:
+        cache: TTL/LRU store for results
+        generate: prompts.generate, injectable for the evaluation runner
+    """
+
+    def __init__(self, cache: Optional[TTLCache] = None, generate: Callable[..., str] = prompts.generate):
+        self.cache = cache if cache is not None else TTLCache(max_entries=4096, ttl_seconds=7 * 24 * 3600)
+        self.generate = generate
+
+    def score(self, extracted_texts: Sequence[str], prompt: Optional[prompts.Prompt] = None) -> dict:
+        prompt = prompt or prompts.get("financial_score")
+        documents = normalize_extractions(extracted_texts)
+        key = cache_key(prompt, documents)
+
+        cached = self.cache.get(key)
+        if cached is not None:
+            return {**cached, "cached": True, "latency_ms": 0.0}
+
+        started = time.perf_counter()
+        parsed = parse_score(self.generate(prompt, documents=documents))
+        latency_ms = round((time.perf_counter() - started) * 1000, 1)
+
+        score, explanation = parsed or (DEFAULT_SCORE, DEFAULT_EXPLANATION)
+        result = {"score": score, "explanation": explanation, "prompt": prompt.tag,
+                  "model": prompt.model, "parsed": parsed is not None}
+        if parsed:
+            self.cache.set(key, result)
+        return {**result, "cached": False, "latency_ms": latency_ms}
+
+
+def store_extractions(store, uid: str, extracted_texts: Sequence[str]) -> Optional[str]:
+    """
+    Keep the extracted text (PII) in the extraction store for later replay and
+    return its id, the only reference that goes into the audit log. Returns
+    None if the write fails; the scoring itself is not affected.
+    """
+    record_id = extraction_id(uid, normalize_extractions(extracted_texts))
+    try:
+        store.put(record_id, uid, extracted_texts)
+        return record_id
+    except Exception as e:
+        print(f"Failed to store extractions: {str(e)}")
+        return None
+
+
+# ---- Offline evaluation ----
+
+def load_extractions(store, directory: Optional[str] = None, db=None, limit: Optional[int] = None) -> List[dict]:
+    """
+    Stored financial scorings (extracted texts plus the score they got): the
+    FINANCIAL_SCORED events from the local NDJSON files, or from the
+    audit_events collection when a Firestore client is given, joined with
+    their text in the extraction store. Expired records are skipped.
+    """
+    if db is not None:
+        events = [doc.to_dict() for doc in db.collection("audit_events").where("type", "==", FINANCIAL_SCORED).stream()]
+        events.sort(key=lambda event: event.get("ts", ""))
+    else:
+        events = query(directory, event_type=FINANCIAL_SCORED)
+
+    events = [event for event in events if event.get("data", {}).get("extraction_id")]
+    records = []
+    for event in events[-limit:] if limit else events:
+        stored = store.get(event["data"]["extraction_id"])
+        if not stored:
+            continue
+        records.append({"id": event["id"], "uid": event.get("uid"), "baseline_score": event["data"]["score"],
+                        "baseline_prompt": event["data"].get("prompt"), "extractions": stored["extractions"]})
+    return records
+
+
+def _percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))]
+
+
+def evaluate(records: List[dict], candidate: prompts.Prompt, workers: int = 8, threshold: int = 5,
+             generate: Callable[..., str] = prompts.generate) -> dict:
+    """
+    Re-score stored extractions with a candidate prompt in parallel and report
+    drift against the recorded scores along with model latency.
+    """
+    # Fresh cache: identical extractions are scored once, everything else hits the model
+    scorer = FinancialScorer(TTLCache(max_entries=max(1, len(records))), generate=generate)
+
+    def run(record):
+        try:
+            return record, scorer.score(record["extractions"], candidate), None
+        except Exception as e:
+            return record, None, str(e)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        outcomes = list(pool.map(run, records))
+
+    drifts, latencies, details = [], [], []
+    errors = unparsed = 0
+    for record, result, error in outcomes:
+        if error:
+            errors += 1
+            details.append({"id": record["id"], "error": error})
+            continue
+        if not result["parsed"]:
+            unparsed += 1
+        if not result["cached"]:
+            latencies.append(result["latency_ms"])
+        drift = result["score"] - record["baseline_score"]
+        drifts.append(drift)
+        details.append({"id": record["id"], "uid": record["uid"], "baseline": record["baseline_score"],
+                        "candidate": result["score"], "drift": drift})
+
+    return {
+        "candidate": candidate.tag,
+        "model": candidate.model,
+        "baselines": dict(Counter(record["baseline_prompt"] or "unknown" for record in records)),
+        "replayed": len(records),
+        "errors": errors,
+        "unparsed": unparsed,
+        "drift": {
+            "mean": round(sum(drifts) / len(drifts), 2) if drifts else None,
+            "mean_abs": round(sum(abs(d) for d in drifts) / len(drifts), 2) if drifts else None,
+            "max_abs": max((abs(d) for d in drifts), default=None),
+            "changed": sum(1 for d in drifts if d),
+            f"over_{threshold}": sum(1 for d in drifts if abs(d) >= threshold)
+        },
+        "latency_ms": {
+            "calls": len(latencies),
+            "p50": _percentile(latencies, 50),
+            "p95": _percentile(latencies, 95),
+            "max": max(latencies, default=None)
+        },
+        "details": details
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay stored financial extractions against a prompt version")
+    parser.add_argument("--candidate", default="financial_score",
+                        help="Prompt name or name@version (default: the active financial_score version)")
+    parser.add_argument("--model", help="Override the candidate's model, e.g. gemini-2.5-pro")
+    parser.add_argument("--source", choices=["ndjson", "firestore"], default="ndjson",
+                        help="Where the audit events are read from")
+    parser.add_argument("--dir", default=os.getenv("AUDIT_LOG_DIR", "audit_logs"))
+    parser.add_argument("--store", choices=["local", "firestore"], default=os.getenv("EXTRACTION_STORE", "local"),
+                        help="Where the extracted text is read from")
+    parser.add_argument("--store-dir", default=os.getenv("EXTRACTION_STORE_DIR", "extractions"))
+    parser.add_argument("--limit", type=int, help="Only the most recent N scorings")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--threshold", type=int, default=5, help="Drift counted as significant")
+    parser.add_argument("--details", action="store_true", help="Include per-record drift")
+    args = parser.parse_args()
+
+    candidate = prompts.get(args.candidate)
+    if args.model:
+        candidate = dataclasses.replace(candidate, model=args.model)
+
+    from dotenv import load_dotenv
+    import google.generativeai as genai
+    load_dotenv()
+    genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+
+    db = None
+    if "firestore" in (args.source, args.store):
+        from utils.firebase_client import init_firestore
+        db = init_firestore()
+    store = FirestoreExtractionStore(db) if args.store == "firestore" else LocalExtractionStore(args.store_dir)
+    records = load_extractions(store, args.dir, db=db if args.source == "firestore" else None, limit=args.limit)
+
+    report = evaluate(records, candidate, workers=args.workers, threshold=args.threshold)
+    if not args.details:
+        report.pop("details")
+    print(json.dumps(report, indent=2))
@@ -0,0 +1,42 @@
+import os
+
+import firebase_admin
+from firebase_admin import credentials, firestore
+
+
+def firebase_config() -> dict:
+    """Service account credentials from the FIREBASE_* environment variables."""
+    return {
+        "type": os.getenv("FIREBASE_TYPE"),
+        "project_id": os.getenv("FIREBASE_PROJECT_ID"),
+        "private_key_id": os.getenv("FIREBASE_PRIVATE_KEY_ID"),
+        "private_key": (os.getenv("FIREBASE_PRIVATE_KEY") or "").replace('\\n', '\n'),
+        "client_email": os.getenv("FIREBASE_CLIENT_EMAIL"),
+        "client_id": os.getenv("FIREBASE_CLIENT_ID"),
+        "auth_uri": os.getenv("FIREBASE_AUTH_URI"),
+        "token_uri": os.getenv("FIREBASE_TOKEN_URI"),
+        "auth_provider_x509_cert_url": os.getenv("FIREBASE_AUTH_PROVIDER_X509_CERT_URL"),
+        "client_x509_cert_url": os.getenv("FIREBASE_CLIENT_X509_CERT_URL")
+    }
+
+
+def init_firestore() -> firestore.Client:
+    """
+    Initialize the default Firebase app and return a Firestore client.
+
+    Used by app.py and by the command line tools, which must not import app:
+    that would start its warm-up, listeners and background threads just to
+    get a client. Call load_dotenv() first.
+    """
+    if os.getenv("FIRESTORE_EMULATOR_HOST"):
+        # Local emulator: no service account needed
+        from google.auth.credentials import AnonymousCredentials
+        from google.cloud import firestore as gcloud_firestore
+        project_id = os.getenv("FIREBASE_PROJECT_ID", "demo-trustbridge")
+        if not firebase_admin._apps:
+            firebase_admin.initialize_app(options={"projectId": project_id})
+        return gcloud_firestore.Client(project=project_id, credentials=AnonymousCredentials())
+
+    if not firebase_admin._apps:
+        firebase_admin.initialize_app(credentials.Certificate(firebase_config()))
+    return firestore.client()
@@ -0,0 +1,127 @@
+import gzip
+import hashlib
+import json
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, Callable, Optional, Union
+
+from flask import Flask, Response, request
+from werkzeug.http import http_date
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_MIMETYPES = {"application/json", "text/plain", "text/html", "text/csv"}
+
+
+def _default(obj):
+    # Matches Flask's default JSON provider so clients see the same date format
+    if isinstance(obj, (datetime, date)):
+        return http_date(obj)
+    if isinstance(obj, Decimal):
+        return str(obj)
+    if hasattr(obj, "path"):  # Firestore DocumentReference
+        return obj.path
+    if hasattr(obj, "latitude") and hasattr(obj, "longitude"):  # Firestore GeoPoint
+        return {"latitude": obj.latitude, "longitude": obj.longitude}
+    if isinstance(obj, bytes):
+        return obj.decode("utf-8", errors="replace")
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps(payload: Any) -> bytes:
+    """Serialize a response payload, including Firestore types such as DatetimeWithNanoseconds."""
+    if orjson is not None:
+        return orjson.dumps(
+            payload,
+            default=_default,
+            option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS,
+        )
+    return json.dumps(payload, default=_default, sort_keys=True, separators=(",", ":")).encode("utf-8")
+
+
+def etag_for(*parts: Any) -> str:
+    """Strong ETag from values that change whenever the resource does (ids, update times)."""
+    return hashlib.sha256(repr(parts).encode("utf-8")).hexdigest()[:32]
+
+
+def _not_modified(etag: str) -> Optional[str]:
+    """The tag in If-None-Match that matches `etag`, or None when the client's copy is stale."""
+    if not request.if_none_match:
+        return None
+    # Compressed representations carry an encoding suffix, see init_compression
+    return next((tag for tag in (etag, f"{etag}-gzip", f"{etag}-br") if request.if_none_match.contains(tag)), None)
+
+
+def _with_etag(response: Response, etag: str) -> Response:
+    response.set_etag(etag)
+    # Let clients keep the body but always revalidate it
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+
+def conditional_json(payload: Union[Any, Callable[[], Any]], etag: Optional[str] = None, status: int = 200) -> Response:
+    """
+    JSON response honouring If-None-Match.
+
+    Args:
+        payload: Response body, or a callable producing it so that a 304 skips building it
+        etag: Precomputed ETag; when omitted it is derived from the serialized body
+        status: Status code for a full response
+    """
+    # A 304 repeats the tag the client holds, including its encoding suffix
+    matched = _not_modified(etag) if etag is not None else None
+    if matched:
+        return _with_etag(Response(status=304), matched)
+
+    body = dumps(payload() if callable(payload) else payload)
+    if etag is None:
+        etag = hashlib.sha256(body).hexdigest()[:32]
+        matched = _not_modified(etag)
+        if matched:
+            return _with_etag(Response(status=304), matched)
+    return _with_etag(Response(body, status=status, mimetype="application/json"), etag)
+
+
+def init_compression(app: Flask, min_size: int = 1024, gzip_level: int = 6) -> None:
+    """Compress buffered responses above `min_size` bytes with brotli (if installed) or gzip."""
+
+    @app.after_request
+    def compress_response(response):
+        if (response.status_code != 200
+                or response.direct_passthrough
+                or response.is_streamed
+                or "Content-Encoding" in response.headers
+                or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+            return response
+
+        accepted = request.accept_encodings
+        if brotli is not None and accepted["br"]:
+            encoding = "br"
+        elif accepted["gzip"]:
+            encoding = "gzip"
+        else:
+            return response
+
+        body = response.get_data()
+        if len(body) < min_size:
+            return response
+        if encoding == "br":
+            body = brotli.compress(body, quality=5)
+        else:
+            body = gzip.compress(body, compresslevel=gzip_level)
+
+        response.set_data(body)
+        response.headers["Content-Encoding"] = encoding
+        response.vary.add("Accept-Encoding")
+        etag, weak = response.get_etag()
+        if etag:
+            response.set_etag(f"{etag}-{encoding}", weak=weak)
+        return response
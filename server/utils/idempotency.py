@@ -0,0 +1,292 @@
+import hashlib
+import json
+import threading
+import time
+from datetime import datetime, timezone, timedelta
+from functools import wraps
+from typing import Optional
+
+from flask import request, jsonify, current_app, Response
+from firebase_admin import firestore
+from google.api_core.exceptions import AlreadyExists
+
+from utils.repositories import instrumentation
+from utils.ttl_cache import TTLCache
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+MAX_KEY_LENGTH = 255
+# Firestore documents are capped at 1 MiB; larger responses stay in the local tier only
+MAX_SHARED_BODY_BYTES = 900 * 1024
+# Transient refusals (rate limited, conflicting in-flight request) must not be
+# replayed: the client is expected to retry them with the same key
+UNCACHED_STATUSES = {409, 429}
+
+
+class IdempotencyStore:
+    """
+    Deduplicates retried POSTs that carry an `Idempotency-Key` header.
+
+    Keys are scoped to the route and the caller's uid, and bound to a
+    fingerprint of the request body: reusing a key with a different payload
+    is rejected with 422 instead of replaying another request's response.
+
+    Completed responses are kept in a bounded in-process TTL cache and, when a
+    Firestore client is given, in a shared `idempotency_keys` collection so that
+    retries landing on another gunicorn worker are deduplicated too. Concurrent
+    duplicates wait for the first execution instead of repeating it; if that
+    one ends without a cacheable response (5xx, 409, 429), a waiter runs the
+    request itself.
+
+    Routes whose responses carry PII (identity numbers, extracted document
+    text) use `idempotent(share_body=False)`: their bodies are only kept in
+    process memory, and the shared key is released on completion, so a retry
+    on another worker runs again rather than reading PII from Firestore.
+
+    Documents in `idempotency_keys` carry `expires_at`; configure a Firestore
+    TTL policy on that field (`gcloud firestore fields ttls update expires_at
+    --collection-group=idempotency_keys --enable-ttl`) or they accumulate.
+
+    Args:
+        db: Firestore client for the shared tier, or None for in-process only
+        ttl_seconds: How long a completed response can be replayed
+        max_entries: Size bound of the in-process tier
+        wait_timeout: How long a duplicate waits for the in-flight original
+        poll_interval: Polling interval while waiting on another worker
+    """
+
+    def __init__(self, db: Optional[firestore.Client] = None, collection: str = "idempotency_keys",
+                 ttl_seconds: float = 24 * 3600, max_entries: int = 2048,
+                 wait_timeout: float = 120.0, poll_interval: float = 0.5):
+        self.db = db
+        self.collection = collection
+        self.ttl_seconds = ttl_seconds
+        self.wait_timeout = wait_timeout
+        self.poll_interval = poll_interval
+        self._local = TTLCache(max_entries=max_entries, ttl_seconds=ttl_seconds)
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def idempotent(self, view=None, *, share_body: bool = True):
+        """
+        Route decorator; requests without the header run unchanged. Use as
+        `@idempotent` or `@idempotent(share_body=False)` for PII responses.
+        """
+        if view is None:
+            return lambda view: self.idempotent(view, share_body=share_body)
+
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            key = request.headers.get(IDEMPOTENCY_HEADER)
+            if not key:
+                return view(*args, **kwargs)
+            if len(key) > MAX_KEY_LENGTH:
+                return jsonify({"error": f"{IDEMPOTENCY_HEADER} must be at most {MAX_KEY_LENGTH} characters"}), 400
+
+            uid = kwargs.get("uid") or _request_uid()
+            scope = f"{request.method}:{request.path}:{uid or '-'}:{key}"
+            fingerprint = _fingerprint()
+            while True:
+                cached = self._local.get(scope)
+                if cached:
+                    return self._replay(cached, fingerprint)
+
+                with self._lock:
+                    event = self._inflight.get(scope)
+                    owner = event is None
+                    if owner:
+                        event = threading.Event()
+                        self._inflight[scope] = event
+                if owner:
+                    break
+                if not event.wait(self.wait_timeout):
+                    return self._in_progress()
+                # The original finished: replay it, or run the request if it left nothing cacheable
+
+            try:
+                shared = self._claim_shared(scope)
+                if shared == "pending":
+                    shared = self._wait_shared(scope)
+                    if shared == "pending":
+                        return self._in_progress()
+                if shared:
+                    self._local.set(scope, shared)
+                    return self._replay(shared, fingerprint)
+
+                try:
+                    response = current_app.make_response(view(*args, **kwargs))
+                except Exception:
+                    self._release_shared(scope)
+                    raise
+
+                if (response.status_code >= 500 or response.status_code in UNCACHED_STATUSES
+                        or response.is_streamed):
+                    # Server errors and transient refusals are not cached so the client can retry them
+                    self._release_shared(scope)
+                    return response
+
+                record = {
+                    "status": response.status_code,
+                    "body": response.get_data(),
+                    "mimetype": response.mimetype,
+                    "fingerprint": fingerprint,
+                }
+                self._local.set(scope, record)
+                if share_body:
+                    self._store_shared(scope, record)
+                else:
+                    self._release_shared(scope)
+                return response
+            finally:
+                with self._lock:
+                    self._inflight.pop(scope, None)
+                event.set()
+
+        return wrapper
+
+    # ---- Shared (Firestore) tier ----
+
+    def _doc(self, scope):
+        doc_id = hashlib.sha256(scope.encode("utf-8")).hexdigest()
+        return self.db.collection(self.collection).document(doc_id)
+
+    def _claim_shared(self, scope):
+        """
+        Returns None when this worker now owns the key, "pending" when another
+        worker is executing it, or the stored record when it already completed.
+        """
+        if self.db is None:
+            return None
+        now = datetime.now(timezone.utc)
+        doc_ref = self._doc(scope)
+        claim = {
+            "state": "pending",
+            "scope": scope,
+            "created_at": now,
+            "expires_at": now + timedelta(seconds=self.ttl_seconds),
+        }
+        try:
+            instrumentation.call("idempotency.claim", lambda: doc_ref.create(claim), writes=1, enforce=False)
+            return None
+        except AlreadyExists:
+            pass
+        except Exception as e:
+            print(f"Idempotency store unavailable, falling back to local tier: {str(e)}")
+            return None
+
+        try:
+            data = instrumentation.call("idempotency.get", doc_ref.get, reads=1, enforce=False).to_dict() or {}
+        except Exception as e:
+            print(f"Idempotency lookup failed: {str(e)}")
+            return None
+
+        stale = data.get("expires_at") and data["expires_at"] <= now
+        abandoned = (data.get("state") == "pending" and data.get("created_at")
+                     and data["created_at"] <= now - timedelta(seconds=self.wait_timeout))
+        if not data or stale or abandoned:
+            instrumentation.call("idempotency.claim", lambda: doc_ref.set(claim), writes=1, enforce=False)
+            return None
+        if data.get("state") == "completed":
+            return self._record_from_doc(data)
+        return "pending"
+
+    def _wait_shared(self, scope):
+        """Same contract as `_claim_shared`; "pending" means the wait timed out."""
+        doc_ref = self._doc(scope)
+        deadline = time.monotonic() + self.wait_timeout
+        while time.monotonic() < deadline:
+            time.sleep(self.poll_interval)
+            try:
+                snapshot = instrumentation.call("idempotency.get", doc_ref.get, reads=1, enforce=False)
+            except Exception as e:
+                print(f"Idempotency lookup failed: {str(e)}")
+                return "pending"
+            if not snapshot.exists:
+                # The original failed and released the key; let the retry run
+                return self._claim_shared(scope)
+            data = snapshot.to_dict()
+            if data.get("state") == "completed":
+                return self._record_from_doc(data)
+        return "pending"
+
+    def _store_shared(self, scope, record):
+        if self.db is None or len(record["body"]) > MAX_SHARED_BODY_BYTES:
+            return
+        completed = {
+            "state": "completed",
+            "status": record["status"],
+            "body": record["body"],
+            "mimetype": record["mimetype"],
+            "fingerprint": record["fingerprint"],
+            "completed_at": firestore.SERVER_TIMESTAMP,
+        }
+        try:
+            instrumentation.call("idempotency.store", lambda: self._doc(scope).set(completed, merge=True),
+                                 writes=1, enforce=False)
+        except Exception as e:
+            print(f"Failed to store idempotent response: {str(e)}")
+
+    def _release_shared(self, scope):
+        if self.db is None:
+            return
+        try:
+            instrumentation.call("idempotency.release", lambda: self._doc(scope).delete(), writes=1, enforce=False)
+        except Exception as e:
+            print(f"Failed to release idempotency key: {str(e)}")
+
+    @staticmethod
+    def _record_from_doc(data):
+        return {
+            "status": data.get("status", 200),
+            "body": bytes(data.get("body") or b""),
+            "mimetype": data.get("mimetype", "application/json"),
+            "fingerprint": data.get("fingerprint"),
+        }
+
+    # ---- Responses ----
+
+    @staticmethod
+    def _replay(record, fingerprint):
+        if record.get("fingerprint") and record["fingerprint"] != fingerprint:
+            return jsonify({"error": f"{IDEMPOTENCY_HEADER} was already used with a different request body"}), 422
+        response = Response(record["body"], status=record["status"], mimetype=record["mimetype"])
+        response.headers["Idempotent-Replayed"] = "true"
+        return response
+
+    @staticmethod
+    def _in_progress():
+        return jsonify({"error": "A request with this Idempotency-Key is still in progress"}), 409
+
+
+def _is_form():
+    return request.mimetype in ("multipart/form-data", "application/x-www-form-urlencoded")
+
+
+def _request_uid():
+    if _is_form():
+        return request.form.get("uid")
+    return (request.get_json(silent=True) or {}).get("uid")
+
+
+def _fingerprint():
+    """
+    sha256 of the request payload. Forms are hashed field by field (files by
+    content) because multipart boundaries change between retries; JSON is
+    hashed in canonical form.
+    """
+    digest = hashlib.sha256()
+    if _is_form():
+        for name, values in sorted(request.form.lists()):
+            digest.update(json.dumps([name, values]).encode("utf-8"))
+        for name, files in sorted(request.files.lists()):
+            for file in files:
+                digest.update(json.dumps([name, file.filename, file.mimetype]).encode("utf-8"))
+                digest.update(hashlib.sha256(file.read()).digest())
+                file.seek(0)
+        return digest.hexdigest()
+
+    payload = request.get_json(silent=True)
+    if payload is not None:
+        digest.update(json.dumps(payload, sort_keys=True, separators=(",", ":")).encode("utf-8"))
+    else:
+        digest.update(request.get_data())
+    return digest.hexdigest()
@@ -1,9 +1,8 @@
-from firebase_admin import firestore
+from utils.repositories import LoanRepo, OfferRepo
 
 def register_lender(db, uid, lender_data):
     try:
-        info_ref = db.collection("lenders").document(uid).collection("info").document("metadata")
-        info_ref.set(lender_data)
+        OfferRepo(db).register_lender(uid, lender_data)
         return {"status": "success", "message": "Lender registered"}
     except Exception as e:
         return {"status": "error", "message": str(e)}
@@ -11,8 +10,8 @@ def register_lender(db, uid, lender_data):
 
 def post_lender_offer(db, uid, offer_data):
     try:
-        offer_ref = db.collection("lenders").document(uid).collection("offers")
-        offer_ref.add(offer_data)
+        # Also folds the offer into the market statistics
+        OfferRepo(db).add_offer(uid, offer_data)
         return {"status": "success", "message": "Offer posted"}
     except Exception as e:
         return {"status": "error", "message": str(e)}
@@ -20,30 +19,26 @@ def post_lender_offer(db, uid, offer_data):
 
 def get_lender_offers(db, uid):
     try:
-        offers = db.collection("lenders").document(uid).collection("offers").stream()
+        offers = OfferRepo(db).list_for_lender(uid)
         return [doc.to_dict() | {"id": doc.id} for doc in offers]
     except Exception as e:
         return {"status": "error", "message": str(e)}
 
 def fetch_all_borrowers(db):
-    users_ref = db.collection("users")
     borrowers = []
 
-    for user_doc in users_ref.stream():
-        uid = user_doc.id
-        loans = db.collection("users").document(uid).collection("loans").stream()
-
-        for loan in loans:
-            loan_data = loan.to_dict()
-            if loan_data.get("status") == "pending":
-                borrowers.append({
-                    "uid": uid,
-                    "loan_id": loan.id,
-                    "amount": loan_data.get("amount"),
-                    "purpose": loan_data.get("purpose"),
-                    "timestamp": str(loan_data.get("timestamp")),
-                    "wallet": loan_data.get("wallet"),
-                    "status": loan_data.get("status", "unknown")
-                })
-
-    return borrowers
\ No newline at end of file
+    for uid, loan in LoanRepo(db).pending_loans():
+        borrowers.append(borrower_entry(uid, loan.id, loan.to_dict()))
+
+    return borrowers
+
+def borrower_entry(uid, loan_id, loan_data):
+    return {
+        "uid": uid,
+        "loan_id": loan_id,
+        "amount": loan_data.get("amount"),
+        "purpose": loan_data.get("purpose"),
+        "timestamp": str(loan_data.get("timestamp")),
+        "wallet": loan_data.get("wallet"),
+        "status": loan_data.get("status", "unknown")
+    }
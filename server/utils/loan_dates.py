@@ -0,0 +1,147 @@
+import re
+from datetime import date, datetime, timezone
+from functools import lru_cache
+from typing import Union
+
+DateLike = Union[int, str, date, datetime]
+
+_ISO_DATE = re.compile(r"(\d{4})-(\d{2})-(\d{2})")
+
+
+def to_day(value: DateLike) -> int:
+    """
+    Normalize a loan date to a UTC day number (proleptic Gregorian ordinal).
+
+    Accepts "YYYY-MM-DD" strings, dates and datetimes, including Firestore's
+    DatetimeWithNanoseconds. Aware datetimes are converted to UTC first;
+    naive datetimes and plain strings are taken to already be in UTC. Day
+    numbers are returned unchanged, so callers can normalize once and pass
+    the result on.
+
+    Raises:
+        ValueError: If the value is not a valid date
+    """
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value
+    if isinstance(value, str):
+        return _parse_day(value)
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc)
+        return value.toordinal()
+    if isinstance(value, date):
+        return value.toordinal()
+    raise ValueError(f"Unsupported date value: {value!r}")
+
+
+@lru_cache(maxsize=4096)
+def _parse_day(value: str) -> int:
+    match = _ISO_DATE.fullmatch(value)
+    if not match:
+        raise ValueError(f"Invalid date format. Use YYYY-MM-DD: {value!r}")
+    year, month, day = match.groups()
+    try:
+        return date(int(year), int(month), int(day)).toordinal()
+    except ValueError as e:
+        raise ValueError(f"Invalid date format. Use YYYY-MM-DD: {str(e)}")
+
+
+def day_to_str(day: int) -> str:
+    return date.fromordinal(day).isoformat()
+
+
+_DAYS_IN_MONTH = (31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31)
+
+
+def _add_months(year: int, month: int, day: int, months: int) -> int:
+    total = year * 12 + (month - 1) + months
+    year, month = divmod(total, 12)
+    month += 1
+    last = 29 if month == 2 and (year % 4 == 0 and (year % 100 != 0 or year % 400 == 0)) else _DAYS_IN_MONTH[month - 1]
+    return date(year, month, min(day, last)).toordinal()
+
+
+def add_months(day: int, months: int) -> int:
+    """Day number `months` calendar months later, clamped to month end like relativedelta."""
+    start = date.fromordinal(day)
+    return _add_months(start.year, start.month, start.day, months)
+
+
+@lru_cache(maxsize=65536)
+def overdue_months(due_day: int, current_day: int) -> int:
+    """
+    Months a loan is overdue, counting a started month as a full one.
+
+    Same result as `relativedelta(current, due)` with `years * 12 + months`
+    plus one when there are leftover days, computed on day numbers. Returns 0
+    when the loan is not yet due.
+    """
+    if current_day <= due_day:
+        return 0
+    due = date.fromordinal(due_day)
+    current = date.fromordinal(current_day)
+    months = (current.year - due.year) * 12 + (current.month - due.month)
+    anniversary = _add_months(due.year, due.month, due.day, months)
+    if anniversary > current_day:
+        months -= 1
+        anniversary = _add_months(due.year, due.month, due.day, months)
+    if current_day > anniversary:
+        months += 1
+    return months
+
+
+def _benchmark(iterations: int = 20000) -> None:
+    """
+    Per-loan CPU cost of the old string round-trip path vs. the day-number
+    path, over `iterations` loans with distinct dates so the lru_caches do
+    not answer from a single entry. The day-number path is timed on the
+    undecorated computation; the warm-cache row is shown separately.
+    """
+    import random
+    import timeit
+    from datetime import timedelta
+    from dateutil.relativedelta import relativedelta
+
+    rng = random.Random(0)
+    start = datetime(2020, 1, 1, tzinfo=timezone.utc)
+    loans = []
+    for _ in range(iterations):
+        issue = start + timedelta(days=rng.randrange(1500), minutes=rng.randrange(1440))
+        due = issue + timedelta(days=30)
+        now = due + timedelta(days=rng.randrange(-30, 400), minutes=rng.randrange(1440))
+        loans.append((issue, due, now))
+
+    def legacy():
+        for issue, due, now in loans:
+            issue_str = issue.astimezone(timezone.utc).strftime("%Y-%m-%d")
+            due_str = due.astimezone(timezone.utc).strftime("%Y-%m-%d")
+            current_str = now.strftime("%Y-%m-%d")
+            # calculate_total_due
+            datetime.strptime(issue_str, "%Y-%m-%d").replace(tzinfo=timezone.utc)
+            d = datetime.strptime(due_str, "%Y-%m-%d").replace(tzinfo=timezone.utc)
+            c = datetime.strptime(current_str, "%Y-%m-%d").replace(tzinfo=timezone.utc)
+            delta = relativedelta(c, d)
+            delta.years * 12 + delta.months + (1 if delta.days > 0 else 0)
+            # check_and_release_documents
+            d = datetime.strptime(due_str, "%Y-%m-%d")
+            c = datetime.strptime(current_str, "%Y-%m-%d")
+            delta = relativedelta(c, d)
+            delta.years * 12 + delta.months + (1 if delta.days > 0 else 0)
+
+    def day_numbers(months):
+        def run():
+            for issue, due, now in loans:
+                to_day(issue)
+                months(to_day(due), to_day(now))
+        return run
+
+    overdue_months.cache_clear()
+    runs = (("legacy", legacy), ("days", day_numbers(overdue_months.__wrapped__)),
+            ("days, warm cache", day_numbers(overdue_months)))
+    for name, fn in runs:
+        seconds = min(timeit.repeat(fn, number=1, repeat=5))
+        print(f"{name:>16}: {seconds / iterations * 1e6:.2f} us per loan")
+
+
+if __name__ == "__main__":
+    _benchmark()
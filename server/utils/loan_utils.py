@@ -1,7 +1,15 @@
-from datetime import datetime, timezone
-from dateutil.relativedelta import relativedelta
+from datetime import datetime
 from firebase_admin import firestore
-from typing import Union, Optional
+from typing import TYPE_CHECKING, Union, Optional
+
+from utils.loan_dates import to_day, overdue_months
+
+if TYPE_CHECKING:
+    # Annotation only: repositories imports this module through utils.repayment
+    from utils.repositories import LoanRepo
+
+# Penalty rule: 5% compound per overdue month, capped at this many months
+MAX_PENALTY_MONTHS = 2
 
 def calculate_total_due(
     principal: float,
@@ -28,71 +36,50 @@ def calculate_total_due(
     if not isinstance(principal, (int, float)) or principal <= 0:
         raise ValueError("Principal must be a positive number")
 
-    # Convert string dates to datetime objects and handle timezone-naive dates
-    try:
-        if isinstance(issue_date, str):
-            issue_date = datetime.strptime(issue_date, "%Y-%m-%d").replace(tzinfo=timezone.utc)
-
-        if isinstance(due_date, str):
-            due_date = datetime.strptime(due_date, "%Y-%m-%d").replace(tzinfo=timezone.utc)
+    # Normalize all dates to UTC day numbers (strings and naive datetimes are taken as UTC)
+    issue_day, due_day, current_day = to_day(issue_date), to_day(due_date), to_day(current_date)
 
-        if isinstance(current_date, str):
-            current_date = datetime.strptime(current_date, "%Y-%m-%d").replace(tzinfo=timezone.utc)
+    validate_loan_days(issue_day, due_day, current_day)
+    return total_due_for_months(principal, overdue_months(due_day, current_day))
 
-    except ValueError as e:
-        raise ValueError(f"Invalid date format. Use YYYY-MM-DD: {str(e)}")
-
-    # Validate date order
-    if issue_date > due_date:
+def validate_loan_days(issue_day: int, due_day: int, current_day: int) -> None:
+    """Date-order checks on UTC day numbers (see utils.loan_dates.to_day)."""
+    if issue_day > due_day:
         raise ValueError("Issue date cannot be after due date")
-    if issue_date > current_date:
+    if issue_day > current_day:
         raise ValueError("Issue date cannot be after current date")
 
+def total_due_for_months(principal: float, months_overdue: int) -> float:
+    """Principal plus 5% compound interest per overdue month (capped at 2 months)."""
     # Return principal if not overdue
-    if current_date <= due_date:
+    if months_overdue <= 0:
         return float(principal)
 
-    # Calculate overdue months (capped at 2)
-    delta = relativedelta(current_date, due_date)
-    months_overdue = delta.years * 12 + delta.months
-    if delta.days > 0:
-        months_overdue += 1
-    months_overdue = min(months_overdue, 2)
-
     # Calculate total due with 5% compound interest per month overdue
+    months_overdue = min(months_overdue, MAX_PENALTY_MONTHS)
     total_due = principal * ((1 + 0.05) ** months_overdue)
     return round(total_due, 2)
 
 def check_and_release_documents(
-    db: firestore.Client,  # Pass firestore client as parameter
+    loans: "LoanRepo",  # Pass the caller's loan repository
     uid: str,
     loan_id: str,
     due_date: Union[str, datetime],
-    current_date: Union[str, datetime]
+    current_date: Union[str, datetime],
+    months_overdue: Optional[int] = None
 ) -> bool:
     # Validate inputs
     if not uid or not loan_id:
         raise ValueError("User ID and Loan ID cannot be empty")
 
-    # Convert string dates to datetime objects
-    try:
-        if isinstance(due_date, str):
-            due_date = datetime.strptime(due_date, "%Y-%m-%d")
-        if isinstance(current_date, str):
-            current_date = datetime.strptime(current_date, "%Y-%m-%d")
-    except ValueError as e:
-        raise ValueError(f"Invalid date format. Use YYYY-MM-DD: {str(e)}")
-
-    # Calculate overdue months
-    delta = relativedelta(current_date, due_date)
-    months_overdue = delta.years * 12 + delta.months
-    if delta.days > 0:
-        months_overdue += 1
+    # Reuse the caller's overdue months when it already computed them for the penalty
+    if months_overdue is None:
+        months_overdue = overdue_months(to_day(due_date), to_day(current_date))
 
     # Release documents if overdue more than 2 months
-    if months_overdue > 2:
+    if months_overdue > MAX_PENALTY_MONTHS:
         try:
-            db.collection("users").document(uid).collection("loans").document(loan_id).update({
+            loans.update(uid, loan_id, {
                 "documents_released": True,
                 "release_date": firestore.SERVER_TIMESTAMP
             })
@@ -0,0 +1,158 @@
+import argparse
+import json
+import math
+from collections import Counter
+from typing import Optional
+
+from firebase_admin import firestore
+
+# Interest rates are bucketed at 0.25% resolution over 0-100%; exact to within half a bin
+RATE_BIN_WIDTH = 0.25
+MAX_RATE = 100.0
+AMOUNT_BUCKETS = ((1000, "<1k"), (5000, "1k-5k"), (10000, "5k-10k"), (50000, "10k-50k"), (float("inf"), "50k+"))
+PERCENTILES = (10, 25, 50, 75, 90)
+
+
+def _rate_bin(rate: float) -> int:
+    return int(min(max(rate, 0.0), MAX_RATE) / RATE_BIN_WIDTH)
+
+
+def _amount_bucket(amount: float) -> str:
+    return next(label for limit, label in AMOUNT_BUCKETS if amount < limit)
+
+
+def parse_offer(offer_data: dict):
+    """Return (amount, interest_rate) of an offer, or None if either is missing or invalid."""
+    try:
+        amount = float(offer_data.get("amount"))
+        rate = float(offer_data.get("interest_rate"))
+    except (TypeError, ValueError):
+        return None
+    if not (math.isfinite(amount) and math.isfinite(rate)) or amount <= 0 or rate < 0:
+        return None
+    return amount, rate
+
+
+class OfferBookSketch:
+    """
+    Mergeable summary of lender offers: count, total capital, a fixed-bin
+    interest-rate histogram and counts per amount bucket. Sketches built on
+    disjoint sets of offers merge by adding their counters, so the stored
+    aggregate can be maintained with Firestore increments.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.capital = 0.0
+        self.rate_bins = Counter()
+        self.amount_buckets = Counter()
+
+    def add(self, amount: float, rate: float) -> None:
+        self.count += 1
+        self.capital += amount
+        self.rate_bins[_rate_bin(rate)] += 1
+        self.amount_buckets[_amount_bucket(amount)] += 1
+
+    def merge(self, other: "OfferBookSketch") -> "OfferBookSketch":
+        self.count += other.count
+        self.capital += other.capital
+        self.rate_bins.update(other.rate_bins)
+        self.amount_buckets.update(other.amount_buckets)
+        return self
+
+    def percentile(self, q: float) -> Optional[float]:
+        total = sum(self.rate_bins.values())
+        if not total:
+            return None
+        rank = q / 100 * total
+        seen = 0
+        for index in sorted(self.rate_bins):
+            seen += self.rate_bins[index]
+            if seen >= rank:
+                return round((index + 0.5) * RATE_BIN_WIDTH, 2)
+        return round((max(self.rate_bins) + 0.5) * RATE_BIN_WIDTH, 2)
+
+    def to_doc(self) -> dict:
+        return {
+            "offer_count": self.count,
+            "total_capital": self.capital,
+            "rate_bins": {str(index): n for index, n in self.rate_bins.items()},
+            "amount_buckets": dict(self.amount_buckets)
+        }
+
+    @classmethod
+    def from_doc(cls, data: dict) -> "OfferBookSketch":
+        sketch = cls()
+        sketch.count = data.get("offer_count", 0)
+        sketch.capital = data.get("total_capital", 0.0)
+        sketch.rate_bins = Counter({int(index): n for index, n in data.get("rate_bins", {}).items()})
+        sketch.amount_buckets = Counter(data.get("amount_buckets", {}))
+        return sketch
+
+    def summary(self) -> dict:
+        histogram = Counter()
+        for index, n in self.rate_bins.items():
+            histogram[int(index * RATE_BIN_WIDTH)] += n
+        return {
+            "offer_count": self.count,
+            "total_available_capital": round(self.capital, 2),
+            "interest_rate_percentiles": {f"p{q}": self.percentile(q) for q in PERCENTILES},
+            "interest_rate_histogram": [
+                {"from": rate, "to": rate + 1, "count": histogram[rate]} for rate in sorted(histogram)
+            ],
+            "offers_by_amount": {label: self.amount_buckets.get(label, 0) for _, label in AMOUNT_BUCKETS}
+        }
+
+
+def stats_ref(db: firestore.Client):
+    return db.collection("market").document("offer_stats")
+
+
+def offer_increments(offer_data: dict) -> Optional[dict]:
+    """Firestore increments that fold one new offer into the stored sketch."""
+    parsed = parse_offer(offer_data)
+    if parsed is None:
+        return None
+    amount, rate = parsed
+    return {
+        "offer_count": firestore.Increment(1),
+        "total_capital": firestore.Increment(amount),
+        "rate_bins": {str(_rate_bin(rate)): firestore.Increment(1)},
+        "amount_buckets": {_amount_bucket(amount): firestore.Increment(1)},
+        "updated_at": firestore.SERVER_TIMESTAMP
+    }
+
+
+def get_market_stats(db: firestore.Client) -> dict:
+    """Summary of the stored sketch; one document read regardless of the number of offers."""
+    snapshot = stats_ref(db).get()
+    sketch = OfferBookSketch.from_doc(snapshot.to_dict() or {}) if snapshot.exists else OfferBookSketch()
+    return sketch.summary()
+
+
+def rebuild(db: firestore.Client) -> dict:
+    """Recompute the sketch from a collection-group scan of all lenders' offers."""
+    sketch = OfferBookSketch()
+    skipped = 0
+    for offer in db.collection_group("offers").stream():
+        parsed = parse_offer(offer.to_dict())
+        if parsed is None:
+            skipped += 1
+            continue
+        sketch.add(*parsed)
+    stats_ref(db).set({**sketch.to_doc(), "updated_at": firestore.SERVER_TIMESTAMP})
+    return {"offers": sketch.count, "skipped": skipped}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offer book market statistics")
+    parser.add_argument("command", choices=["rebuild", "show"])
+    args = parser.parse_args()
+
+    # Standalone client: importing app would start its background workers
+    from dotenv import load_dotenv
+    from utils.firebase_client import init_firestore
+    load_dotenv()
+    db = init_firestore()
+    result = rebuild(db) if args.command == "rebuild" else get_market_stats(db)
+    print(json.dumps(result, indent=2))
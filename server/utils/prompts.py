@@ -0,0 +1,205 @@
+import os
+import threading
+from dataclasses import dataclass
+from string import Template
+from typing import Dict, List, Optional, Sequence
+
+import google.generativeai as genai
+
+
+@dataclass(frozen=True)
+class Prompt:
+    """
+    One immutable version of a prompt template and the model it runs on.
+    Templates use `$field` placeholders so JSON examples need no escaping.
+    A new wording or model is a new version; never edit a registered one,
+    since cached and audited results are keyed on `tag` and `model`.
+    """
+
+    name: str
+    version: str
+    model: str
+    template: str
+    temperature: float = 0.0
+    response_mime_type: Optional[str] = None
+
+    @property
+    def tag(self) -> str:
+        return f"{self.name}@{self.version}"
+
+    def render(self, **fields) -> str:
+        return Template(self.template).substitute(fields)
+
+    def generation_config(self) -> dict:
+        config = {"temperature": self.temperature}
+        if self.response_mime_type:
+            config["response_mime_type"] = self.response_mime_type
+        return config
+
+
+_registry: Dict[str, Dict[str, Prompt]] = {}
+
+
+def register(prompt: Prompt) -> Prompt:
+    versions = _registry.setdefault(prompt.name, {})
+    if prompt.version in versions:
+        raise ValueError(f"Prompt {prompt.tag} is already registered")
+    versions[prompt.version] = prompt
+    return prompt
+
+
+def _overrides() -> Dict[str, str]:
+    # PROMPT_VERSIONS="financial_score=v2,face_match=v1" pins versions per deploy
+    pairs = (item.split("=", 1) for item in os.getenv("PROMPT_VERSIONS", "").split(",") if "=" in item)
+    return {name.strip(): version.strip() for name, version in pairs}
+
+
+def active_version(name: str) -> str:
+    """The pinned version from PROMPT_VERSIONS, else the most recently registered one."""
+    if name not in _registry:
+        raise KeyError(f"Unknown prompt: {name}")
+    return _overrides().get(name) or list(_registry[name])[-1]
+
+
+def get(name: str, version: Optional[str] = None) -> Prompt:
+    """Look up a prompt by name (and version), or by a `name@version` tag."""
+    if version is None and "@" in name:
+        name, version = name.split("@", 1)
+    version = version or active_version(name)
+    try:
+        return _registry[name][version]
+    except KeyError:
+        raise KeyError(f"Unknown prompt: {name}@{version}") from None
+
+
+def versions(name: str) -> List[str]:
+    return list(_registry.get(name, {}))
+
+
+def active_models() -> List[str]:
+    return sorted({get(name).model for name in _registry})
+
+
+_models: Dict[str, genai.GenerativeModel] = {}
+_models_lock = threading.Lock()
+
+
+def model_for(prompt: Prompt) -> genai.GenerativeModel:
+    with _models_lock:
+        if prompt.model not in _models:
+            _models[prompt.model] = genai.GenerativeModel(prompt.model)
+        return _models[prompt.model]
+
+
+def generate(prompt: Prompt, inline_data: Sequence[dict] = (), **fields) -> str:
+    """Render the prompt, send it with any inline_data parts and return the response text."""
+    parts = [{"text": prompt.render(**fields)}] + [{"inline_data": data} for data in inline_data]
+    response = model_for(prompt).generate_content(
+        contents=[{"parts": parts}],
+        generation_config=prompt.generation_config()
+    )
+    return response.text if response and response.text else ""
+
+
+# ---- Registered prompts ----
+
+register(Prompt("identity_extraction", "v1", "gemini-2.5-flash", """
+You are extracting user identity details from official Indian documents (PAN card, Aadhaar card).
+Strictly extract:
+- Full Name
+- PAN Number (if available)
+- Aadhaar Number (if available)
+- Phone Number (if available)
+
+Output format (plain text):
+Name: [full name]
+PAN: [PAN number]
+Aadhaar: [12-digit number]
+Phone: [10-digit number]
+
+If irrelevant or no values found, return only: "Invalid document"
+"""))
+
+register(Prompt("financial_extraction", "v1", "gemini-2.5-flash", """
+You are analyzing financial documents to evaluate a user's financial reliability.
+Documents may include:
+- Income Tax Returns (ITR)
+- Electricity bills
+- Gas bills
+- Rent receipts
+- Water bills
+- Phone/Internet bills
+- Bank statements
+- Property tax receipts
+- Insurance premium receipts
+
+Extract:
+- Document Type
+- Amount
+- Date
+- Account Holder
+- Outstanding Due
+- Payment Consistency (if visible)
+
+If invalid or irrelevant, respond with: "Invalid financial document"
+
+Output:
+Document Type: [type]
+Amount: [amount]
+Date: [date]
+Account Holder: [name]
+Outstanding Due: [yes/no]
+Notes: [summary]
+"""))
+
+register(Prompt("financial_score", "v1", "gemini-2.5-flash", """
+You are evaluating a user's financial reliability based on their submitted financial documents.
+
+The documents may include:
+- Income Tax Returns (ITR)
+- Electricity bills
+- Gas bills
+- Rent receipts
+- Water bills
+- Phone/Internet bills
+- Bank statements
+- Property tax receipts
+- Insurance premium receipts
+
+Scoring Guidelines (0–60):
+
+- 50–60: User has submitted 3 or more valid and recent documents. Payments are consistent and on time. Documents are clearly legible and contain complete financial and personal information.
+
+- 30–49: User has submitted 1–2 valid documents. There may be inconsistencies (e.g., partial data, outdated documents, or occasional late payments). Overall moderately reliable.
+
+- 10–29: Documents are low-quality, outdated, or show irregular payments. Some documents may be hard to read, missing key details, or only partially relevant.
+
+- 0–9: No valid documents submitted, or all are invalid, irrelevant, or unreadable.
+
+Instructions:
+Analyze the user's extracted document data below and assign a trust score between 0 and 60.
+
+User's document data:
+$documents
+
+Respond in the following format (plain text):
+Score: [number 0–60]
+Explanation: [brief explanation of reasoning]
+"""))
+
+register(Prompt("face_match", "v1", "gemini-2.5-flash", """
+You are a strict identity verification AI.
+I have provided two images:
+1. A live selfie of a person.
+2. An ID document (Passport, Aadhaar, PAN, etc.) containing a photo.
+
+Task: Compare the face in the live selfie with the face in the ID document.
+Ignore differences in age, lighting, or hair style, but focus on facial structure (eyes, nose, jawline).
+
+Output strictly in this JSON format (no markdown, no extra text):
+{
+    "match": boolean,
+    "confidence": number_between_0_and_100,
+    "reason": "short explanation of why they match or do not match"
+}
+""", response_mime_type="application/json"))
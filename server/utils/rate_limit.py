@@ -0,0 +1,249 @@
+import hashlib
+import math
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone, timedelta
+from functools import wraps
+from typing import Callable, Dict, Optional
+
+from flask import request, jsonify
+from firebase_admin import firestore
+
+from utils.repositories import instrumentation
+from utils.ttl_cache import TTLCache
+
+
+@dataclass(frozen=True)
+class RouteClass:
+    """
+    Admission policy shared by a group of routes.
+
+    Args:
+        rate: Tokens refilled per second for each client
+        burst: Bucket capacity, i.e. requests a client may fire back to back
+        max_concurrent: Requests of this class executing at once in this worker;
+            the process-wide cap is max_concurrent x gunicorn workers
+        max_queue: Requests allowed to wait for a slot in this worker; beyond this load is shed
+        max_wait: Seconds a queued request waits before giving up
+    """
+    rate: float
+    burst: int
+    max_concurrent: int
+    max_queue: int
+    max_wait: float
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: int, clock: Callable[[], float] = time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self._clock = clock
+        self.tokens = float(capacity)
+        self.updated = clock()
+
+    def take(self) -> float:
+        """Consume one token. Returns 0 on success, else seconds until one is available."""
+        now = self._clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class LocalBucketBackend:
+    """Per-client buckets held in this process; idle buckets are evicted once full again."""
+
+    def __init__(self, max_clients: int = 10000, clock: Callable[[], float] = time.monotonic):
+        self._clock = clock
+        self._buckets = TTLCache(max_entries=max_clients, clock=clock)
+        self._lock = threading.Lock()
+
+    def take(self, key: str, policy: RouteClass) -> float:
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = TokenBucket(policy.rate, policy.burst, clock=self._clock)
+            retry_after = bucket.take()
+            self._buckets.set(key, bucket, ttl_seconds=policy.burst / policy.rate)
+            return retry_after
+
+
+class FirestoreBucketBackend:
+    """
+    Per-client buckets shared by all workers through a `rate_limits` collection.
+    Falls back to a local bucket when Firestore is unreachable. Only the
+    buckets are shared; concurrency caps and queues stay per worker. Bucket
+    documents carry `expires_at`; configure a Firestore TTL policy on it so
+    idle clients' buckets are deleted.
+    """
+
+    def __init__(self, db: firestore.Client, collection: str = "rate_limits",
+                 clock: Callable[[], float] = time.time):
+        self.db = db
+        self.collection = collection
+        self._clock = clock
+        self._fallback = LocalBucketBackend()
+
+    def take(self, key: str, policy: RouteClass) -> float:
+        doc_id = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        ref = self.db.collection(self.collection).document(doc_id)
+        try:
+            return instrumentation.call("rate_limits.take",
+                                        lambda: _take_shared(self.db.transaction(), ref, policy, self._clock()),
+                                        reads=1, writes=1, enforce=False)
+        except Exception as e:
+            print(f"Shared rate limit backend failed, using local bucket: {str(e)}")
+            return self._fallback.take(key, policy)
+
+
+@firestore.transactional
+def _take_shared(transaction, ref, policy, now):
+    snapshot = ref.get(transaction=transaction)
+    data = snapshot.to_dict() if snapshot.exists else {}
+    tokens = data.get("tokens", policy.burst)
+    updated = data.get("updated", now)
+    tokens = min(policy.burst, tokens + max(0.0, now - updated) * policy.rate)
+    retry_after = 0.0
+    if tokens >= 1:
+        tokens -= 1
+    else:
+        retry_after = (1 - tokens) / policy.rate
+    transaction.set(ref, {
+        "tokens": tokens,
+        "updated": now,
+        "expires_at": datetime.now(timezone.utc) + timedelta(seconds=policy.burst / policy.rate),
+    })
+    return retry_after
+
+
+class ConcurrencyGate:
+    """
+    Caps concurrent executions and holds a bounded queue of waiters. Queued
+    requests re-check their deadline at least every `poll_interval` seconds,
+    so the wait is measured on `clock` rather than on the condition's timer.
+    """
+
+    def __init__(self, policy: RouteClass, clock: Callable[[], float] = time.monotonic,
+                 poll_interval: float = 0.1):
+        self.policy = policy
+        self.active = 0
+        self.waiting = 0
+        self._clock = clock
+        self._poll_interval = poll_interval
+        self._cond = threading.Condition()
+
+    def acquire(self) -> Optional[str]:
+        """Returns None once a slot is held, "shed" when the queue is full, "timeout" after max_wait."""
+        with self._cond:
+            if self.active < self.policy.max_concurrent and self.waiting == 0:
+                self.active += 1
+                return None
+            if self.waiting >= self.policy.max_queue:
+                return "shed"
+            self.waiting += 1
+            try:
+                deadline = self._clock() + self.policy.max_wait
+                while self.active >= self.policy.max_concurrent:
+                    remaining = deadline - self._clock()
+                    if remaining <= 0:
+                        return "timeout"
+                    self._cond.wait(min(remaining, self._poll_interval))
+                self.active += 1
+                return None
+            finally:
+                self.waiting -= 1
+
+    def release(self) -> None:
+        with self._cond:
+            self.active -= 1
+            self._cond.notify()
+
+
+def client_identity(trusted_proxies: int = 0,
+                    verify_token: Optional[Callable[[str], Optional[str]]] = None) -> Callable[[], str]:
+    """
+    Build the bucket-key function. Nothing in the request body is trusted: a
+    client could rotate it to get a fresh bucket on every call.
+
+    Args:
+        trusted_proxies: Reverse proxies in front of the app that append to
+            X-Forwarded-For. The client address is the entry the outermost
+            trusted proxy appended; with 0 the header is ignored.
+        verify_token: Optional callable mapping a Firebase ID token from an
+            `Authorization: Bearer` header to its uid, or None if invalid
+    """
+
+    def identity() -> str:
+        if verify_token:
+            header = request.headers.get("Authorization", "")
+            if header.startswith("Bearer "):
+                uid = verify_token(header[len("Bearer "):].strip())
+                if uid:
+                    return f"uid:{uid}"
+        ip = request.remote_addr
+        if trusted_proxies > 0:
+            forwarded = [hop.strip() for hop in request.headers.get("X-Forwarded-For", "").split(",") if hop.strip()]
+            if len(forwarded) >= trusted_proxies:
+                ip = forwarded[-trusted_proxies]
+        return f"ip:{ip or 'unknown'}"
+
+    return identity
+
+
+class AdmissionController:
+    """
+    Per-client token buckets plus a per-route-class concurrency cap with a
+    bounded wait queue. Concurrency is capped per gunicorn worker even with the
+    shared bucket backend. Rejections carry a `Retry-After` header: 429 when the
+    client is over its rate or its queued wait expires, 503 when the queue is
+    already full and the request is shed outright.
+
+    Args:
+        policies: Route class name -> RouteClass
+        backend: Bucket store; LocalBucketBackend or FirestoreBucketBackend
+        identity: Callable returning the client key for the current request, see client_identity
+        clock: Monotonic time source for buckets and queue waits, injectable for tests
+    """
+
+    def __init__(self, policies: Dict[str, RouteClass], backend=None,
+                 identity: Optional[Callable[[], str]] = None, clock: Callable[[], float] = time.monotonic):
+        self.policies = policies
+        self.backend = backend or LocalBucketBackend(clock=clock)
+        self.identity = identity or client_identity()
+        self._gates = {name: ConcurrencyGate(policy, clock=clock) for name, policy in policies.items()}
+
+    def limit(self, route_class: str):
+        policy = self.policies[route_class]
+        gate = self._gates[route_class]
+
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                key = f"{route_class}:{self.identity()}"
+                retry_after = self.backend.take(key, policy)
+                if retry_after > 0:
+                    return _reject(429, "Rate limit exceeded", retry_after)
+
+                outcome = gate.acquire()
+                if outcome == "shed":
+                    return _reject(503, "Server is busy, please retry later", policy.max_wait)
+                if outcome == "timeout":
+                    return _reject(429, "Timed out waiting for capacity", policy.max_wait)
+                try:
+                    return view(*args, **kwargs)
+                finally:
+                    gate.release()
+
+            return wrapper
+
+        return decorator
+
+
+def _reject(status, message, retry_after):
+    response = jsonify({"error": message, "retry_after": math.ceil(retry_after)})
+    response.status_code = status
+    response.headers["Retry-After"] = str(max(1, math.ceil(retry_after)))
+    return response
@@ -0,0 +1,106 @@
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Callable, Tuple
+
+
+class Readiness:
+    """
+    Warm-up routine and readiness state for an instance.
+
+    Registered checks open connections and prime caches (Firestore channel,
+    auth certificates, Gemini client, ...). `start()` runs them all in
+    parallel in the background and retries the failed ones until every
+    required check has passed, so /readyz only reports ready once the first
+    users will not pay the connection setup cost.
+
+    Args:
+        retry_interval: Seconds between retries of failed checks
+        timeout: Seconds a single check may take before it counts as failed
+    """
+
+    def __init__(self, retry_interval: float = 30.0, timeout: float = 15.0):
+        self.retry_interval = retry_interval
+        self.timeout = timeout
+        self._checks = {}
+        self._results = {}
+        self._lock = threading.Lock()
+        self._started = False
+
+    def add_check(self, name: str, check: Callable[[], object], required: bool = True) -> None:
+        """A check passes unless it raises or returns False."""
+        self._checks[name] = (check, required)
+
+    def _run(self, name):
+        check, required = self._checks[name]
+        started = time.perf_counter()
+        try:
+            ok = check() is not False
+            error = None if ok else "check returned False"
+        except Exception as e:
+            ok, error = False, str(e)
+        result = {
+            "ok": ok,
+            "required": required,
+            "latency_ms": round((time.perf_counter() - started) * 1000, 1),
+            "checked_at": datetime.now(timezone.utc).isoformat()
+        }
+        if error:
+            result["error"] = error
+        with self._lock:
+            self._results[name] = result
+        return ok
+
+    def warm_up(self, names=None) -> bool:
+        """Run the given (default: all) checks in parallel; True if all passed."""
+        names = list(names or self._checks)
+        # Daemon threads so a hung dependency never blocks shutdown
+        threads = {name: threading.Thread(target=self._run, args=(name,), name=f"warmup-{name}", daemon=True)
+                   for name in names}
+        for thread in threads.values():
+            thread.start()
+        deadline = time.monotonic() + self.timeout
+        for name, thread in threads.items():
+            thread.join(max(0.0, deadline - time.monotonic()))
+            if thread.is_alive():
+                with self._lock:
+                    self._results[name] = {
+                        "ok": False,
+                        "required": self._checks[name][1],
+                        "error": f"timed out after {self.timeout}s"
+                    }
+        with self._lock:
+            return all(self._results.get(name, {}).get("ok") for name in names)
+
+    def start(self) -> None:
+        """
+        Warm up in the background. Every check runs once; failed required
+        checks are retried until they pass, while a failed optional check is
+        only reported, so a missing credential is not retried forever.
+        """
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+
+        def loop():
+            pending = list(self._checks)
+            while pending:
+                self.warm_up(pending)
+                with self._lock:
+                    pending = [name for name in pending
+                               if self._checks[name][1] and not self._results.get(name, {}).get("ok")]
+                if pending:
+                    time.sleep(self.retry_interval)
+
+        threading.Thread(target=loop, name="warmup", daemon=True).start()
+
+    def status(self) -> Tuple[bool, dict]:
+        """(ready, per-dependency results). Ready once every required check has passed."""
+        with self._lock:
+            results = dict(self._results)
+        ready = all(
+            results.get(name, {}).get("ok")
+            for name, (_, required) in self._checks.items() if required
+        )
+        return ready, results
@@ -0,0 +1,283 @@
+import math
+from datetime import datetime, timezone
+from firebase_admin import firestore
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from utils.loan_dates import DateLike, to_day, day_to_str, add_months, overdue_months
+from utils.loan_utils import total_due_for_months
+
+# Loans requested without terms are a single 30-day repayment, as before
+DEFAULT_INSTALLMENTS = 1
+DEFAULT_INTEREST_RATE = 0.0
+
+
+def loan_terms(loan_data: dict) -> Tuple[float, float, int]:
+    """Return (principal, flat interest rate in percent, number of installments) of a loan document."""
+    principal = float(loan_data["amount"])
+    rate = float(loan_data.get("interest_rate") or DEFAULT_INTEREST_RATE)
+    installments = int(loan_data.get("installments") or DEFAULT_INSTALLMENTS)
+    if not math.isfinite(principal) or principal <= 0:
+        raise ValueError("Principal must be a positive number")
+    if not math.isfinite(rate) or rate < 0:
+        raise ValueError("Interest rate cannot be negative")
+    if installments <= 0:
+        raise ValueError("Installments must be a positive integer")
+    return principal, rate, installments
+
+
+def amortization_schedule(
+    principal: float,
+    interest_rate: float,
+    installments: int,
+    first_due_date: datetime
+) -> List[dict]:
+    """
+    Equal-installment schedule for a flat-rate loan, the same terms the
+    repayment page uses: total = principal * (1 + rate / 100), split evenly.
+    The last installment absorbs rounding so the schedule sums to the total.
+
+    Args:
+        principal: Original loan amount
+        interest_rate: Flat interest over the life of the loan, in percent
+        installments: Number of monthly installments
+        first_due_date: Due date of the first installment (the loan's due_date)
+
+    Returns:
+        list: One dict per installment with number, due_date, principal, interest, amount and balance
+    """
+    rows = _installment_rows(principal, 1 + interest_rate / 100, installments)
+    return _with_due_dates(rows, _due_dates(to_day(first_due_date), installments))
+
+
+def _installment_rows(principal, growth, installments):
+    total = round(principal * growth, 2)
+    installment = round(total / installments, 2)
+    principal_part = round(principal / installments, 2)
+
+    rows = []
+    balance = total
+    for number in range(1, installments + 1):
+        last = number == installments
+        amount = round(balance, 2) if last else installment
+        principal_paid = round(principal - principal_part * (installments - 1), 2) if last else principal_part
+        balance = round(balance - amount, 2)
+        rows.append({
+            "number": number,
+            "principal": principal_paid,
+            "interest": round(amount - principal_paid, 2),
+            "amount": amount,
+            "balance": balance
+        })
+    return rows
+
+
+def _due_dates(first_due_day, installments):
+    return [day_to_str(add_months(first_due_day, k)) for k in range(installments)]
+
+
+def _with_due_dates(rows, due_dates):
+    return [{"number": row["number"], "due_date": due_date, **row} for row, due_date in zip(rows, due_dates)]
+
+
+def bulk_schedules(loans: Iterable[Tuple[str, dict]]) -> Dict[str, List[dict]]:
+    """
+    Schedules for many loans at once. Loans are grouped by their terms, so
+    the growth factor is computed once per (rate, installments) group, the
+    installment amounts once per distinct principal in a group and the due
+    dates once per distinct first due day; each loan then only pairs the
+    shared rows with its dates. Gives the same rows as amortization_schedule.
+
+    Args:
+        loans: (loan_id, loan document) pairs
+
+    Returns:
+        dict: loan_id -> schedule; loans with invalid terms or no due_date are left out
+    """
+    groups = {}
+    for loan_id, loan_data in loans:
+        try:
+            principal, rate, installments = loan_terms(loan_data)
+            first_due_day = to_day(loan_data["due_date"])
+        except (KeyError, ValueError, TypeError) as e:
+            print(f"Skipping schedule for loan {loan_id}: {str(e)}")
+            continue
+        groups.setdefault((rate, installments), []).append((loan_id, principal, first_due_day))
+
+    schedules = {}
+    for (rate, installments), members in groups.items():
+        growth = 1 + rate / 100
+        rows_by_principal = {}
+        dates_by_day = {}
+        for loan_id, principal, first_due_day in members:
+            rows = rows_by_principal.get(principal)
+            if rows is None:
+                rows = rows_by_principal[principal] = _installment_rows(principal, growth, installments)
+            due_dates = dates_by_day.get(first_due_day)
+            if due_dates is None:
+                due_dates = dates_by_day[first_due_day] = _due_dates(first_due_day, installments)
+            schedules[loan_id] = _with_due_dates(rows, due_dates)
+    return schedules
+
+
+def initial_snapshot(loan_data: dict) -> dict:
+    principal, rate, installments = loan_terms(loan_data)
+    total = round(principal * (1 + rate / 100), 2)
+    return {
+        "total": total,
+        "paid": 0.0,
+        "outstanding": total,
+        "installments": installments,
+        "installment_amount": round(total / installments, 2),
+        "installments_paid": 0,
+        "entries": 0,
+        "last_payment_at": None
+    }
+
+
+def apply_payment(snapshot: dict, amount: float, paid_at: datetime) -> dict:
+    """Advance a running balance snapshot by one payment without replaying the ledger."""
+    # NaN compares false with everything and would otherwise settle the loan
+    if not math.isfinite(amount) or amount <= 0:
+        raise ValueError("Payment amount must be a positive number")
+    if amount - snapshot["outstanding"] > 0.005:
+        raise ValueError(f"Payment exceeds outstanding balance of {snapshot['outstanding']}")
+    paid = round(snapshot["paid"] + amount, 2)
+    outstanding = round(max(0.0, snapshot["total"] - paid), 2)
+    if outstanding == 0:
+        installments_paid = snapshot["installments"]
+    else:
+        installments_paid = int((paid + 0.005) // snapshot["installment_amount"])
+    return {
+        **snapshot,
+        "paid": paid,
+        "outstanding": outstanding,
+        "installments_paid": installments_paid,
+        "entries": snapshot["entries"] + 1,
+        "last_payment_at": paid_at
+    }
+
+
+@firestore.transactional
+def _record_payment(transaction, loan_ref, amount, tx_hash, now):
+    loan = loan_ref.get(transaction=transaction)
+    if not loan.exists:
+        raise LookupError("Loan not found")
+    loan_data = loan.to_dict()
+    if loan_data.get("status") not in ("approved", "repaid"):
+        raise ValueError("Only approved loans can be repaid")
+
+    snapshot = loan_data.get("repayment") or initial_snapshot(loan_data)
+    updated = apply_payment(snapshot, amount, now)
+
+    # Ledger entries are append-only; the sequence number doubles as the document id
+    entry_ref = loan_ref.collection("ledger").document(f"{updated['entries']:06d}")
+    transaction.create(entry_ref, {
+        "type": "payment",
+        "amount": round(amount, 2),
+        "tx_hash": tx_hash,
+        "balance_after": updated["outstanding"],
+        "created_at": now
+    })
+
+    changes = {"repayment": updated}
+    if updated["outstanding"] == 0:
+        changes["status"] = "repaid"
+        changes["repaid_at"] = now
+    transaction.update(loan_ref, changes)
+    return loan_data, updated
+
+
+def record_payment(
+    db: firestore.Client,
+    uid: str,
+    loan_id: str,
+    amount: float,
+    tx_hash: Optional[str] = None
+) -> Tuple[dict, dict]:
+    """
+    Append a payment to a loan's ledger and advance its stored balance snapshot.
+
+    Returns:
+        tuple: (loan document before the payment, updated repayment snapshot)
+
+    Raises:
+        LookupError: If the loan does not exist
+        ValueError: If the loan is not approved or the amount is invalid
+    """
+    if not uid or not loan_id:
+        raise ValueError("User ID and Loan ID cannot be empty")
+    loan_ref = db.collection("users").document(uid).collection("loans").document(loan_id)
+    return _record_payment(db.transaction(), loan_ref, float(amount), tx_hash, datetime.now(timezone.utc))
+
+
+def amount_owed(loan_data: dict, current_date: DateLike) -> dict:
+    """
+    What a borrower owes today, from the stored repayment snapshot: the
+    outstanding balance plus the overdue penalty counted from the first
+    unpaid installment. Repaid loans owe nothing and are never overdue.
+
+    Returns:
+        dict: outstanding, next_due_day (UTC day number or None), months_overdue, total_due
+    """
+    snapshot = loan_data.get("repayment") or initial_snapshot(loan_data)
+    outstanding = snapshot["outstanding"]
+    if outstanding <= 0 or loan_data.get("status") == "repaid":
+        return {"outstanding": 0.0, "next_due_day": None, "months_overdue": 0, "total_due": 0.0}
+
+    # Installment k falls due k - 1 months after the loan's due_date
+    installments_paid = min(snapshot["installments_paid"], snapshot["installments"] - 1)
+    next_due_day = add_months(to_day(loan_data["due_date"]), installments_paid)
+    months_overdue = overdue_months(next_due_day, to_day(current_date))
+    return {
+        "outstanding": outstanding,
+        "next_due_day": next_due_day,
+        "months_overdue": months_overdue,
+        "total_due": total_due_for_months(outstanding, months_overdue)
+    }
+
+
+def final_due_day(loan_data: dict) -> int:
+    """UTC day number the last installment falls due, k - 1 months after due_date for k installments."""
+    _, _, installments = loan_terms(loan_data)
+    return add_months(to_day(loan_data["due_date"]), installments - 1)
+
+
+def repaid_on_time(loan_data: dict, repaid_at: DateLike) -> bool:
+    """Whether a loan settled on repaid_at met its schedule; loans without a due date count as on time."""
+    if not loan_data.get("due_date"):
+        return True
+    return to_day(repaid_at) <= final_due_day(loan_data)
+
+
+def loan_schedule(loan_data: dict, current_date: datetime) -> dict:
+    """Schedule, running balance and overdue total for one loan document."""
+    principal, rate, installments = loan_terms(loan_data)
+    due_date = _as_datetime(loan_data["due_date"])
+    snapshot = loan_data.get("repayment") or initial_snapshot(loan_data)
+
+    schedule = amortization_schedule(principal, rate, installments, due_date)
+    next_installment = next((row for row in schedule if row["number"] > snapshot["installments_paid"]), None)
+
+    # Overdue penalties follow the existing rule, applied to what is still outstanding
+    owed = amount_owed(loan_data, current_date)
+
+    return {
+        "principal": principal,
+        "interest_rate": rate,
+        "installments": installments,
+        "schedule": schedule,
+        "paid": snapshot["paid"],
+        "outstanding": snapshot["outstanding"],
+        "installments_paid": snapshot["installments_paid"],
+        "next_installment": next_installment,
+        "total_due_now": owed["total_due"],
+        "status": loan_data.get("status", "unknown")
+    }
+
+
+def _as_datetime(value) -> datetime:
+    if isinstance(value, str):
+        return datetime.strptime(value, "%Y-%m-%d").replace(tzinfo=timezone.utc)
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value
@@ -0,0 +1,202 @@
+import time
+from typing import Callable, Union
+
+from flask import Flask, g, has_request_context, jsonify
+from firebase_admin import firestore
+
+from utils.market_stats import offer_increments, stats_ref, get_market_stats
+from utils.repayment import record_payment
+from utils.trust_score import apply_event, apply_event_async
+
+
+class ReadBudgetExceeded(Exception):
+    pass
+
+
+class FirestoreInstrumentation:
+    """
+    Per-request Firestore accounting. Every repository call records its reads,
+    writes and round trips on `flask.g`; totals are returned as
+    X-Firestore-* response headers, requests over the read budget are logged
+    (or rejected when enforce=True) and slow calls are logged individually.
+    Calls made outside a request (background threads, CLIs) are only timed.
+
+    Stores that talk to Firestore directly (idempotency keys, shared rate
+    limits, the extraction store) count their calls through `call(...,
+    enforce=False)`: they never raise themselves, but once a request is over
+    budget every later repository call does. A rejected request is answered
+    with 503 even if its route caught the exception.
+    """
+
+    def __init__(self):
+        self.read_budget = 50
+        self.slow_query_ms = 500.0
+        self.enforce = False
+
+    def init_app(self, app: Flask, read_budget: int = 50, slow_query_ms: float = 500.0,
+                 enforce: bool = False) -> None:
+        self.read_budget = read_budget
+        self.slow_query_ms = slow_query_ms
+        self.enforce = enforce
+
+        @app.errorhandler(ReadBudgetExceeded)
+        def read_budget_exceeded(e):
+            return _budget_response(str(e))
+
+        @app.after_request
+        def report_firestore_usage(response):
+            stats = g.get("firestore_stats")
+            if stats and stats["rejected"]:
+                # Routes catch Exception and would otherwise answer 500 with the error details
+                response = _budget_response(f"Request exceeded Firestore read budget of {self.read_budget}")
+            if stats:
+                response.headers["X-Firestore-Reads"] = str(stats["reads"])
+                response.headers["X-Firestore-Writes"] = str(stats["writes"])
+                response.headers["X-Firestore-Round-Trips"] = str(stats["round_trips"])
+            return response
+
+    def call(self, label: str, fn: Callable, reads: Union[int, Callable] = 0, writes: int = 0,
+             enforce: bool = True):
+        """Run one Firestore round trip and record it; `reads` may be a function of the result."""
+        started = time.perf_counter()
+        result = fn()
+        if callable(reads):
+            reads = reads(result)
+        self.record(label, reads, writes, time.perf_counter() - started, enforce=enforce)
+        return result
+
+    def record(self, label: str, reads: int, writes: int, elapsed: float, enforce: bool = True) -> None:
+        elapsed_ms = elapsed * 1000
+        if elapsed_ms > self.slow_query_ms:
+            print(f"Slow Firestore call {label}: {elapsed_ms:.0f}ms")
+        if not has_request_context():
+            return
+
+        stats = g.setdefault("firestore_stats", {"reads": 0, "writes": 0, "round_trips": 0,
+                                                 "over_budget": False, "rejected": False})
+        stats["reads"] += reads
+        stats["writes"] += writes
+        stats["round_trips"] += 1
+        if stats["reads"] <= self.read_budget:
+            return
+        if not stats["over_budget"]:
+            stats["over_budget"] = True
+            print(f"Firestore read budget exceeded ({stats['reads']} > {self.read_budget}) at {label}")
+        if self.enforce and enforce:
+            stats["rejected"] = True
+            raise ReadBudgetExceeded(f"Request exceeded Firestore read budget of {self.read_budget}")
+
+
+def _budget_response(message):
+    response = jsonify({"error": message})
+    response.status_code = 503
+    return response
+
+
+instrumentation = FirestoreInstrumentation()
+
+
+class _Repo:
+    def __init__(self, db: firestore.Client):
+        self.db = db
+
+    def _call(self, label: str, fn: Callable, reads: Union[int, Callable] = 0, writes: int = 0):
+        return instrumentation.call(label, fn, reads=reads, writes=writes)
+
+    def _get(self, label, ref):
+        return self._call(label, ref.get, reads=1)
+
+    def _stream(self, label, query):
+        # A query is billed at least one read even when it matches nothing
+        return self._call(label, lambda: list(query.stream()), reads=lambda docs: max(1, len(docs)))
+
+
+class UserRepo(_Repo):
+    def ref(self, uid):
+        return self.db.collection("users").document(uid)
+
+    def get(self, uid):
+        return self._get("users.get", self.ref(uid))
+
+    def update_profile(self, uid, data):
+        return self._call("users.set", lambda: self.ref(uid).set(data, merge=True), writes=1)
+
+    def gov_record(self, pan_number):
+        return self._get("gov_records.get", self.db.collection("gov_records").document(pan_number))
+
+    def apply_trust_event(self, uid, event, extra=None, **payload):
+        # One transactional read of the user document plus one write
+        return self._call(f"trust_score.{event}",
+                          lambda: apply_event(self.db, uid, event, extra=extra, **payload), reads=1, writes=1)
+
+    def apply_trust_event_async(self, uid, event, **payload):
+        apply_event_async(self.db, uid, event, **payload)
+
+
+class LoanRepo(_Repo):
+    def collection(self, uid):
+        return self.db.collection("users").document(uid).collection("loans")
+
+    def ref(self, uid, loan_id):
+        return self.collection(uid).document(loan_id)
+
+    def get(self, uid, loan_id):
+        return self._get("loans.get", self.ref(uid, loan_id))
+
+    def list_for_user(self, uid):
+        return self._stream("loans.list", self.collection(uid))
+
+    def add(self, uid, loan_data):
+        return self._call("loans.add", lambda: self.collection(uid).add(loan_data), writes=1)
+
+    def update(self, uid, loan_id, changes):
+        return self._call("loans.update", lambda: self.ref(uid, loan_id).update(changes), writes=1)
+
+    def record_payment(self, uid, loan_id, amount, tx_hash=None):
+        # Transaction: read the loan, create a ledger entry, update the snapshot
+        return self._call("loans.record_payment",
+                          lambda: record_payment(self.db, uid, loan_id, amount, tx_hash), reads=1, writes=2)
+
+    def pending_loans(self):
+        """
+        Pending loans of all users as (uid, loan) in one collection-group query
+        (same index exemption as the borrower feed); prefer the feed for hot paths.
+        """
+        query = self.db.collection_group("loans").where("status", "==", "pending")
+        for loan in self._stream("loans.pending", query):
+            yield loan.reference.parent.parent.id, loan
+
+
+class OfferRepo(_Repo):
+    def lender_ref(self, uid):
+        return self.db.collection("lenders").document(uid)
+
+    def register_lender(self, uid, lender_data):
+        info_ref = self.lender_ref(uid).collection("info").document("metadata")
+        return self._call("lenders.register", lambda: info_ref.set(lender_data), writes=1)
+
+    def add_offer(self, uid, offer_data):
+        offer_ref = self.lender_ref(uid).collection("offers").document()
+        try:
+            increments = offer_increments(offer_data)
+        except Exception as e:
+            # The offer is still written; `python -m utils.market_stats rebuild` restores the stats
+            print(f"Failed to fold offer into market stats: {str(e)}")
+            increments = None
+
+        # Write the offer and fold it into the market statistics atomically
+        def commit():
+            batch = self.db.batch()
+            batch.set(offer_ref, offer_data)
+            if increments:
+                batch.set(stats_ref(self.db), increments, merge=True)
+            batch.commit()
+            return offer_ref
+
+        return self._call("offers.add", commit, writes=2 if increments else 1)
+
+    def list_for_lender(self, uid):
+        return self._stream("offers.list", self.lender_ref(uid).collection("offers"))
+
+    def market_stats(self):
+        return self._call("market.stats", lambda: get_market_stats(self.db), reads=1)
@@ -0,0 +1,235 @@
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Optional
+
+from firebase_admin import firestore
+
+from utils.repayment import amount_owed, repaid_on_time
+
+# Component caps; identity + financial + repayment add up to 100 as described in the README
+IDENTITY_MAX = 15
+FINANCIAL_MAX = 60
+REPAYMENT_MAX = 25
+# A passed face match is a small bonus on top, the total is still capped at 100
+FACE_BONUS = 5
+
+ON_TIME_POINTS = 5
+LATE_POINTS = 2
+OVERDUE_PENALTY = 10
+
+EVENTS = ("identity_verified", "financial_verified", "face_verified", "loan_repaid", "loan_overdue")
+
+_event_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="trust-score")
+
+
+def repayment_score(outcomes: dict) -> int:
+    """Score 0-25 from a loan_id -> "on_time" | "late" | "overdue" map."""
+    values = list(outcomes.values())
+    earned = min(REPAYMENT_MAX, ON_TIME_POINTS * values.count("on_time") + LATE_POINTS * values.count("late"))
+    return max(0, earned - OVERDUE_PENALTY * values.count("overdue"))
+
+
+def compute_current(trust_score: dict) -> int:
+    """Combine the stored components of a `trust_score` map into the 0-100 score."""
+    identity = min(IDENTITY_MAX, trust_score.get("identity_score", 0))
+    financial = min(FINANCIAL_MAX, trust_score.get("financial_score", 0))
+    repayment = repayment_score(trust_score.get("repayment_outcomes", {}))
+    face = FACE_BONUS if trust_score.get("face_verified") else 0
+    return min(100, identity + financial + repayment + face)
+
+
+def _apply(trust_score: dict, event: str, payload: dict) -> dict:
+    """Return the component fields changed by one event."""
+    if event == "identity_verified":
+        return {"identity_score": payload["score"]}
+    if event == "financial_verified":
+        return {"financial_score": payload["score"]}
+    if event == "face_verified":
+        return {"face_verified": bool(payload["match"])}
+    outcomes = dict(trust_score.get("repayment_outcomes", {}))
+    if event == "loan_repaid":
+        outcomes[payload["loan_id"]] = "on_time" if payload["on_time"] else "late"
+    elif event == "loan_overdue":
+        outcomes.setdefault(payload["loan_id"], "overdue")
+    return {"repayment_outcomes": outcomes, "repayment_score": repayment_score(outcomes)}
+
+
+@firestore.transactional
+def _apply_in_transaction(transaction, user_ref, event, payload, extra):
+    snapshot = user_ref.get(transaction=transaction)
+    trust_score = (snapshot.to_dict() or {}).get("trust_score", {}) if snapshot.exists else {}
+
+    changes = _apply(trust_score, event, payload)
+    merged = {**trust_score, **changes}
+    current = compute_current(merged)
+    transaction.set(user_ref, {
+        "trust_score": {
+            **(extra or {}),
+            **changes,
+            "current": current,
+            "updated_at": firestore.SERVER_TIMESTAMP
+        }
+    }, merge=True)
+    return {**merged, "current": current}
+
+
+def apply_event(db: firestore.Client, uid: str, event: str, extra: Optional[dict] = None, **payload) -> dict:
+    """
+    Incrementally update one component of `users/{uid}.trust_score` and
+    recompute `current` from the stored components in a single transaction.
+
+    Args:
+        db: Firestore client
+        uid: User ID
+        event: One of EVENTS
+        extra: Additional trust_score fields written in the same transaction (history entries, timestamps)
+        payload: Event data (score, match, loan_id, on_time)
+
+    Returns:
+        dict: The updated trust_score map (server timestamps excluded)
+
+    Raises:
+        ValueError: If the event is unknown or uid is empty
+    """
+    if not uid:
+        raise ValueError("User ID cannot be empty")
+    if event not in EVENTS:
+        raise ValueError(f"Unknown trust score event: {event}")
+
+    user_ref = db.collection("users").document(uid)
+    return _apply_in_transaction(db.transaction(), user_ref, event, payload, extra)
+
+
+def apply_event_async(db: firestore.Client, uid: str, event: str, **payload) -> None:
+    """Fire-and-forget variant for routes whose response does not need the new score."""
+    def run():
+        try:
+            apply_event(db, uid, event, **payload)
+        except Exception as e:
+            print(f"Trust score update failed for {uid} ({event}): {str(e)}")
+    _event_executor.submit(run)
+
+
+def loan_outcome(loan_data: dict, now: datetime) -> Optional[str]:
+    """
+    Classify a loan for the repayment component, or None if it doesn't count
+    yet. Uses the same rules as the live events: a repaid loan is on time if
+    it was settled by its last installment's due date, and an approved loan
+    is overdue only when its first unpaid installment is.
+    """
+    if not loan_data.get("due_date"):
+        return "on_time" if loan_data.get("status") == "repaid" else None
+    try:
+        if loan_data.get("status") == "repaid":
+            repaid_at = loan_data.get("repaid_at")
+            return "on_time" if repaid_at is None or repaid_on_time(loan_data, repaid_at) else "late"
+        if loan_data.get("status") == "approved" and amount_owed(loan_data, now)["months_overdue"] > 0:
+            return "overdue"
+    except (ValueError, KeyError, TypeError) as e:
+        print(f"Skipping loan with invalid terms in trust score: {str(e)}")
+    return None
+
+
+def recompute_user(db: firestore.Client, user_snapshot, now: Optional[datetime] = None) -> int:
+    """Rebuild every component of one user's trust score from Firestore and store it."""
+    now = now or datetime.now(timezone.utc)
+    trust_score = (user_snapshot.to_dict() or {}).get("trust_score", {})
+
+    outcomes = {}
+    for loan in user_snapshot.reference.collection("loans").stream():
+        outcome = loan_outcome(loan.to_dict(), now)
+        if outcome:
+            outcomes[loan.id] = outcome
+
+    components = {**trust_score, "repayment_outcomes": outcomes}
+    current = compute_current(components)
+    user_snapshot.reference.set({
+        "trust_score": {
+            "repayment_outcomes": outcomes,
+            "repayment_score": repayment_score(outcomes),
+            "current": current,
+            "updated_at": firestore.SERVER_TIMESTAMP
+        }
+    }, merge=True)
+    return current
+
+
+def backfill(db: firestore.Client, chunk_size: int = 200, workers: int = 8,
+             checkpoint_path: str = "trust_score_backfill.json") -> dict:
+    """
+    Recompute trust scores for all users in chunks ordered by document id,
+    scoring each chunk in parallel and checkpointing after every chunk so an
+    interrupted run resumes where it stopped.
+
+    Returns:
+        dict: users scored, failures, elapsed seconds and users scored per second
+    """
+    checkpoint = {}
+    if os.path.exists(checkpoint_path):
+        with open(checkpoint_path) as f:
+            checkpoint = json.load(f)
+
+    users = db.collection("users")
+    base_query = users.order_by("__name__").limit(chunk_size)
+    cursor = users.document(checkpoint["last_uid"]).get() if checkpoint.get("last_uid") else None
+    scored = checkpoint.get("scored", 0)
+    failed = checkpoint.get("failed", 0)
+    started = time.perf_counter()
+    run_scored = 0
+
+    def score(snapshot):
+        try:
+            recompute_user(db, snapshot)
+            return True
+        except Exception as e:
+            print(f"Backfill failed for {snapshot.id}: {str(e)}")
+            return False
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while True:
+            query = base_query.start_after(cursor) if cursor else base_query
+            chunk = list(query.stream())
+            if not chunk:
+                break
+
+            results = list(executor.map(score, chunk))
+            run_scored += results.count(True)
+            scored += results.count(True)
+            failed += results.count(False)
+            cursor = chunk[-1]
+
+            with open(checkpoint_path, "w") as f:
+                json.dump({"last_uid": cursor.id, "scored": scored, "failed": failed}, f)
+            elapsed = time.perf_counter() - started
+            print(f"Scored {scored} users ({failed} failed), {run_scored / elapsed:.1f} users/s")
+
+    elapsed = time.perf_counter() - started
+    return {
+        "scored": scored,
+        "failed": failed,
+        "elapsed_seconds": round(elapsed, 2),
+        "users_per_second": round(run_scored / elapsed, 2) if elapsed else 0.0
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recompute trust scores for all users")
+    parser.add_argument("--chunk-size", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--checkpoint", default="trust_score_backfill.json")
+    parser.add_argument("--reset", action="store_true", help="Ignore an existing checkpoint")
+    args = parser.parse_args()
+
+    if args.reset and os.path.exists(args.checkpoint):
+        os.remove(args.checkpoint)
+
+    # Standalone client: importing app would start its background workers
+    from dotenv import load_dotenv
+    from utils.firebase_client import init_firestore
+    load_dotenv()
+    db = init_firestore()
+    print(json.dumps(backfill(db, args.chunk_size, args.workers, args.checkpoint), indent=2))